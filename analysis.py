@@ -0,0 +1,343 @@
+"""
+Multi-core position analysis on a process pool.
+
+Searches are CPU-bound, so threads of the Flask server cannot spread them
+over more than one core. The AnalysisService runs them in a
+ProcessPoolExecutor instead, using root move splitting: the legal moves of
+the position are dealt out to the worker processes, each worker scores its
+share with engine.Searcher.analyse (exact score per move), and the lines are
+merged into a multi-PV result.
+
+Request threads never wait for a search. They submit a job, get its id back
+immediately and poll for the result:
+
+    job_id = service.submit(board, time_limit=2.0, multipv=3)
+    service.poll(job_id)    # {"status": "running", ...} then {"status": "done", ...}
+    service.cancel(job_id)
+
+The number of unfinished jobs is bounded (AnalysisQueueFull beyond that),
+every job has a hard deadline, and cancelling a job stops its running
+workers through a flag in shared memory.
+
+The pool also takes the app's other CPU-bound work off the request
+workers, whose event loop (under gevent) or GIL it would otherwise hold:
+the engine's move search and batch position analysis. Their callers wait
+for the result, but an idle greenlet or thread waits without the CPU:
+
+    result = service.search(board, time_limit=1.0)          # engine.SearchResult
+    for result in service.analyze_positions(positions): ...  # in order, as they finish
+
+Workers set up their boards with the app's tablebase and opening book.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+
+from board import TwoHSChessBoard
+import engine
+from opening_book import open_book
+from tablebase import Tablebase
+
+DEFAULT_MAX_JOBS = 16
+DEFAULT_MAX_TIME = 10.0   # seconds
+DEFAULT_MAX_NODES = 2000000
+# Positions of a batch analysis sent to a worker at once
+ANALYZE_CHUNK_SIZE = 64
+# Finished jobs can be polled for this long (seconds)
+RESULT_TTL = 5 * 60
+
+# Set in each worker process by _init_worker: one cancellation flag per job slot
+_cancel_flags = None
+
+
+class AnalysisQueueFull(Exception):
+    """Raised by submit() when the maximum number of unfinished jobs is reached."""
+
+
+def _init_worker(cancel_flags, tablebase_dir=None, book_path=None):
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+    # Opened in each worker, whether the pool forks or spawns it
+    TwoHSChessBoard.tablebase = Tablebase(tablebase_dir) if tablebase_dir else None
+    TwoHSChessBoard.opening_book = open_book(book_path)
+
+
+def _analyse_chunk(fen, history, ucis, deadline, node_limit, slot):
+    """
+    Worker process entry point: analyse some root moves of a position.
+
+    deadline is absolute (time.time()), so a chunk that waited in the pool's
+    queue gets only what is left of the job's time.
+    """
+    time_limit = deadline - time.time()
+    if time_limit <= 0 or _cancel_flags[slot]:
+        return [], 0
+    searcher = engine.Searcher(time_limit=time_limit, node_limit=node_limit,
+                               should_stop=lambda: _cancel_flags[slot])
+    lines = searcher.analyse(chess.Board(fen), history=history,
+                             moves=[chess.Move.from_uci(uci) for uci in ucis])
+    return [(line.move.uci(), line.is_kings_step, line.score, line.depth,
+             [move.uci() for move in line.pv]) for line in lines], searcher.nodes
+
+
+def _search(fen, history, deadline, node_limit):
+    """Worker process entry point: engine search of a position, until deadline."""
+    # A search that waited in the queue gets what is left, but always finishes
+    # an iteration, so it has a move
+    searcher = engine.Searcher(time_limit=max(0.01, deadline - time.time()), node_limit=node_limit,
+                               tablebase=TwoHSChessBoard.tablebase)
+    return searcher.search(chess.Board(fen), history=history)
+
+
+def _analyze_chunk(positions, max_moves):
+    """Worker process entry point: TwoHSChessBoard.analyze_positions of a chunk."""
+    return list(TwoHSChessBoard.analyze_positions(positions, max_moves=max_moves))
+
+
+class _Job:
+    def __init__(self, job_id, slot, fen, multipv):
+        self.job_id = job_id
+        self.slot = slot
+        self.fen = fen
+        self.multipv = multipv
+        self.status = 'queued'
+        self.error = None
+        self.futures = []
+        self.chunks = []          # results of the finished chunks
+        self.started = time.monotonic()
+        self.finished = None
+
+
+class AnalysisService:
+    """Runs analysis jobs on a pool of worker processes."""
+
+    def __init__(self, max_workers=None, max_jobs=DEFAULT_MAX_JOBS,
+                 max_time=DEFAULT_MAX_TIME, max_nodes=DEFAULT_MAX_NODES,
+                 tablebase_dir=None, book_path=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+        self.tablebase_dir = tablebase_dir
+        self.book_path = book_path
+        self._cancel_flags = multiprocessing.Array('b', max_jobs, lock=False)
+        self._free_slots = list(range(max_jobs))
+        self._jobs = OrderedDict()
+        # Reentrant: cancelling a future runs its done callback synchronously
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def _pool(self):
+        # Started on first use, so importing the app does not fork workers
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 initializer=_init_worker,
+                                                 initargs=(self._cancel_flags, self.tablebase_dir,
+                                                           self.book_path))
+        return self._executor
+
+    def search(self, board, time_limit=1.0, node_limit=None, book=None):
+        """
+        engine.search of a TwoHSChessBoard on a worker process; waits for
+        and returns its SearchResult. A move from the opening book (book)
+        is answered at once, without the pool. The limits are the caller's.
+        """
+        result = engine.book_move(book, board.zobrist_key) if book is not None else None
+        if result is not None:
+            return result
+        future = self._pool().submit(_search, board.fen(), list(board.position_history),
+                                     time.time() + time_limit, node_limit)
+        return future.result()
+
+    def analyze_positions(self, positions, max_moves=None, chunk_size=ANALYZE_CHUNK_SIZE):
+        """
+        TwoHSChessBoard.analyze_positions on the worker processes: positions
+        are read and sent in chunks, up to one chunk per worker is analysed
+        at once, and the results are yielded in order. If reading positions
+        raises ValueError, the results before it are yielded first.
+        """
+        pool = self._pool()
+        pending = deque()
+        chunk = []
+        try:
+            try:
+                for item in positions:
+                    chunk.append(item)
+                    if len(chunk) == chunk_size:
+                        pending.append(pool.submit(_analyze_chunk, chunk, max_moves))
+                        chunk = []
+                        if len(pending) > self.max_workers:
+                            yield from pending.popleft().result()
+            except ValueError as e:
+                error = e
+            else:
+                error = None
+            if chunk:
+                pending.append(pool.submit(_analyze_chunk, chunk, max_moves))
+            while pending:
+                yield from pending.popleft().result()
+            if error is not None:
+                raise error
+        finally:
+            # The client went away: drop the chunks not started yet
+            for future in pending:
+                future.cancel()
+
+    def submit(self, board, time_limit=1.0, node_limit=None, multipv=1):
+        """
+        Queue an analysis of a TwoHSChessBoard position and return its job id.
+
+        time_limit (seconds) and node_limit (per worker) are capped by the
+        service limits. Raises AnalysisQueueFull when too many jobs are
+        unfinished.
+        """
+        time_limit = max(0.01, min(time_limit, self.max_time))
+        node_limit = max(1, min(node_limit or self.max_nodes, self.max_nodes))
+        ucis = [move.uci() for move in board.legal_moves()]
+
+        with self._lock:
+            self._purge()
+            if not self._free_slots:
+                raise AnalysisQueueFull("Too many analysis jobs in progress")
+            slot = self._free_slots.pop()
+            self._cancel_flags[slot] = 0
+            job = _Job(uuid.uuid4().hex, slot, board.fen(), multipv)
+            self._jobs[job.job_id] = job
+
+            if not ucis:
+                self._finish(job, 'done')
+                return job.job_id
+
+            # Deal the moves round-robin so every worker gets a similar mix
+            chunk_count = min(self.max_workers, len(ucis))
+            deadline = time.time() + time_limit
+            pool = self._pool()
+            for i in range(chunk_count):
+                future = pool.submit(_analyse_chunk, job.fen, list(board.position_history),
+                                     ucis[i::chunk_count], deadline, node_limit, slot)
+                job.futures.append(future)
+            for future in job.futures:
+                future.add_done_callback(lambda future, job=job: self._chunk_done(job, future))
+        return job.job_id
+
+    def _chunk_done(self, job, future):
+        with self._lock:
+            if job.finished is not None:
+                return
+            if future.cancelled():
+                pass
+            elif future.exception() is not None:
+                job.error = str(future.exception())
+                self._cancel_flags[job.slot] = 1
+                for other in job.futures:
+                    other.cancel()
+            else:
+                job.chunks.append(future.result())
+            if all(f.done() for f in job.futures):
+                if job.error is not None:
+                    self._finish(job, 'failed')
+                elif job.status == 'cancelled':
+                    self._finish(job, 'cancelled')
+                else:
+                    self._finish(job, 'done')
+
+    def _finish(self, job, status):
+        # Called with the lock held. Cancelling a chunk's siblings runs their
+        # callbacks right away, and one of them may have finished the job:
+        # its slot must be freed only once.
+        if job.finished is not None:
+            return
+        job.status = status
+        job.finished = time.monotonic()
+        self._free_slots.append(job.slot)
+
+    def poll(self, job_id):
+        """Return the job's status and, once done, its result; None for unknown ids."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == 'queued' and any(f.running() or f.done() for f in job.futures):
+                job.status = 'running'
+            elapsed = (job.finished or time.monotonic()) - job.started
+            response = {"jobId": job.job_id, "status": job.status, "fen": job.fen,
+                        "elapsed": round(elapsed, 3)}
+            if job.status == 'failed':
+                response["error"] = job.error
+            if job.status == 'done':
+                response.update(self._merge(job, elapsed))
+            return response
+
+    def cancel(self, job_id):
+        """Stop a job; returns False for unknown ids. Finished jobs are unaffected."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if job.finished is None:
+                job.status = 'cancelled'
+                self._cancel_flags[job.slot] = 1
+                for future in job.futures:
+                    future.cancel()
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.finished is None:
+                    self._cancel_flags[job.slot] = 1
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _merge(self, job, elapsed):
+        """Combine the lines of all chunks into one multi-PV result."""
+        lines = [line for chunk_lines, _ in job.chunks for line in chunk_lines]
+        nodes = sum(chunk_nodes for _, chunk_nodes in job.chunks)
+        lines.sort(key=lambda line: (line[3] > 0, line[2]), reverse=True)
+        lines = [{"move": uci, "isKingsStep": is_kings_step, "score": score, "depth": depth, "pv": pv}
+                 for uci, is_kings_step, score, depth, pv in lines[:job.multipv]]
+        return {
+            "bestMove": lines[0]["move"] if lines else None,
+            "score": lines[0]["score"] if lines else None,
+            "depth": lines[0]["depth"] if lines else 0,
+            "lines": lines,
+            "nodes": nodes,
+            "nps": int(nodes / elapsed) if elapsed > 0 else None
+        }
+
+    def _purge(self):
+        # Called with the lock held; drop finished jobs older than RESULT_TTL
+        now = time.monotonic()
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job.finished is not None and now - job.finished > RESULT_TTL:
+                del self._jobs[job_id]
+
+
+def create_analysis_service(tablebase_dir=None, book_path=None):
+    """
+    Build the analysis service configured by the environment:
+
+    ANALYSIS_WORKERS    worker processes (default: number of CPUs)
+    ANALYSIS_MAX_JOBS   unfinished jobs accepted at once
+    ANALYSIS_MAX_TIME   hard time limit of a job in seconds
+    ANALYSIS_MAX_NODES  hard node limit per worker and job
+
+    tablebase_dir and book_path are the app's tablebase and opening book,
+    opened by each worker.
+    """
+    return AnalysisService(
+        max_workers=int(os.environ.get('ANALYSIS_WORKERS', 0)) or None,
+        max_jobs=int(os.environ.get('ANALYSIS_MAX_JOBS', DEFAULT_MAX_JOBS)),
+        max_time=float(os.environ.get('ANALYSIS_MAX_TIME', DEFAULT_MAX_TIME)),
+        max_nodes=int(os.environ.get('ANALYSIS_MAX_NODES', DEFAULT_MAX_NODES)),
+        tablebase_dir=tablebase_dir,
+        book_path=book_path
+    )
@@ -1,570 +1,588 @@
-from flask import Flask, render_template, request, jsonify, session
-import chess
+from flask import Flask, render_template, request, session, g, Response, stream_with_context
+from flask import jsonify as flask_jsonify
+import json
 import os
+import uuid
+import gzip
+import codecs
+import re
+from flask_sock import Sock
+
+from board import TwoHSChessBoard, board_to_state, board_from_state
+from game_store import create_game_store
+from analysis import create_analysis_service, AnalysisQueueFull
+from ponder import create_ponder_service
+from tablebase import Tablebase
+from opening_book import open_book, DEFAULT_PATH as DEFAULT_BOOK_PATH
+import metrics
+from realtime import GameChannels, Connection, SpectatorHub, StateMessages, cooperative, error_message
 
 app = Flask(__name__)
 # For production, set a permanent secret key in your environment variables.
 # For development, a random key is fine.
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
 
-# Custom 2HS Chess Board: With Knights + Fixed Game Termination Detection
-class TwoHSChessBoard:
-    # Starting FEN with knights (standard chess starting position)
-    VARIANT_STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
-
-    def __init__(self, fen=VARIANT_STARTING_FEN):
-        self.board = chess.Board(fen)
-        # "King's Step" directions
-        self.kings_step_directions = [
-            (0, 1), (1, 1), (1, 0), (1, -1),
-            (0, -1), (-1, -1), (-1, 0), (-1, 1)
-        ]
-        # Store position history for repetition detection
-        self.position_history = []
-        self.update_position_history()
-        
-        # Cache for legal moves to avoid recalculation
-        self._legal_moves_cache = None
-        self._last_fen = None
-        
-        # Last move made for better UI highlighting
-        self.last_move = None
-        
-        # Game termination reason
-        self.termination_reason = None
-        
-        # Extended FEN information - additional flags for 2HS rules
-        # Currently no additional flags needed, but prepared for extensions
-        self.extended_fen_flags = {}
-    
-    def get_extended_fen(self):
-        """Get the extended FEN that includes 2HS Chess specific flags."""
-        base_fen = self.board.fen()
-        # If we have any custom flags to add, we can append them here
-        # For future extensions like super_pawns, variable castling, etc.
-        return base_fen
-
-    def update_position_history(self):
-        # Add current position to history for repetition detection
-        position_key = self.board.fen().split(' ')[0]  # Just the piece positions
-        self.position_history.append(position_key)
-        
-        # Prevent memory leak by limiting history size
-        # Keep only last 100 positions (sufficient for repetition detection)
-        # Threefold repetition needs only 3 occurrences, so 100 positions is more than enough
-        if len(self.position_history) > 100:
-            self.position_history = self.position_history[-100:]
-    
-    def _clear_cache(self):
-        """Clear the legal moves cache to prevent stale data."""
-        self._legal_moves_cache = None
-        self._last_fen = None
-    
-    def reset_position_history(self):
-        """Reset position history for a new game to prevent memory accumulation."""
-        self.position_history = []
-        self.update_position_history()
-        
-    def legal_moves(self):
-        """
-        Generates all legal moves for the current position, including standard chess
-        moves and custom "King's Step" moves. This is the single source of truth for move legality.
-        A move is legal if, and only if, it does not leave the player's king in check.
-        """
-        current_fen = self.board.fen()
-        if self._legal_moves_cache is not None and self._last_fen == current_fen:
-            return self._legal_moves_cache
-
-        legal_moves = []
-        
-        # 1. Generate standard pseudo-legal moves from python-chess
-        candidate_moves = list(self.board.pseudo_legal_moves)
-        
-        # 2. Generate "King's Step" pseudo-legal moves
-        for square in chess.SQUARES:
-            piece = self.board.piece_at(square)
-            # Any piece except King or Queen can perform a King's Step
-            if piece and piece.color == self.board.turn and piece.piece_type not in [chess.KING, chess.QUEEN]:
-                for dx, dy in self.kings_step_directions:
-                    file, rank = chess.square_file(square), chess.square_rank(square)
-                    new_file, new_rank = file + dx, rank + dy
-                    if 0 <= new_file < 8 and 0 <= new_rank < 8:
-                        to_sq = chess.square(new_file, new_rank)
-                        # The destination square must be empty
-                        if self.board.piece_at(to_sq) is None:
-                            candidate_moves.append(chess.Move(square, to_sq))
-                            
-        # 3. Validate all candidate moves by simulation
-        for move in set(candidate_moves): # Use set to handle duplicates
-            try:
-                # Create a temporary board to simulate the move
-                temp_board = self.board.copy()
-                temp_board.push(move)
-                
-                # A move is legal if the player's own king is NOT in check after the move.
-                # This single check correctly handles all check/pin-related rules.
-                king_square = temp_board.king(self.board.turn)
-                if not temp_board.is_attacked_by(not self.board.turn, king_square):
-                    legal_moves.append(move)
-            except Exception:
-                # Ignore fundamentally illegal moves that python-chess might raise errors on.
-                continue
+# Game state lives server-side; the session cookie only carries the game id.
+# Configure with GAME_STORE=memory|sqlite (see game_store.py). The SQLite
+# database is opened on the first request, not when the app is imported.
+game_store = create_game_store()
 
-        self._legal_moves_cache = legal_moves
-        self._last_fen = current_fen
-        return legal_moves
-
-    def get_move_info(self):
-        """Get information about valid moves for UI display."""
-        moves_info = {}
-        
-        # If in checkmate, return empty moves
-        if self.is_checkmate():
-            return {}
-        
-        # Get all legal moves including King's Step
-        legal_moves = self.legal_moves()
-        
-        # Group moves by origin square
-        for move in legal_moves:
-            from_sq = chess.square_name(move.from_square)
-            to_sq = chess.square_name(move.to_square)
-            entry = moves_info.setdefault(from_sq, {"moves": [], "captures": []})
-            
-            # Categorize as capture or regular move
-            if self.board.is_capture(move):
-                entry["captures"].append(to_sq)
-            else:
-                entry["moves"].append(to_sq)
-                
-        return moves_info
-
-    def is_move_valid(self, move_uci: str):
-        """
-        Checks if a move is valid by referencing the main legal_moves engine.
-        This ensures all rules are applied consistently from a single source of truth.
-        """
-        if self.is_game_over():
-            return False
-            
-        try:
-            move = chess.Move.from_uci(move_uci)
-            # A move is legal if and only if it exists in our main function's generated list.
-            return move in self.legal_moves()
-        except (ValueError, IndexError):
-            # Handle invalid UCI format or board errors.
-            return False
-
-    def make_move(self, move):
-        """Make a move on the board if it's valid."""
-        # First check if game is already over
-        if self.is_game_over():
-            return False
-            
-        # Verify the move is legal
-        if self.is_move_valid(move):
-            # Parse the move
-            chess_move = chess.Move.from_uci(move)
-            
-            # Save as last move for UI highlighting
-            self.last_move = chess_move
-            
-            # Execute the move
-            self.board.push(chess_move)
-            
-            # Clear the legal moves cache since the position changed
-            self._clear_cache()
-            
-            # Update position history for repetition detection
-            self.update_position_history()
-            
-            # Check if this move ended the game
-            if self.is_game_over():
-                if self.is_checkmate():
-                    self.termination_reason = "checkmate"
-                elif self.is_stalemate():
-                    self.termination_reason = "stalemate"
-                elif self.is_insufficient_material():
-                    self.termination_reason = "insufficient_material"
-                elif self.is_threefold_repetition():
-                    self.termination_reason = "threefold_repetition"
-                elif self.is_fifty_moves():
-                    self.termination_reason = "fifty_moves"
-            
-            return True
-        return False
-
-    def fen(self):
-        """Get the FEN of the current position."""
-        return self.board.fen()
-
-    def turn(self):
-        """Get the side to move."""
-        return self.board.turn
-
-    def is_check(self):
-        """Check if the current side to move is in check."""
-        return self.board.is_check()
-
-    def is_checkmate(self):
-        """Check if the current position is checkmate."""
-        # A position is checkmate when the king is in check and there are no legal moves
-        # Use all legal moves (including King's Step) for consistent detection
-        return self.board.is_check() and len(self.legal_moves()) == 0
-
-    def is_stalemate(self):
-        """Check if the current position is stalemate."""
-        # A position is stalemate when the king is not in check and there are no legal moves
-        # Use all legal moves (including King's Step) for consistent detection
-        return not self.board.is_check() and len(self.legal_moves()) == 0
-
-    def is_insufficient_material(self):
-        """Check if there's insufficient material to checkmate."""
-        # Use python-chess's built-in insufficient material detection
-        # which correctly handles standard chess rules
-        return self.board.is_insufficient_material()
-
-    def is_threefold_repetition(self):
-        """Check if the current position has occurred three times."""
-        current_position = self.board.fen().split(' ')[0]
-        return self.position_history.count(current_position) >= 3
-
-    def is_fifty_moves(self):
-        """Check if the fifty-move rule applies."""
-        # Check if the fifty-move rule applies (no captures or pawn moves in the last 50 moves)
-        return self.board.halfmove_clock >= 100  # 50 full moves = 100 half-moves
-
-    def is_game_over(self):
-        """Check if the game has ended."""
-        # 1. First check for checkmate (highest priority)
-        if self.is_checkmate():
-            return True
-            
-        # 2. Check for stalemate
-        if self.is_stalemate():
-            return True
-            
-        # 3. Check for draws
-        if (self.is_insufficient_material() or
-            self.is_threefold_repetition() or
-            self.is_fifty_moves()):
-            return True
-            
-        return False
-
-    def king(self, color):
-        """Get the square of the king of the given color."""
-        return self.board.king(color)
-
-    def is_kings_step_move(self, move):
-        """Determine if a move is a King's Step move."""
-        # Convert string move to Move object if necessary
-        if isinstance(move, str):
-            try:
-                move = chess.Move.from_uci(move)
-            except ValueError:
-                return False
-        
-        # If the move is in standard legal moves, it's not a King's Step
-        if move in self.board.legal_moves:
-            return False
-            
-        piece = self.board.piece_at(move.from_square)
-        if piece is None or piece.piece_type in [chess.KING, chess.QUEEN]:
-            return False
-            
-        # Calculate Manhattan distance
-        from_file = chess.square_file(move.from_square)
-        from_rank = chess.square_rank(move.from_square)
-        to_file = chess.square_file(move.to_square)
-        to_rank = chess.square_rank(move.to_square)
-        
-        # King's Step is one square in any direction
-        file_diff = abs(from_file - to_file)
-        rank_diff = abs(from_rank - to_rank)
-        
-        # Basic King's Step check
-        is_kings_step = file_diff <= 1 and rank_diff <= 1 and not (file_diff == 0 and rank_diff == 0)
-        
-        # For pawns, normal forward moves and captures aren't King's Step
-        if piece.piece_type == chess.PAWN:
-            direction = 1 if piece.color == chess.WHITE else -1
-            
-            # Normal forward move
-            if file_diff == 0 and (to_rank - from_rank) == direction:
-                return False
-                
-            # Initial two-square move
-            if file_diff == 0 and from_rank in [1, 6] and abs(to_rank - from_rank) == 2:
-                return False
-                
-            # Normal capture
-            if file_diff == 1 and (to_rank - from_rank) == direction:
-                return False
-        
-        # For knights, L-shape moves aren't King's Step
-        if piece.piece_type == chess.KNIGHT:
-            if (file_diff == 1 and rank_diff == 2) or (file_diff == 2 and rank_diff == 1):
-                return False
-        
-        # For bishops, diagonal moves aren't King's Step
-        if piece.piece_type == chess.BISHOP:
-            if file_diff == rank_diff:
-                return False
-        
-        # For rooks, horizontal and vertical moves aren't King's Step
-        if piece.piece_type == chess.ROOK:
-            if file_diff == 0 or rank_diff == 0:
-                return False
-        
-        # If it passed all the above checks and is within 1 square, it's a King's Step
-        return is_kings_step
-
-
-        
-    def get_pin_direction_and_attacker(self, square):
-        """Get the direction of the pin and the attacker's square for a pinned piece.
-        
-        Returns a tuple (file_dir, rank_dir, attacker_square) or None if not pinned.
-        """
-        piece = self.board.piece_at(square)
-        if piece is None:
-            return None
-            
-        color = piece.color
-        king_square = self.board.king(color)
-        
-        # Check if pinned using our main method
-        is_pinned, file_dir, rank_dir = self.is_pinned_against_king(square)
-        if not is_pinned:
-            return None
-            
-        # Look for the attacker in the direction from the piece away from the king
-        piece_file = chess.square_file(square)
-        piece_rank = chess.square_rank(square)
-        attacker_square = None
-        current_file = piece_file + file_dir
-        current_rank = piece_rank + rank_dir
-        
-        while 0 <= current_file <= 7 and 0 <= current_rank <= 7:
-            current_square = chess.square(current_file, current_rank)
-            current_piece = self.board.piece_at(current_square)
-            
-            if current_piece is not None:
-                # Check if this piece could be pinning our piece
-                if current_piece.color != color:
-                    # Horizontal or vertical pin
-                    if (file_dir != 0 and rank_dir == 0) or (file_dir == 0 and rank_dir != 0):
-                        if current_piece.piece_type in [chess.ROOK, chess.QUEEN]:
-                            attacker_square = current_square
-                            break
-                    # Diagonal pin
-                    elif file_dir != 0 and rank_dir != 0:
-                        if current_piece.piece_type in [chess.BISHOP, chess.QUEEN]:
-                            attacker_square = current_square
-                            break
-                
-                # If we hit any other piece first, there's no pin from this direction
-                break
-                
-            current_file += file_dir
-            current_rank += rank_dir
-            
-        return (file_dir, rank_dir, attacker_square) if attacker_square is not None else None
-    
-    def is_move_along_pin_line(self, move):
-        """Check if a move is along the pin line (connecting the king, piece, and attacker).
-        
-        If a piece is pinned, it can only move along the line of the pin.
-        """
-        from_square = move.from_square
-        to_square = move.to_square
-        
-        # Get pin information
-        pin_info = self.get_pin_direction_and_attacker(from_square)
-        if pin_info is None:
-            # Not pinned, any move is allowed
-            return True
-            
-        file_dir, rank_dir, attacker_square = pin_info
-        
-        # Calculate positions
-        king_square = self.board.king(self.board.piece_at(from_square).color)
-        king_file = chess.square_file(king_square)
-        king_rank = chess.square_rank(king_square)
-        to_file = chess.square_file(to_square)
-        to_rank = chess.square_rank(to_square)
-        
-        # For a move to be along the pin line, it must:
-        # 1. Be on the same rank, file, or diagonal as the king and piece
-        # 2. Be between the king and the attacker or beyond the king in the opposite direction
-        
-        # Check if the target is on the same line as the king
-        if file_dir == 0:  # Vertical pin
-            if to_file != king_file:
-                return False
-        elif rank_dir == 0:  # Horizontal pin
-            if to_rank != king_rank:
-                return False
-        else:  # Diagonal pin
-            # Check if on the same diagonal
-            if abs(to_file - king_file) != abs(to_rank - king_rank):
-                return False
-                
-            # Check if the direction matches
-            to_file_dir = 1 if king_file < to_file else -1
-            to_rank_dir = 1 if king_rank < to_rank else -1
-            
-            if to_file_dir != file_dir or to_rank_dir != rank_dir:
-                # Allow moves in the opposite direction (away from the attacker, behind the king)
-                if to_file_dir != -file_dir or to_rank_dir != -rank_dir:
-                    return False
-        
-        return True
+# Latency histograms, stage timings and counters for /metrics, and the
+# opt-in slow request log (SLOW_REQUEST_DIR, see metrics.py)
+request_metrics = metrics.create_request_metrics()
+# Long-lived connections, not requests to time
+UNTIMED_ROUTES = {'/ws/game', '/api/game/<game_id>/events'}
+
+def jsonify(*args, **kwargs):
+    """flask.jsonify, timed as the request's serialization stage."""
+    with metrics.stage('serialize'):
+        return flask_jsonify(*args, **kwargs)
+
+# JSON responses at least this large are gzipped for clients that accept it (0: never)
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 512))
+GZIP_LEVEL = 6
+
+# WebSocket play channel (see realtime.py); pings detect dead connections
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25}
+sock = Sock(app)
+game_channels = GameChannels()
+# Each spectator stream holds a thread unless the worker runs gevent, so
+# threaded servers allow only a few (SPECTATOR_MAX_STREAMS, 0: no limit)
+SPECTATOR_MAX_STREAMS = int(os.environ.get('SPECTATOR_MAX_STREAMS', 0 if cooperative() else 8))
+spectator_hub = SpectatorHub(max_streams=SPECTATOR_MAX_STREAMS)
+
+# Hard per-request budget of /api/engine/move; clients may ask for less, never more
+ENGINE_MAX_TIME = float(os.environ.get('ENGINE_MAX_TIME', 2.0))  # seconds
+ENGINE_MAX_NODES = int(os.environ.get('ENGINE_MAX_NODES', 200000))
+ENGINE_DEFAULT_TIME = min(1.0, ENGINE_MAX_TIME)
+# Endgame tablebases generated with tablebase.py, used by the engine and the
+# insufficient material rule if configured
+TABLEBASE_DIR = os.environ.get('TABLEBASE_DIR')
+tablebase = Tablebase(TABLEBASE_DIR) if TABLEBASE_DIR else None
+TwoHSChessBoard.tablebase = tablebase
+# Memory-mapped opening book (see opening_book.py), consulted before move generation
+OPENING_BOOK = os.environ.get('OPENING_BOOK', DEFAULT_BOOK_PATH)
+TwoHSChessBoard.opening_book = open_book(OPENING_BOOK)
+
+# Limits of one /api/analyze request
+ANALYZE_MAX_POSITIONS = int(os.environ.get('ANALYZE_MAX_POSITIONS', 10000))
+ANALYZE_MAX_MOVES = int(os.environ.get('ANALYZE_MAX_MOVES', 500))
+
+# Deep analysis runs on a process pool; request threads submit jobs and poll.
+# Engine moves and /api/analyze batches run there too, so that no search or
+# batch holds the worker's event loop (or GIL) while other requests wait.
+# Configure with ANALYSIS_WORKERS, ANALYSIS_MAX_JOBS, ... (see analysis.py).
+analysis_service = create_analysis_service(tablebase_dir=TABLEBASE_DIR, book_path=OPENING_BOOK)
+
+# Opt-in pondering of the replies to each game's position while its player
+# thinks; None unless PONDER_WORKERS is set, and under gevent (see ponder.py)
+ponder_service = create_ponder_service(cooperative=cooperative())
+
+def load_game_board(game_id, state):
+    """board_from_state for a stored game, with the positions pondered for it."""
+    board = board_from_state(state)
+    if ponder_service is not None:
+        board.pondered = ponder_service.pondered(game_id)
+    return board
 
 def get_board_from_session():
-    """Load board state from session or create a new one."""
-    if 'board_fen' not in session:
-        board = TwoHSChessBoard()
-        session['board_fen'] = board.fen()
-        session['position_history'] = board.position_history
-        session['last_move_uci'] = None
-        session['termination_reason'] = None
-    else:
-        board = TwoHSChessBoard(fen=session['board_fen'])
-        board.position_history = session.get('position_history', [])
-        last_move_uci = session.get('last_move_uci')
-        if last_move_uci:
-            try:
-                board.last_move = chess.Move.from_uci(last_move_uci)
-            except ValueError:
-                board.last_move = None  # Handle invalid UCI in session
-        board.termination_reason = session.get('termination_reason')
+    """Load the board of the session's game from the game store or start a new game."""
+    game_id = session.get('game_id')
+    with metrics.stage('session_load'):
+        state = game_store.get(game_id) if game_id else None
+        if state is not None:
+            return load_game_board(game_id, state)
+
+    # Unknown or expired game: start a new one under a fresh id
+    board = TwoHSChessBoard()
+    session['game_id'] = uuid.uuid4().hex
+    game_store.put(session['game_id'], board_to_state(board))
     return board
 
 def save_board_to_session(board):
-    """Save the current board state to the session."""
-    session['board_fen'] = board.fen()
-    session['position_history'] = board.position_history
-    session['last_move_uci'] = board.last_move.uci() if board.last_move else None
-    session['termination_reason'] = board.termination_reason
+    """Save the current board state for the session's game."""
+    with metrics.stage('session_save'):
+        game_store.put(session['game_id'], board_to_state(board))
+
+def publish_game_state(game_id, board):
+    """
+    Push a game's new state to its players' connections and its spectators.
+    Call it with the game lock held, so pushes go out in the order of moves.
+    """
+    players = game_channels.has_subscribers(game_id)
+    # Open streams get every state even if their kept frames were evicted
+    watched = spectator_hub.is_watched(game_id) or spectator_hub.has_spectators(game_id)
+    if players or watched:
+        # Each format serialized once for everyone
+        messages = StateMessages(game_id, board)
+        if players:
+            game_channels.broadcast(game_id, messages)
+        if watched:
+            spectator_hub.publish(game_id, len(board.move_history), messages)
+
+def send_game_state(game_id, connection):
+    """Send a connection the current state of its game, in full (compact or not)."""
+    # Under the game lock, so that no push of a newer state overtakes it
+    with game_channels.game_lock(game_id):
+        state = game_store.get(game_id)
+        if state is None:
+            connection.send(error_message("Unknown game"))
+            return
+        messages = StateMessages(game_id, board_from_state(state))
+        connection.send(messages.compact() if connection.compact else messages.full(), messages.tag)
+
+def ponder_after_response(game_id, board):
+    """Ponder the replies to a game's position once the response is sent (if enabled)."""
+    if ponder_service is not None and not board.game_status().is_game_over:
+        g.ponder = (game_id, board)
+
+def wants_compact():
+    """True if the client asked for the compact state format (?format=compact or X-State-Format)."""
+    return (request.args.get('format') or request.headers.get('X-State-Format')) == 'compact'
+
+def status_payload(board):
+    """
+    The game status of a board in the format the client asked for. A
+    compact client may acknowledge the state it holds (?ack=<tag> or the
+    X-State-Ack header) to get only the changes since then, when that state
+    is still part of the game.
+    """
+    status = board.game_status()
+    if not wants_compact():
+        return status.to_dict()
+    ack = request.args.get('ack') or request.headers.get('X-State-Ack')
+    return status.to_compact_dict(board.state_delta(ack) if ack else None)
+
+@app.before_request
+def start_request_metrics():
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if route not in UNTIMED_ROUTES:
+        request_metrics.start(route, request.method)
+
+@app.after_request
+def record_response_status(response):
+    record = metrics.current_request()
+    if record is not None:
+        record.status = response.status_code
+        if response.is_streamed:
+            # Finished when the last chunk is sent, so the whole stream counts
+            record.streamed = True
+            response.call_on_close(request_metrics.finish)
+    return response
+
+@app.after_request
+def start_pondering(response):
+    job = g.pop('ponder', None)
+    if job is not None and response.status_code == 200:
+        # The player sees the response first; pondering uses the time they think
+        response.call_on_close(lambda: ponder_service.ponder(*job))
+    return response
+
+@app.after_request
+def compress_response(response):
+    if (not GZIP_MIN_SIZE or response.status_code != 200 or response.is_streamed or
+            response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip'] and (response.content_length or 0) >= GZIP_MIN_SIZE:
+        with metrics.stage('compress'):
+            response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error):
+    record = metrics.current_request()
+    if record is not None and (error is not None or not record.streamed):
+        request_metrics.finish(status=500 if error is not None else None)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request metrics and position cache stats in the Prometheus text format."""
+    return Response(request_metrics.render(TwoHSChessBoard.position_cache, ponder_service),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/')
 def index():
+    # /?game=<id> joins an existing game, e.g. to play it from a second browser
+    game_id = request.args.get('game')
+    if game_id and game_store.get(game_id) is not None:
+        session['game_id'] = game_id
     return render_template('index.html')
 
 @app.route('/api/board', methods=['GET'])
 def get_board():
     b = get_board_from_session()
-    
-    # Get game state information
-    is_game_over = b.is_game_over()
-    checkmate = b.is_checkmate()
-    stalemate = b.is_stalemate()
-    threefold_repetition = b.is_threefold_repetition()
-    fifty_moves = b.is_fifty_moves()
-    insufficient_material = b.is_insufficient_material()
-    
-    # Determine the specific reason for game over
-    game_over_reason = b.termination_reason
-    
-    # Last move information for UI highlighting
-    last_move = None
-    if b.last_move:
-        last_move = {
-            "from": chess.square_name(b.last_move.from_square),
-            "to": chess.square_name(b.last_move.to_square),
-            "isKingsStep": b.is_kings_step_move(b.last_move)
-        }
-    
-    return jsonify({
-        "fen": b.fen(),
-        "extendedFen": b.get_extended_fen(),
-        "turn": "white" if b.turn() else "black",
-        "moveInfo": b.get_move_info(),
-        "isCheck": b.is_check(),
-        "isGameOver": is_game_over,
-        "gameOverReason": game_over_reason,
-        "isCheckmate": checkmate,
-        "isStalemate": stalemate,
-        "isThreefoldRepetition": threefold_repetition,
-        "isFiftyMoves": fifty_moves,
-        "isInsufficientMaterial": insufficient_material,
-        "inCheck": chess.square_name(b.king(b.turn())) if b.is_check() else None,
-        "lastMove": last_move
-    })
+
+    # Revalidation by state tag: an unchanged game costs no status or serialization
+    etag = '%s.%s' % (b.state_tag(), 'c' if wants_compact() else 'f')
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        ponder_after_response(session['game_id'], b)
+        # One snapshot of the position: status flags, move info and last move
+        response = jsonify(status_payload(b))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.update(('X-State-Format', 'X-State-Ack'))
+    return response
 
 @app.route('/api/move', methods=['POST'])
 def make_move():
-    data = request.json
-    move = data.get('move')
+    data = request.get_json(silent=True)
+    move = data.get('move') if isinstance(data, dict) else None
     if not move:
         return jsonify({"error": "Move not provided"}), 400
+    if not isinstance(move, str):
+        return jsonify({"error": "Move must be a UCI string"}), 400
+
+    # Moves of a game are serialized with the WebSocket channel's moves
+    with game_channels.game_lock(session.get('game_id', '')):
+        b = get_board_from_session()
+
+        # Check if game is already over
+        status = b.game_status()
+        if status.is_game_over:
+            return jsonify({
+                "error": "Game is already over. Please reset to start a new game.",
+                **status.game_over_dict()
+            }), 400
+
+        if not b.make_move(move):
+            return jsonify({"error": "Invalid move"}), 400
+
+        # Save the updated board state to the session
+        save_board_to_session(b)
+        publish_game_state(session['game_id'], b)
+        ponder_after_response(session['game_id'], b)
+
+    # Snapshot of the new position
+    return jsonify({
+        "success": True,
+        **status_payload(b)
+    })
+
+@app.route('/api/engine/move', methods=['POST'])
+def engine_move():
+    data = request.get_json(silent=True) or {}
+    try:
+        time_limit = float(data.get('timeLimit', ENGINE_DEFAULT_TIME))
+        node_limit = int(data.get('nodeLimit', ENGINE_MAX_NODES))
+    except (TypeError, ValueError):
+        return jsonify({"error": "timeLimit and nodeLimit must be numbers"}), 400
+    time_limit = max(0.01, min(time_limit, ENGINE_MAX_TIME))
+    node_limit = max(1, min(node_limit, ENGINE_MAX_NODES))
 
     b = get_board_from_session()
-    
-    # Check if game is already over
-    if b.is_game_over():
+
+    status = b.game_status()
+    if status.is_game_over:
         return jsonify({
             "error": "Game is already over. Please reset to start a new game.",
-            "isGameOver": True,
-            "gameOverReason": b.termination_reason,
-            "isCheckmate": b.is_checkmate(),
-            "isStalemate": b.is_stalemate(),
-            "isThreefoldRepetition": b.is_threefold_repetition(),
-            "isFiftyMoves": b.is_fifty_moves(),
-            "isInsufficientMaterial": b.is_insufficient_material()
+            **status.game_over_dict()
         }), 400
 
-    if b.make_move(move):
-        # Save the updated board state to the session
-        save_board_to_session(b)
-        
-        # Get updated game state information
-        is_game_over = b.is_game_over()
-        checkmate = b.is_checkmate()
-        stalemate = b.is_stalemate()
-        threefold_repetition = b.is_threefold_repetition()
-        fifty_moves = b.is_fifty_moves()
-        insufficient_material = b.is_insufficient_material()
-        
-        # Last move information for UI highlighting
-        last_move = None
-        if b.last_move:
-            last_move = {
-                "from": chess.square_name(b.last_move.from_square),
-                "to": chess.square_name(b.last_move.to_square),
-                "isKingsStep": b.is_kings_step_move(b.last_move)
-            }
-        
-        return jsonify({
-            "success": True,
-            "fen": b.fen(),
-            "extendedFen": b.get_extended_fen(),
-            "turn": "white" if b.turn() else "black",
-            "moveInfo": b.get_move_info(),
-            "isCheck": b.is_check(),
-            "isGameOver": is_game_over,
-            "gameOverReason": b.termination_reason,
-            "isCheckmate": checkmate,
-            "isStalemate": stalemate,
-            "isThreefoldRepetition": threefold_repetition,
-            "isFiftyMoves": fifty_moves,
-            "isInsufficientMaterial": insufficient_material,
-            "inCheck": chess.square_name(b.king(b.turn())) if b.is_check() else None,
-            "lastMove": last_move
-        })
+    # On a worker process: the search would hold this worker for up to ENGINE_MAX_TIME
+    result = analysis_service.search(b, time_limit=time_limit, node_limit=node_limit, book=b.opening_book)
+    response = {
+        "bestMove": result.best_move.uci(),
+        "isKingsStep": result.is_kings_step,
+        "score": result.score,
+        "depth": result.depth,
+        "nodes": result.nodes,
+        "nps": int(result.nodes / result.seconds) if result.seconds > 0 else None,
+        "pv": [move.uci() for move in result.pv],
+        "book": result.book
+    }
+
+    # With "play": true the engine's move is made on the game board
+    if data.get('play'):
+        with game_channels.game_lock(session['game_id']):
+            b = get_board_from_session()
+            if not b.make_move(result.best_move.uci()):
+                return jsonify({"error": "The game changed during the search", **response}), 409
+            save_board_to_session(b)
+            publish_game_state(session['game_id'], b)
+            ponder_after_response(session['game_id'], b)
+        response.update({"success": True, **status_payload(b)})
+    return jsonify(response)
+
+# JSON whitespace, skipped between the items of a streamed list
+_JSON_SPACE = re.compile(r'[ \t\n\r]*')
+# Longest list item read before giving up on a body
+JSON_MAX_ITEM = 1 << 20
+
+def stream_json_list(stream, key, chunk_size=1 << 16):
+    """
+    Iterator over the items of the list in a {"<key>": [...]} JSON body,
+    decoded one at a time from a binary stream while it is read, so the
+    body is never held in memory as a whole. Returns None if the body does
+    not start that way; the iterator raises ValueError if the list turns
+    out to be malformed. Anything after the list is ignored.
+    """
+    decode = codecs.getincrementaldecoder('utf-8')(errors='replace').decode
+    start = re.compile(r'[ \t\n\r]*\{[ \t\n\r]*"%s"[ \t\n\r]*:[ \t\n\r]*\[' % re.escape(key))
+    buffer = ''
+    while True:
+        match = start.match(buffer)
+        if match:
+            break
+        chunk = stream.read(chunk_size)
+        if not chunk or len(buffer) > 4096:
+            return None
+        buffer += decode(chunk)
+
+    def items(buffer, pos):
+        decoder = json.JSONDecoder()
+        eof = False
+        expect = 'first'  # 'first' item or ']', an 'item', or a 'separator'
+        while True:
+            pos = _JSON_SPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                char = buffer[pos]
+                if expect == 'separator':
+                    if char == ']':
+                        return
+                    if char != ',':
+                        raise ValueError("expected ',' or ']' at %r" % char)
+                    pos, expect = pos + 1, 'item'
+                    continue
+                if expect == 'first' and char == ']':
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    end = None
+                # Complete once a delimiter follows: "12" may be the start of "12.5"
+                if end is not None and (eof or end < len(buffer) and buffer[end] in ' \t\n\r,]'):
+                    yield item
+                    pos, expect = end, 'separator'
+                    continue
+                if eof or len(buffer) - pos > JSON_MAX_ITEM:
+                    raise ValueError("malformed list item")
+            elif eof:
+                raise ValueError("unterminated list")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + decode(chunk, final=eof)
+            pos = 0
+
+    return items(buffer, match.end())
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze_positions():
+    """
+    Stateless batch analysis. The body is NDJSON with one position per line,
+    a FEN string or {"fen": ..., "moves": [...]}, or a JSON object
+    {"positions": [...]}. Both are read while the results are written. The
+    response streams one NDJSON result per position, in order, with its
+    "index" (see TwoHSChessBoard.analyze_positions). Positions are analysed
+    in chunks on the analysis worker processes.
+    """
+    if request.mimetype == 'application/json':
+        positions = stream_json_list(request.stream, 'positions')
+        if positions is None:
+            return jsonify({"error": "positions must be a list"}), 400
     else:
-        return jsonify({"error": "Invalid move"}), 400
+        # Read line by line while the results are written
+        positions = (line for line in request.stream if line.strip())
+
+    truncated = []
+
+    def parse(items):
+        for index, item in enumerate(items):
+            if index == ANALYZE_MAX_POSITIONS:
+                truncated.append(True)
+                return
+            if isinstance(item, bytes):
+                try:
+                    item = json.loads(item)
+                except ValueError:
+                    item = None
+            yield item
+
+    def generate():
+        results = analysis_service.analyze_positions(parse(positions), max_moves=ANALYZE_MAX_MOVES)
+        try:
+            for index, result in enumerate(results):
+                yield json.dumps({"index": index, **result}, separators=(',', ':')) + '\n'
+        except ValueError:
+            # The JSON body broke off or went wrong after some positions
+            yield json.dumps({"error": "Malformed JSON body; the rest was not analysed"}) + '\n'
+            return
+        if truncated:
+            yield json.dumps({"error": "At most %d positions per request; the rest were not analysed"
+                              % ANALYZE_MAX_POSITIONS}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/analysis', methods=['POST'])
+def submit_analysis():
+    data = request.get_json(silent=True) or {}
+    try:
+        time_limit = float(data.get('timeLimit', 2.0))
+        multipv = int(data.get('multiPv', 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "timeLimit and multiPv must be numbers"}), 400
+
+    b = get_board_from_session()
+    try:
+        job_id = analysis_service.submit(b, time_limit=time_limit, multipv=max(1, multipv))
+    except AnalysisQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(analysis_service.poll(job_id)), 202
+
+@app.route('/api/analysis/<job_id>', methods=['GET'])
+def poll_analysis(job_id):
+    result = analysis_service.poll(job_id)
+    if result is None:
+        return jsonify({"error": "Unknown analysis job"}), 404
+    return jsonify(result)
+
+@app.route('/api/analysis/<job_id>', methods=['DELETE'])
+def cancel_analysis(job_id):
+    if not analysis_service.cancel(job_id):
+        return jsonify({"error": "Unknown analysis job"}), 404
+    return jsonify(analysis_service.poll(job_id))
+
+@app.route('/api/game/pgn', methods=['GET'])
+def export_pgn():
+    # game_record imports this module, so it is imported on first use
+    from game_record import export_game
+    b = get_board_from_session()
+    return Response(export_game(b), mimetype='application/x-chess-pgn',
+                    headers={'Content-Disposition': 'attachment; filename=asha-game.pgn'})
+
+@app.route('/api/game/history', methods=['GET'])
+def game_history():
+    # Read-only view of the session's game after ?ply=N moves (0 is the start)
+    b = get_board_from_session()
+    ply = request.args.get('ply', type=int)
+    if ply is None or not 0 <= ply <= len(b.move_history):
+        return jsonify({"error": "ply must be between 0 and %d" % len(b.move_history)}), 400
+    return jsonify({
+        **status_payload(b.position_at(ply)),
+        "gamePlies": len(b.move_history)
+    })
+
+@app.route('/api/takeback', methods=['POST'])
+def takeback():
+    data = request.get_json(silent=True) or {}
+    plies = data.get('plies', 1)
+    if not isinstance(plies, int) or isinstance(plies, bool) or plies < 1:
+        return jsonify({"error": "plies must be a positive integer"}), 400
+
+    with game_channels.game_lock(session.get('game_id', '')):
+        b = get_board_from_session()
+        if plies > len(b.move_history):
+            return jsonify({"error": "Only %d plies to take back" % len(b.move_history)}), 400
+        b.takeback(plies)
+        save_board_to_session(b)
+        publish_game_state(session['game_id'], b)
+        ponder_after_response(session['game_id'], b)
+
+    return jsonify({
+        "success": True,
+        **status_payload(b)
+    })
+
+@app.route('/api/game/<game_id>/events')
+def spectate_game(game_id):
+    """
+    Read-only Server-Sent Events stream of a game's states, in the compact
+    format with ?format=compact. ?since=<ply> (or the Last-Event-ID header
+    EventSource sends when it reconnects) resumes after that ply.
+    """
+    state = game_store.get(game_id)
+    if state is None:
+        return jsonify({"error": "Unknown game"}), 404
+    cursor = request.args.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        since = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "since must be a ply number"}), 400
+    if spectator_hub.is_full():
+        response = jsonify({"error": "Too many spectators, try again later"})
+        response.headers['Retry-After'] = str(SpectatorHub.KEEPALIVE)
+        return response, 503
+
+    def snapshot():
+        board = board_from_state(state)
+        return len(board.move_history), StateMessages(game_id, board)
+
+    return Response(spectator_hub.stream(game_id, since, snapshot, compact=wants_compact()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/reset', methods=['POST'])
 def reset_game():
-    # Reset the board by clearing the game data from the session
-    session.pop('board_fen', None)
-    session.pop('position_history', None)
-    session.pop('last_move_uci', None)
-    session.pop('termination_reason', None)
-    return jsonify({"message": "Game reset successfully"})
+    # Reset the board by forgetting the session's game
+    game_id = session.pop('game_id', None)
+    if game_id:
+        game_store.delete(game_id)
+    return jsonify({"success": True, "message": "Game reset successfully"})
+
+@sock.route('/ws/game')
+def game_socket(ws):
+    """
+    Real-time channel of the session's game (or ?game=<id>). Clients send
+    {"type": "move", "move": "e2e4"} or {"type": "state"}; every new state
+    of the game is pushed to all its connections as {"type": "state", ...}.
+    If the handshake asked for the compact format (?format=compact), pushes
+    are compact deltas against the state the connection got before.
+    """
+    game_id = request.args.get('game') or session.get('game_id')
+    if not game_id or game_store.get(game_id) is None:
+        ws.send(error_message("Unknown game. Load the board first."))
+        return
+
+    connection = Connection(ws, compact=wants_compact())
+    game_channels.subscribe(game_id, connection)
+    try:
+        send_game_state(game_id, connection)
+        while True:
+            try:
+                message = json.loads(ws.receive())
+            except (TypeError, ValueError):
+                connection.send(error_message("Malformed message"))
+                continue
+            if not isinstance(message, dict):
+                connection.send(error_message("Malformed message"))
+            elif message.get('type') == 'move':
+                socket_move(game_id, connection, message.get('move'))
+            elif message.get('type') == 'state':
+                send_game_state(game_id, connection)
+            else:
+                connection.send(error_message("Unknown message type"))
+    finally:
+        game_channels.unsubscribe(game_id, connection)
+
+def socket_move(game_id, connection, move):
+    """Make a move received on the WebSocket channel and push the new state."""
+    if not move:
+        connection.send(error_message("Move not provided"))
+        return
+    if not isinstance(move, str):
+        connection.send(error_message("Move must be a UCI string"))
+        return
+    with game_channels.game_lock(game_id):
+        state = game_store.get(game_id)
+        if state is None:
+            connection.send(error_message("Unknown game"))
+            return
+        b = load_game_board(game_id, state)
+        status = b.game_status()
+        if status.is_game_over:
+            connection.send(error_message("Game is already over. Please reset to start a new game.",
+                                          **status.game_over_dict()))
+            return
+        if not b.make_move(move):
+            connection.send(error_message("Invalid move", move=move))
+            return
+        game_store.put(game_id, board_to_state(b))
+        publish_game_state(game_id, b)
+    if ponder_service is not None and not b.game_status().is_game_over:
+        ponder_service.ponder(game_id, b)
 
 if __name__ == '__main__':
     # Use threaded=True to handle multiple concurrent requests,
@@ -0,0 +1,527 @@
+"""
+Vectorized batch move generation for ASHA CHESS, for offline bulk work.
+
+movegen.generate_moves handles one chess.Board at a time, in Python. For
+dataset generation and analytics over millions of positions this engine
+holds N positions as NumPy uint64 bitboard arrays and generates the moves
+of all of them at once: every step is a shift or mask applied to N
+bitboards.
+
+- Positions with black to move are mirrored (a byte swap of each bitboard
+  flips the ranks), so the side to move always moves up the board.
+- The enemy attack map and the rays from the king are Kogge-Stone fills.
+  They give the check (evasion) mask and the pinned pieces.
+- Moves are produced as target bitboards per move family: a direction and
+  distance for sliders, a knight jump, a King's Step direction, a pawn
+  push or capture, a king step, castling. The from square of a target is
+  the to square minus the family's offset, so the bits of the target
+  bitboards are the moves.
+
+The results are the move counts and the moves packed into uint32 like
+opening_book.pack_move, so King's Step and capture tags come along.
+
+A few positions go to movegen.generate_moves instead. These are
+kingless positions, positions with several kings, and positions where a
+pawn of the side to move is diagonally next to the en passant square.
+python-chess plays any diagonal pawn move onto that square as an en
+passant capture, which needs its special handling. The results are the
+same either way; `verify` checks this.
+
+Requires numpy 2 (pip install -r requirements-tools.txt). Usage:
+    python batch_movegen.py verify --positions 20000 --seed 1
+    python batch_movegen.py verify selfplay.bin
+    python batch_movegen.py bench --positions 50000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from collections import namedtuple
+
+import chess
+import numpy as np
+
+from movegen import generate_moves
+from opening_book import pack_move, unpack_move
+
+U64 = np.uint64
+ALL = U64(0xFFFFFFFFFFFFFFFF)
+FILE_A = U64(chess.BB_FILE_A)
+FILE_B = U64(chess.BB_FILE_B)
+FILE_G = U64(chess.BB_FILE_G)
+FILE_H = U64(chess.BB_FILE_H)
+RANK_1 = U64(chess.BB_RANK_1)
+RANK_8 = U64(chess.BB_RANK_8)
+DOUBLE_PUSH_RANKS = U64(chess.BB_RANK_3 | chess.BB_RANK_4)
+
+# Directions (file step, rank step); the opposite of DIRECTIONS[i] is DIRECTIONS[i ^ 4]
+DIRECTIONS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+NORTH, NORTH_EAST, NORTH_WEST = 0, 1, 7
+KNIGHT_JUMPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+
+# Positions per vectorized pass; bounds the size of the temporary arrays
+CHUNK_SIZE = 8192
+
+
+def _offset(df, dr):
+    return 8 * dr + df
+
+
+def _landing_mask(df):
+    """Squares a shift by df files may land on without wrapping around the board."""
+    if df > 0:
+        return ~(FILE_A | FILE_B) if df == 2 else ~FILE_A
+    if df < 0:
+        return ~(FILE_G | FILE_H) if df == -2 else ~FILE_H
+    return ALL
+
+
+def _shift_raw(bb, offset):
+    return bb << U64(offset) if offset > 0 else bb >> U64(-offset)
+
+
+def _shift(bb, df, dr):
+    """Move every bit of bb by (df, dr); bits leaving the board are dropped."""
+    return _shift_raw(bb, _offset(df, dr)) & _landing_mask(df)
+
+
+def _fill(gen, empty, df, dr):
+    """Kogge-Stone occluded fill: gen extended along (df, dr) through empty squares."""
+    offset = _offset(df, dr)
+    pro = empty & _landing_mask(df)
+    gen = gen | (pro & _shift_raw(gen, offset))
+    pro = pro & _shift_raw(pro, offset)
+    gen = gen | (pro & _shift_raw(gen, 2 * offset))
+    pro = pro & _shift_raw(pro, 2 * offset)
+    return gen | (pro & _shift_raw(gen, 4 * offset))
+
+
+def _ray(sources, empty, df, dr):
+    """Squares attacked along (df, dr) from sources, up to and including the first blocker."""
+    return _shift(_fill(sources, empty, df, dr), df, dr)
+
+
+def _attacked(pawns, knights, diagonal, orthogonal, kings, empty):
+    """Squares attacked by the side that moves down the board (their pawns capture downwards)."""
+    attacked = _shift(pawns, 1, -1) | _shift(pawns, -1, -1)
+    for df, dr in KNIGHT_JUMPS:
+        attacked |= _shift(knights, df, dr)
+    for i, (df, dr) in enumerate(DIRECTIONS):
+        attacked |= _shift(kings, df, dr)
+        sliders = orthogonal if i % 2 == 0 else diagonal
+        attacked |= _ray(sliders, empty, df, dr)
+    return attacked
+
+
+class PositionBatch:
+    """
+    N positions as NumPy arrays: one uint64 bitboard per piece type and
+    colour, the side to move, the castling rights (rook squares, as in
+    python-chess) and the en passant square (-1 if none).
+    """
+
+    FIELDS = ('pawns', 'knights', 'bishops', 'rooks', 'queens', 'kings', 'white', 'black')
+
+    def __init__(self, pawns, knights, bishops, rooks, queens, kings, white, black,
+                 turn, castling, ep_square):
+        self.pawns, self.knights, self.bishops = pawns, knights, bishops
+        self.rooks, self.queens, self.kings = rooks, queens, kings
+        self.white, self.black = white, black
+        self.turn = turn  # bool, True for white
+        self.castling = castling
+        self.ep_square = ep_square  # int16
+
+    def __len__(self):
+        return len(self.turn)
+
+    @classmethod
+    def from_boards(cls, boards):
+        """Batch of chess.Board (or TwoHSChessBoard .board) positions."""
+        rows = [(b.pawns, b.knights, b.bishops, b.rooks, b.queens, b.kings,
+                 b.occupied_co[chess.WHITE], b.occupied_co[chess.BLACK],
+                 b.turn, b.clean_castling_rights(), -1 if b.ep_square is None else b.ep_square)
+                for b in boards]
+        columns = list(zip(*rows)) if rows else [()] * 11
+        bitboards = [np.array(column, dtype=np.uint64) for column in columns[:8]]
+        return cls(*bitboards, np.array(columns[8], dtype=bool),
+                   np.array(columns[9], dtype=np.uint64), np.array(columns[10], dtype=np.int16))
+
+    @classmethod
+    def from_fens(cls, fens):
+        return cls.from_boards(chess.Board(fen) for fen in fens)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Batch of self-play records (see selfplay.py), e.g. a slice of
+        numpy.memmap(path, dtype=RECORD_NUMPY_DTYPE, offset=HEADER.size).
+        Decoding is vectorized too.
+        """
+        packed = np.asarray(records['squares'], dtype=np.uint8)
+        codes = np.empty((len(packed), 64), dtype=np.uint8)
+        codes[:, 0::2] = packed & 15
+        codes[:, 1::2] = packed >> 4
+
+        def bitboard(mask):
+            return np.packbits(mask, axis=1, bitorder='little').view('<u8')[:, 0].astype(np.uint64)
+
+        kinds = codes & 7
+        pieces = [bitboard(kinds == piece_type) for piece_type in range(1, 7)]
+        white = bitboard((codes >= 1) & (codes <= 6))
+        black = bitboard(codes >= 9)
+
+        bits = np.asarray(records['castling'])
+        castling = np.zeros(len(packed), dtype=np.uint64)
+        for bit, corner in ((1, chess.BB_H1), (2, chess.BB_A1), (4, chess.BB_H8), (8, chess.BB_A8)):
+            castling |= np.where(bits & bit, U64(corner), U64(0))
+        # Keep the rights python-chess would keep: king on e1/e8, rook on its corner
+        rooks, kings = pieces[3], pieces[5]
+        castling &= rooks & ((white & RANK_1) | (black & RANK_8))
+        castling &= np.where(kings & white & U64(chess.BB_E1), ALL, ~RANK_1)
+        castling &= np.where(kings & black & U64(chess.BB_E8), ALL, ~RANK_8)
+
+        ep = np.asarray(records['ep_square']).astype(np.int16)
+        ep[ep == 64] = -1
+        return cls(*pieces, white, black, np.asarray(records['turn']).astype(bool), castling, ep)
+
+    def slice(self, start, stop):
+        return PositionBatch(*(getattr(self, name)[start:stop] for name in self.FIELDS),
+                             self.turn[start:stop], self.castling[start:stop], self.ep_square[start:stop])
+
+    def board(self, i):
+        """Position i as a chess.Board."""
+        board = chess.Board(None)
+        for piece_type, name in enumerate(self.FIELDS[:6], 1):
+            bb = int(getattr(self, name)[i])
+            for color, name in ((chess.WHITE, 'white'), (chess.BLACK, 'black')):
+                for square in chess.scan_reversed(bb & int(getattr(self, name)[i])):
+                    board.set_piece_at(square, chess.Piece(piece_type, color))
+        board.turn = bool(self.turn[i])
+        board.castling_rights = int(self.castling[i])
+        board.ep_square = None if self.ep_square[i] < 0 else int(self.ep_square[i])
+        return board
+
+
+class BatchMoves(namedtuple('BatchMoves', ['counts', 'offsets', 'moves'])):
+    """
+    Moves of a PositionBatch: the moves of position i are
+    moves[offsets[i]:offsets[i + 1]], packed like opening_book.pack_move.
+    """
+    __slots__ = ()
+
+    def tagged_moves(self, i):
+        """The moves of position i as a list of movegen.TaggedMove."""
+        return [unpack_move(int(packed)) for packed in self.moves[self.offsets[i]:self.offsets[i + 1]]]
+
+
+def generate_batch(batch, chunk_size=CHUNK_SIZE):
+    """Generate the legal moves of every position of a PositionBatch; returns BatchMoves."""
+    counts, moves = [], []
+    for start in range(0, len(batch), chunk_size):
+        chunk_counts, chunk_moves = _generate_chunk(batch.slice(start, start + chunk_size))
+        counts.append(chunk_counts)
+        moves.append(chunk_moves)
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+    moves = np.concatenate(moves) if moves else np.zeros(0, dtype=np.uint32)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return BatchMoves(counts, offsets, moves)
+
+
+def _generate_chunk(batch):
+    n = len(batch)
+    black = ~batch.turn
+    # Mirror the positions with black to move so that every side to move moves up
+    def side(bb):
+        return np.where(black, bb.byteswap(), bb)
+
+    white, black_pieces = side(batch.white), side(batch.black)
+    us = np.where(black, black_pieces, white)
+    them = np.where(black, white, black_pieces)
+    pawns, knights, bishops = side(batch.pawns), side(batch.knights), side(batch.bishops)
+    rooks, queens, kings = side(batch.rooks), side(batch.queens), side(batch.kings)
+    castling = side(batch.castling) & RANK_1
+    ep = np.where(batch.ep_square < 0, U64(0),
+                  U64(1) << (np.where(black, batch.ep_square ^ 56, batch.ep_square).astype(np.uint64) & U64(63)))
+
+    # The scalar generator handles kingless positions, several kings and
+    # pawns that could move diagonally onto the en passant square
+    king = kings & us
+    scalar = (king == 0) | ((king & (king - U64(1))) != 0)
+    diagonal_to_ep = _shift(ep, 1, 1) | _shift(ep, -1, 1) | _shift(ep, 1, -1) | _shift(ep, -1, -1)
+    scalar |= (diagonal_to_ep & pawns & us) != 0
+    # Without pieces of their own these positions get no moves here
+    us = np.where(scalar, U64(0), us)
+    king = kings & us
+
+    occupied = us | them
+    empty = ~occupied
+    diagonal = (bishops | queens) & them
+    orthogonal = (rooks | queens) & them
+
+    # Checkers, the evasion mask, and pinned pieces per direction
+    checkers = (_shift(king, 1, 1) | _shift(king, -1, 1)) & pawns & them
+    for df, dr in KNIGHT_JUMPS:
+        checkers |= _shift(king, df, dr) & knights & them
+    block_lines = np.zeros(n, dtype=np.uint64)
+    pinned = []
+    for i, (df, dr) in enumerate(DIRECTIONS):
+        sliders = orthogonal if i % 2 == 0 else diagonal
+        ray = _ray(king, empty, df, dr)
+        checker = ray & sliders
+        checkers |= checker
+        block_lines |= np.where(checker != 0, ray, U64(0))
+        # Our first piece on the ray is pinned if an enemy slider is next behind it
+        first = ray & us
+        behind = _ray(first, empty, df, dr) & occupied
+        pinned.append(np.where((behind & sliders) != 0, first, U64(0)))
+    evasions = np.where(checkers == 0, ALL,
+                        np.where((checkers & (checkers - U64(1))) != 0, U64(0), checkers | block_lines))
+    all_pinned = np.zeros(n, dtype=np.uint64)
+    for pins in pinned:
+        all_pinned |= pins
+    # Pieces that may move in direction i: unpinned ones, and those pinned along that line
+    movable = [~all_pinned | pinned[i] | pinned[i ^ 4] for i in range(8)]
+
+    targets = _MoveFamilies()
+
+    # King moves: to squares the enemy does not attack once the king has left
+    attacked = _attacked(pawns & them, knights & them, diagonal, orthogonal, kings & them,
+                         empty | king)
+    for df, dr in DIRECTIONS:
+        targets.add(_shift(king, df, dr) & ~us & ~attacked, _offset(df, dr))
+    # Castling needs the rook's rights, empty squares between, and a king path not attacked
+    kingside = (castling & U64(chess.BB_H1)) != 0
+    kingside &= (occupied & U64(chess.BB_F1 | chess.BB_G1)) == 0
+    kingside &= (attacked & U64(chess.BB_E1 | chess.BB_F1 | chess.BB_G1)) == 0
+    queenside = (castling & U64(chess.BB_A1)) != 0
+    queenside &= (occupied & U64(chess.BB_B1 | chess.BB_C1 | chess.BB_D1)) == 0
+    queenside &= (attacked & U64(chess.BB_C1 | chess.BB_D1 | chess.BB_E1)) == 0
+    on_e1 = (king & U64(chess.BB_E1)) != 0
+    targets.add(np.where(kingside & on_e1, U64(chess.BB_G1), U64(0)), 2)
+    targets.add(np.where(queenside & on_e1, U64(chess.BB_C1), U64(0)), -2)
+
+    # Sliders, one family per direction and distance
+    for i, (df, dr) in enumerate(DIRECTIONS):
+        movers = ((rooks if i % 2 == 0 else bishops) | queens) & us & movable[i]
+        offset = _offset(df, dr)
+        for distance in range(1, 8):
+            movers = _shift(movers, df, dr) & ~us
+            if not movers.any():
+                break
+            targets.add(movers & evasions, distance * offset)
+            movers &= empty
+
+    # Knight jumps; a pinned knight cannot move
+    free_knights = knights & us & ~all_pinned
+    for df, dr in KNIGHT_JUMPS:
+        targets.add(_shift(free_knights, df, dr) & ~us & evasions, _offset(df, dr))
+
+    # King's Steps: one square into an empty square, where it is not a standard move
+    # (bishops step diagonally and rooks orthogonally anyway, pawns push forward)
+    our_pawns = pawns & us
+    for i, (df, dr) in enumerate(DIRECTIONS):
+        steppers = knights | (bishops if i % 2 == 0 else rooks)
+        if i != NORTH:
+            steppers = steppers | pawns
+        steppers &= us & movable[i]
+        landing = _shift(steppers, df, dr) & empty & evasions
+        if i == NORTH:
+            # A pawn's step onto the last rank without promoting is a King's Step
+            landing |= _shift(our_pawns & movable[i], df, dr) & empty & evasions & RANK_8
+        targets.add(landing, _offset(df, dr), kings_step=True)
+
+    # Pawn pushes, double pushes and captures, with promotions on the last rank
+    single = _shift(our_pawns & movable[NORTH], 0, 1) & empty
+    double = _shift(single, 0, 1) & empty & DOUBLE_PUSH_RANKS & evasions
+    targets.add(double, 16)
+    for i, landing in ((NORTH, single & evasions),
+                       (NORTH_EAST, _shift(our_pawns & movable[NORTH_EAST], 1, 1) & them & evasions),
+                       (NORTH_WEST, _shift(our_pawns & movable[NORTH_WEST], -1, 1) & them & evasions)):
+        offset = _offset(*DIRECTIONS[i])
+        targets.add(landing & ~RANK_8, offset)
+        for promotion in (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT):
+            targets.add(landing & RANK_8, offset, promotion=promotion)
+
+    positions, to_squares, offsets, promotions, kings_steps = targets.moves()
+    from_squares = to_squares - offsets
+    is_capture = ((them[positions] >> to_squares.astype(np.uint64)) & U64(1)).astype(np.uint32)
+    # Mirror the squares of black's moves back
+    flip = np.where(black[positions], 56, 0)
+    packed = ((from_squares ^ flip) | (to_squares ^ flip) << 6 | promotions << 12 |
+              kings_steps << 15).astype(np.uint32) | is_capture << 16
+
+    # Merge in the positions left to the scalar generator, keeping position order
+    scalar_positions = np.flatnonzero(scalar)
+    if len(scalar_positions):
+        extra_positions, extra_moves = [], []
+        for i in scalar_positions:
+            generated = [pack_move(tagged) for tagged in generate_moves(batch.board(i))]
+            extra_positions.extend([i] * len(generated))
+            extra_moves.extend(generated)
+        positions = np.concatenate([positions, np.array(extra_positions, dtype=positions.dtype)])
+        packed = np.concatenate([packed, np.array(extra_moves, dtype=np.uint32)])
+        order = np.argsort(positions, kind='stable')
+        positions, packed = positions[order], packed[order]
+    return np.bincount(positions, minlength=n), packed
+
+
+class _MoveFamilies:
+    """Target bitboards of one chunk, each with its from offset, promotion and King's Step tag."""
+
+    def __init__(self):
+        self.bitboards = []
+        self.offsets = []
+        self.promotions = []
+        self.kings_steps = []
+
+    def add(self, bitboard, offset, promotion=0, kings_step=False):
+        self.bitboards.append(bitboard)
+        self.offsets.append(offset)
+        self.promotions.append(promotion)
+        self.kings_steps.append(kings_step)
+
+    def moves(self):
+        """(position, to square, offset, promotion, King's Step) arrays, ordered by position."""
+        families = np.stack(self.bitboards, axis=1)
+        popcounts = np.bitwise_count(families).astype(np.int64)
+        # Each non-empty bitboard gets a run of slots, in position order
+        flat = families.ravel()
+        sizes = popcounts.ravel()
+        entries = np.flatnonzero(flat)
+        slots = (np.cumsum(sizes) - sizes)[entries]
+        values = flat[entries]
+        family = entries % families.shape[1]
+
+        total = int(sizes.sum())
+        to_squares = np.empty(total, dtype=np.int64)
+        move_family = np.empty(total, dtype=np.int64)
+        # Peel off the lowest bit of every bitboard at once until all are empty
+        while len(values):
+            lowest = values & (~values + U64(1))
+            to_squares[slots] = np.frexp(lowest.astype(np.float64))[1] - 1
+            move_family[slots] = family
+            values = values ^ lowest
+            left = values != 0
+            values, slots, family = values[left], slots[left] + 1, family[left]
+
+        positions = np.repeat(np.arange(len(families)), popcounts.sum(axis=1))
+        return (positions, to_squares,
+                np.array(self.offsets, dtype=np.int64)[move_family],
+                np.array(self.promotions, dtype=np.int64)[move_family],
+                np.array(self.kings_steps, dtype=np.int64)[move_family])
+
+
+# --- Verification and benchmark -----------------------------------------------
+
+def random_positions(count, seed=0, max_plies=200):
+    """count chess.Board positions from random games, King's Steps included."""
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        board = chess.Board()
+        for _ in range(max_plies):
+            moves = generate_moves(board)
+            if not moves or len(boards) >= count:
+                break
+            boards.append(board.copy(stack=False))
+            board.push(rng.choice(moves).move)
+    return boards
+
+
+def load_records(path, limit=None):
+    """The records of a self-play file as a numpy array (memory-mapped)."""
+    from selfplay import HEADER, RECORD_NUMPY_DTYPE
+    records = np.memmap(path, dtype=RECORD_NUMPY_DTYPE, mode='r', offset=HEADER.size)
+    return records[:limit] if limit else records
+
+
+def verify(batch, boards=None):
+    """
+    Compare generate_batch with movegen.generate_moves position by position.
+    Returns the list of (index, missing, extra) differences.
+    """
+    result = generate_batch(batch)
+    mismatches = []
+    for i in range(len(batch)):
+        board = boards[i] if boards is not None else batch.board(i)
+        expected = {pack_move(tagged) for tagged in generate_moves(board)}
+        actual = result.moves[result.offsets[i]:result.offsets[i + 1]]
+        got = set(int(packed) for packed in actual)
+        if got != expected or len(actual) != len(expected):
+            mismatches.append((i, sorted(expected - got), sorted(got - expected)))
+    return mismatches
+
+
+def benchmark(boards):
+    """Positions per second of the scalar generator and of the batch engine."""
+    start = time.perf_counter()
+    scalar_moves = sum(len(generate_moves(board)) for board in boards)
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = PositionBatch.from_boards(boards)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    result = generate_batch(batch)
+    batch_seconds = time.perf_counter() - start
+    assert int(result.counts.sum()) == scalar_moves
+
+    count = len(boards)
+    return {
+        "positions": count,
+        "moves": scalar_moves,
+        "scalarSeconds": round(scalar_seconds, 4),
+        "scalarPositionsPerSecond": int(count / scalar_seconds),
+        "batchLoadSeconds": round(load_seconds, 4),
+        "batchSeconds": round(batch_seconds, 4),
+        "batchPositionsPerSecond": int(count / batch_seconds),
+        "speedup": round(scalar_seconds / batch_seconds, 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vectorized batch move generation for ASHA CHESS.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, text in (('verify', "compare with movegen.generate_moves"),
+                       ('bench', "positions/second against movegen.generate_moves")):
+        sub = subparsers.add_parser(name, help=text)
+        sub.add_argument('records', nargs='?', help="self-play record file (default: random games)")
+        sub.add_argument('--positions', type=int, default=20000)
+        sub.add_argument('--seed', type=int, default=0)
+    subparsers.choices['bench'].add_argument('--json', action='store_true',
+                                             help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.records:
+        batch = PositionBatch.from_records(load_records(args.records, args.positions))
+        boards = [batch.board(i) for i in range(len(batch))]
+    else:
+        boards = random_positions(args.positions, seed=args.seed)
+        batch = PositionBatch.from_boards(boards)
+
+    if args.command == 'verify':
+        mismatches = verify(batch, boards)
+        for i, missing, extra in mismatches[:20]:
+            print('%s  missing %s  extra %s' % (boards[i].fen(),
+                                                [unpack_move(m).move.uci() for m in missing],
+                                                [unpack_move(m).move.uci() for m in extra]))
+        print('%d positions, %d mismatches' % (len(batch), len(mismatches)))
+        return 1 if mismatches else 0
+
+    results = benchmark(boards)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print('%d positions, %d moves' % (results['positions'], results['moves']))
+        print('scalar  %8.3fs  %10d positions/s' % (results['scalarSeconds'],
+                                                   results['scalarPositionsPerSecond']))
+        print('batch   %8.3fs  %10d positions/s  (%.2fx, loading %.3fs)' % (
+            results['batchSeconds'], results['batchPositionsPerSecond'], results['speedup'],
+            results['batchLoadSeconds']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,790 @@
+"""
+The ASHA CHESS board: TwoHSChessBoard, a chess.Board with the variant's
+King's Step moves, its game records (move history, repetitions, takebacks)
+and its status, plus the dicts it is stored as.
+
+It has no web dependencies, so the offline tools (perft, game records,
+self-play, mate mining) use it without starting the app's services. The
+process-wide position cache is on by default; the opening book and the
+tablebase are class attributes that app.py configures from the environment.
+
+Usage:
+    from board import TwoHSChessBoard
+    board = TwoHSChessBoard()
+    board.make_move('e2e4')
+    board.game_status().to_dict()
+"""
+import time
+import zlib
+
+import chess
+
+from movegen import position_key, MoveLists
+import zobrist
+from game_status import GameStatus, compute_position_info, diff_move_groups, pack_move
+from position_cache import shared_position_cache
+import metrics
+
+# Custom 2HS Chess Board: With Knights + Fixed Game Termination Detection
+class TwoHSChessBoard:
+    # Starting FEN with knights (standard chess starting position)
+    VARIANT_STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+    # Process-wide cache of PositionInfo shared by all boards; None disables it
+    position_cache = shared_position_cache
+    # Memory-mapped opening book (see opening_book.py), consulted before
+    # move generation; set by app.py (OPENING_BOOK)
+    opening_book = None
+    # Decides whether the material left can still mate, where it covers it;
+    # set by app.py (TABLEBASE_DIR)
+    tablebase = None
+
+    def __init__(self, fen=VARIANT_STARTING_FEN):
+        self.board = chess.Board(fen)
+        # Where the game started and the moves played since (UCI), for game records
+        self.start_fen = self.board.fen()
+        self.move_history = []
+        # "King's Step" directions
+        self.kings_step_directions = [
+            (0, 1), (1, 1), (1, 0), (1, -1),
+            (0, -1), (-1, -1), (-1, 0), (-1, 1)
+        ]
+        # Zobrist key of the current position, updated incrementally by make_move
+        self.zobrist_key = zobrist.zobrist_hash(self.board)
+        # Zobrist keys of the positions since the last irreversible move, and
+        # how often each occurred, for repetition detection
+        self.position_history = []
+        self._repetition_counts = {}
+        self.update_position_history()
+
+        # Per-ply records of the game, for takebacks and history navigation:
+        # the Zobrist key after each move with its flags (see push), and the
+        # FEN every KEYFRAME_INTERVAL plies, keyframes[i] being the position
+        # at ply i * KEYFRAME_INTERVAL. None when a stored game predates them.
+        self.deltas = []
+        self.keyframes = [self.start_fen]
+        # How to take back each move pushed on this board object (see pop)
+        self._undo_stack = []
+        # Piece move lists reused from one position to the next by move generation
+        self._move_lists = MoveLists()
+        
+        # PositionInfo (legal moves etc.) of the current position, to avoid recalculation
+        self._position_info = None
+        self._cache_key = None
+        # Positions pondered for this board's game ({position_key: PositionInfo}, see ponder.py)
+        self.pondered = None
+        
+        # Last move made for better UI highlighting, and whether it was a King's Step
+        self.last_move = None
+        self.last_move_kings_step = False
+        
+        # GameStatus of the current position, computed on demand
+        self._status_cache = None
+        self._status_key = None
+        
+        # Game termination reason
+        self.termination_reason = None
+        
+        # Extended FEN information - additional flags for 2HS rules
+        # Currently no additional flags needed, but prepared for extensions
+        self.extended_fen_flags = {}
+    
+    # Distinct positions whose moves one analyze_positions batch remembers
+    BATCH_MEMO_SIZE = 4096
+    # chess.Board.status() flags the variant reaches in legal play: pawns
+    # step onto back ranks, and King's Steps uncover checks that standard
+    # moves cannot
+    VARIANT_STATUS = chess.STATUS_PAWNS_ON_BACKRANK | chess.STATUS_TOO_MANY_CHECKERS | chess.STATUS_IMPOSSIBLE_CHECK
+
+    # Plies between two stored FENs of a game; a past position is rebuilt
+    # from the keyframe before it by replaying fewer moves than this
+    KEYFRAME_INTERVAL = 16
+    # Flags of a per-ply delta
+    DELTA_KINGS_STEP = 1
+    DELTA_IRREVERSIBLE = 2
+
+    @classmethod
+    def analyze_positions(cls, positions, max_moves=None):
+        """
+        Analyse a batch of positions, without a game or a session.
+
+        positions is an iterable of FEN strings, (fen, moves) pairs or
+        {"fen": ..., "moves": [...]} dicts, the moves (UCI) being played
+        from the FEN. Yields one result per position, in order, as soon as
+        it is computed: the /api/board fields plus "legalMoves" and
+        "kingsStepMoves" (UCI), or {"error": ...}, also for positions that
+        cannot occur (no king, side not to move in check, ...). Positions
+        reached more than once in a batch, however they are written, share
+        their move lists, and positions go through the shared position
+        cache, so a position is generated once.
+        """
+        memo = {}
+        for item in positions:
+            if isinstance(item, str):
+                fen, moves = item, ()
+            elif isinstance(item, dict):
+                fen, moves = item.get('fen'), item.get('moves') or ()
+            elif isinstance(item, (list, tuple)) and len(item) == 2:
+                fen, moves = item
+                moves = moves or ()
+            else:
+                yield {"error": "Expected a FEN or {\"fen\": ..., \"moves\": [...]}"}
+                continue
+            if not isinstance(fen, str) or not isinstance(moves, (list, tuple)) or \
+                    not all(isinstance(move, str) for move in moves):
+                yield {"error": "fen must be a string and moves a list of UCI moves"}
+                continue
+            if max_moves is not None and len(moves) > max_moves:
+                yield {"error": "At most %d moves per position" % max_moves}
+                continue
+
+            yield cls._analyze_position(fen.strip(), moves, memo)
+
+    @classmethod
+    def _analyze_position(cls, fen, moves, memo):
+        try:
+            board = cls(fen)
+        except ValueError as e:
+            return {"error": "Invalid FEN: %s" % e}
+        invalid = board.board.status() & ~cls.VARIANT_STATUS
+        if invalid:
+            reasons = [name.lower().replace('_', ' ') for name, flag in chess.Status.__members__.items()
+                       if flag and invalid & flag == flag]
+            return {"error": "Invalid position: %s" % ', '.join(reasons)}
+        for ply, move in enumerate(moves):
+            if not board.make_move(move):
+                return {"error": "Illegal move %s at ply %d" % (move, ply)}
+
+        # The status depends on the game (ply, last move, repetitions); the
+        # move lists only on the position
+        key = position_key(board.board)
+        lists = memo.get(key)
+        if lists is None:
+            tagged_moves = board.tagged_legal_moves()
+            lists = ([tagged.move.uci() for tagged in tagged_moves],
+                     [tagged.move.uci() for tagged in tagged_moves if tagged.is_kings_step])
+            if len(memo) < cls.BATCH_MEMO_SIZE:
+                memo[key] = lists
+        return {
+            **board.game_status().to_dict(),
+            "legalMoves": lists[0],
+            "kingsStepMoves": lists[1]
+        }
+
+    def get_extended_fen(self):
+        """Get the extended FEN that includes 2HS Chess specific flags."""
+        base_fen = self.board.fen()
+        # If we have any custom flags to add, we can append them here
+        # For future extensions like super_pawns, variable castling, etc.
+        return base_fen
+
+    def update_position_history(self, irreversible=False):
+        """
+        Record the current position for repetition detection.
+
+        Pass irreversible=True after a capture or promotion: the material
+        changed, so no earlier position can ever occur again. Pawn moves do
+        not qualify in this variant, since a King's Step can take a pawn back.
+        """
+        if irreversible:
+            self.position_history = []
+            self._repetition_counts = {}
+        self.position_history.append(self.zobrist_key)
+        self._repetition_counts[self.zobrist_key] = self._repetition_counts.get(self.zobrist_key, 0) + 1
+
+    def load_position_history(self, history):
+        """Restore a saved position history, e.g. from the session."""
+        if not history or history[-1] != self.zobrist_key:
+            # Missing or stale history (e.g. from an older session format)
+            self.reset_position_history()
+            return
+        self.position_history = list(history)
+        self._repetition_counts = {}
+        for key in self.position_history:
+            self._repetition_counts[key] = self._repetition_counts.get(key, 0) + 1
+    
+    def _clear_cache(self):
+        """Clear the legal moves cache to prevent stale data."""
+        self._position_info = None
+        self._cache_key = None
+    
+    def reset_position_history(self):
+        """Reset position history for a new game to prevent memory accumulation."""
+        self.update_position_history(irreversible=True)
+        
+    def legal_moves(self):
+        """
+        Generates all legal moves for the current position, including standard chess
+        moves and custom "King's Step" moves. This is the single source of truth for move legality.
+        A move is legal if, and only if, it does not leave the player's king in check.
+        """
+        return [tagged.move for tagged in self.tagged_legal_moves()]
+
+    def tagged_legal_moves(self):
+        """
+        Same moves as legal_moves, each tagged as standard or King's Step and
+        as capture or quiet move (see movegen.TaggedMove).
+        """
+        return self.position_info().tagged_moves
+
+    def position_info(self):
+        """
+        Get the PositionInfo (legal moves, move info, check) of the current
+        position, from this board's cache, the shared position cache, the
+        game's pondered positions, the opening book, or a fresh move generation.
+        """
+        record = metrics.current_request()
+        current_key = position_key(self.board)
+        if self._position_info is not None and self._cache_key == current_key:
+            if record is not None:
+                record.position_info('board')
+            return self._position_info
+
+        source = 'cache'
+        info = self.position_cache.get(current_key) if self.position_cache is not None else None
+        if info is None and self.pondered is not None:
+            info = self.pondered.get(current_key)
+            if info is not None:
+                source = 'ponder'
+                if self.position_cache is not None:
+                    self.position_cache.put(current_key, info)
+        if info is None and self.opening_book is not None:
+            # Hash the board itself: callers like perft push moves without make_move
+            entry = self.opening_book.lookup(zobrist.zobrist_hash(self.board))
+            if entry is not None:
+                info = entry.position_info()
+                source = 'book'
+        if info is None:
+            start = time.perf_counter()
+            info = compute_position_info(self.board, self._move_lists, self.tablebase)
+            if record is not None:
+                record.position_info('generated', self.board.fen(), len(info.tagged_moves),
+                                     time.perf_counter() - start)
+            if self.position_cache is not None:
+                self.position_cache.put(current_key, info)
+        elif record is not None:
+            record.position_info(source)
+
+        self._position_info = info
+        self._cache_key = current_key
+        return info
+
+    def game_status(self):
+        """
+        Get the GameStatus of the current position: terminal reason, check
+        square, grouped move info and last move, from one move generation pass.
+        """
+        current_key = (position_key(self.board), self.board.halfmove_clock, self.zobrist_key,
+                       len(self.position_history), self.last_move)
+        if self._status_cache is not None and self._status_key == current_key:
+            return self._status_cache
+
+        with metrics.stage('status'):
+            status = GameStatus(self)
+
+        self._status_cache = status
+        self._status_key = current_key
+        return status
+
+    def get_move_info(self):
+        """Get information about valid moves for UI display."""
+        return self.game_status().move_info
+
+    def is_move_valid(self, move_uci: str):
+        """
+        Checks if a move is valid by referencing the main legal_moves engine.
+        This ensures all rules are applied consistently from a single source of truth.
+        """
+        if self.is_game_over():
+            return False
+            
+        try:
+            move = chess.Move.from_uci(move_uci)
+            # A move is legal if and only if it exists in our main function's generated list.
+            return move in self.legal_moves()
+        except (ValueError, IndexError):
+            # Handle invalid UCI format or board errors.
+            return False
+
+    def make_move(self, move):
+        """Make a move on the board if it's valid."""
+        # First check if game is already over
+        if self.is_game_over():
+            return False
+            
+        # Verify the move is legal
+        if self.is_move_valid(move):
+            self.push(chess.Move.from_uci(move))
+            
+            # Check if this move ended the game
+            status = self.game_status()
+            if status.is_game_over:
+                self.termination_reason = status.game_over_reason
+            
+            return True
+        return False
+
+    def push(self, move, is_kings_step=None):
+        """
+        Play a legal chess.Move, keeping what pop() needs to take it back.
+
+        is_kings_step is the move's tag when the caller has it (e.g. from
+        tagged_legal_moves); otherwise it is looked up. Unlike make_move,
+        the move is not validated.
+        """
+        if is_kings_step is None:
+            is_kings_step = self.is_kings_step_move(move)
+        # Captures and promotions can never be undone
+        irreversible = self.board.is_capture(move) or move.promotion is not None
+
+        # The previous position's move info and status stay cached for pop
+        self._undo_stack.append((
+            self.zobrist_key, self.last_move, self.last_move_kings_step, self.termination_reason,
+            (self.position_history, self._repetition_counts) if irreversible else None,
+            self._position_info, self._cache_key, self._status_cache, self._status_key
+        ))
+
+        # Save as last move for UI highlighting
+        self.last_move = move
+        self.last_move_kings_step = is_kings_step
+
+        # Execute the move, keeping the Zobrist key up to date
+        self.zobrist_key = zobrist.push(self.board, move, self.zobrist_key)
+        self.move_history.append(move.uci())
+        if self.deltas is not None:
+            self.deltas.append((self.zobrist_key, (self.DELTA_KINGS_STEP if is_kings_step else 0) |
+                                (self.DELTA_IRREVERSIBLE if irreversible else 0)))
+            if len(self.move_history) % self.KEYFRAME_INTERVAL == 0:
+                self.keyframes.append(self.board.fen())
+
+        # The legal moves of the new position are generated on demand
+        self._clear_cache()
+
+        # Update position history for repetition detection
+        self.update_position_history(irreversible=irreversible)
+
+    def pop(self):
+        """
+        Take back the last move pushed on this board object (by push or
+        make_move), restoring the previous position's cached move info and
+        status. Raises IndexError if there is none.
+        """
+        (zobrist_key, last_move, last_move_kings_step, termination_reason, history,
+         position_info, cache_key, status, status_key) = self._undo_stack.pop()
+        self.board.pop()
+
+        if history is not None:
+            self.position_history, self._repetition_counts = history
+        else:
+            key = self.position_history.pop()
+            count = self._repetition_counts[key] - 1
+            if count:
+                self._repetition_counts[key] = count
+            else:
+                del self._repetition_counts[key]
+
+        self.move_history.pop()
+        if self.deltas is not None:
+            self.deltas.pop()
+            del self.keyframes[len(self.move_history) // self.KEYFRAME_INTERVAL + 1:]
+
+        self.zobrist_key = zobrist_key
+        self.last_move = last_move
+        self.last_move_kings_step = last_move_kings_step
+        self.termination_reason = termination_reason
+        self._position_info, self._cache_key = position_info, cache_key
+        self._status_cache, self._status_key = status, status_key
+
+    def takeback(self, plies=1):
+        """
+        Take back the last plies moves of the game.
+
+        Moves pushed on this board object are popped. Earlier ones (e.g. of
+        a game loaded from the store) are taken back from the per-ply
+        records: the position is rebuilt from the nearest keyframe before
+        the target ply and the few moves played after it, and its
+        repetition history from the stored Zobrist keys.
+        """
+        if not 0 <= plies <= len(self.move_history):
+            raise ValueError("Cannot take back %d plies after %d" % (plies, len(self.move_history)))
+        while plies and self._undo_stack:
+            self.pop()
+            plies -= 1
+        if plies:
+            self._rewind(len(self.move_history) - plies)
+
+    def position_at(self, ply):
+        """A new board with this game as it was after ply moves (0 is the start)."""
+        if not 0 <= ply <= len(self.move_history):
+            raise ValueError("No ply %d in a game of %d plies" % (ply, len(self.move_history)))
+        self._ensure_records()
+        board = type(self)(self.start_fen)
+        board.move_history = self.move_history[:ply]
+        board.deltas = self.deltas[:ply]
+        board.keyframes = self.keyframes[:ply // self.KEYFRAME_INTERVAL + 1]
+        board._rewind(ply)
+        return board
+
+    def state_tag(self):
+        """
+        Short id of the game state the API reports: the ply, the position's
+        Zobrist key, and a checksum of the repetition history, move clock,
+        last move and termination. Serves as the ETag of /api/board and as
+        the base a client acknowledges for compact deltas (see state_delta).
+        """
+        checksum = zlib.crc32(repr((self.position_history, self.board.halfmove_clock, self.last_move,
+                                    self.last_move_kings_step, self.termination_reason)).encode())
+        return '%d-%016x-%08x' % (len(self.move_history), self.zobrist_key, checksum)
+
+    def state_delta(self, tag):
+        """
+        The changes since an earlier state of this game, given its state_tag:
+        its ply, the squares whose piece changed ([square, piece symbol or
+        ""]), the FEN fields after the placement, the moves played since
+        (see game_status.pack_move) and the legal moves of the origin
+        squares whose moves changed (see game_status.diff_move_groups).
+        None if the tag is not the position of this game at its ply (e.g.
+        it was taken back since); the client then needs the full state.
+        """
+        try:
+            ply, key = tag.split('-')[:2]
+            ply, key = int(ply), int(key, 16)
+        except (AttributeError, ValueError):
+            return None
+        plies = len(self.move_history)
+        if not 0 <= ply <= plies:
+            return None
+        self._ensure_records()
+        if key != (self.deltas[ply - 1][0] if ply else zobrist.zobrist_hash(chess.Board(self.start_fen))):
+            return None
+
+        board = self.board
+        if plies - ply <= len(board.move_stack):
+            # Usually the move just pushed: step back on a copy rather than replay
+            base = board.copy(stack=plies - ply)
+            for _ in range(plies - ply):
+                base.pop()
+        else:
+            base = self.position_at(ply).board
+        changed = ((base.pawns ^ board.pawns) | (base.knights ^ board.knights) |
+                   (base.bishops ^ board.bishops) | (base.rooks ^ board.rooks) |
+                   (base.queens ^ board.queens) | (base.kings ^ board.kings) |
+                   (base.occupied_co[chess.WHITE] ^ board.occupied_co[chess.WHITE]))
+        squares = []
+        for square in chess.scan_forward(changed):
+            piece = board.piece_at(square)
+            squares.append([square, piece.symbol() if piece is not None else ""])
+        played = [pack_move(chess.Move.from_uci(uci), bool(flags & self.DELTA_KINGS_STEP))
+                  for uci, (_, flags) in zip(self.move_history[ply:], self.deltas[ply:])]
+        # The acknowledged position was usually served just before, so its
+        # moves come from the position cache
+        base_key = position_key(base)
+        base_info = self.position_cache.get(base_key) if self.position_cache is not None else None
+        if base_info is None:
+            base_info = compute_position_info(base, tablebase=self.tablebase)
+        return {
+            "since": ply,
+            "squares": squares,
+            "fenTail": board.fen().split(' ', 1)[1],
+            "played": played,
+            "changedMoves": diff_move_groups(base_info.move_groups, self.position_info().move_groups)
+        }
+
+    def load_records(self, deltas, keyframes):
+        """Restore saved per-ply records (see __init__); stale ones are rebuilt when needed."""
+        plies = len(self.move_history)
+        if deltas is None or keyframes is None or len(deltas) != plies or \
+                len(keyframes) != plies // self.KEYFRAME_INTERVAL + 1 or keyframes[0] != self.start_fen:
+            # Missing (a game stored before them) or inconsistent
+            self.deltas = self.keyframes = None
+            return
+        self.deltas = [tuple(delta) for delta in deltas]
+        self.keyframes = list(keyframes)
+
+    def _ensure_records(self):
+        """Rebuild missing per-ply records by replaying the game once."""
+        if self.deltas is not None:
+            return
+        board = type(self)(self.start_fen)
+        for uci in self.move_history:
+            board.push(chess.Move.from_uci(uci))
+        self.deltas, self.keyframes = board.deltas, board.keyframes
+
+    def _rewind(self, ply):
+        """Go back to ply from the per-ply records, dropping the moves after it."""
+        self._ensure_records()
+        interval = self.KEYFRAME_INTERVAL
+        del self.move_history[ply:]
+        del self.deltas[ply:]
+        del self.keyframes[ply // interval + 1:]
+
+        board = chess.Board(self.keyframes[-1])
+        for uci in self.move_history[(len(self.keyframes) - 1) * interval:]:
+            board.push(chess.Move.from_uci(uci))
+        self.board = board
+        self._undo_stack = []
+
+        # Zobrist keys of the positions since the last irreversible move
+        start = ply
+        while start > 0 and not self.deltas[start - 1][1] & self.DELTA_IRREVERSIBLE:
+            start -= 1
+        history = [delta[0] for delta in self.deltas[max(start - 1, 0):ply]]
+        if start == 0:
+            history.insert(0, zobrist.zobrist_hash(chess.Board(self.start_fen)))
+        self.zobrist_key = history[-1]
+        self.load_position_history(history)
+
+        if ply:
+            self.last_move = chess.Move.from_uci(self.move_history[-1])
+            self.last_move_kings_step = bool(self.deltas[-1][1] & self.DELTA_KINGS_STEP)
+        else:
+            self.last_move, self.last_move_kings_step = None, False
+        self._clear_cache()
+        self._status_cache = None
+        self.termination_reason = self.game_status().game_over_reason
+
+    def fen(self):
+        """Get the FEN of the current position."""
+        return self.board.fen()
+
+    def turn(self):
+        """Get the side to move."""
+        return self.board.turn
+
+    def is_check(self):
+        """Check if the current side to move is in check."""
+        return self.board.is_check()
+
+    def is_checkmate(self):
+        """Check if the current position is checkmate."""
+        # A position is checkmate when the king is in check and there are no legal moves
+        # Use all legal moves (including King's Step) for consistent detection
+        return self.board.is_check() and len(self.legal_moves()) == 0
+
+    def is_stalemate(self):
+        """Check if the current position is stalemate."""
+        # A position is stalemate when the king is not in check and there are no legal moves
+        # Use all legal moves (including King's Step) for consistent detection
+        return not self.board.is_check() and len(self.legal_moves()) == 0
+
+    def is_insufficient_material(self):
+        """Check if there's insufficient material to checkmate."""
+        # Variant rules, see game_status.is_insufficient_material
+        return self.position_info().is_insufficient_material
+
+    def is_threefold_repetition(self):
+        """Check if the current position has occurred three times."""
+        # Same pieces, side to move, castling and en passant rights
+        return self._repetition_counts.get(self.zobrist_key, 0) >= 3
+
+    def is_fifty_moves(self):
+        """Check if the fifty-move rule applies."""
+        # Check if the fifty-move rule applies (no captures or pawn moves in the last 50 moves)
+        return self.board.halfmove_clock >= 100  # 50 full moves = 100 half-moves
+
+    def is_game_over(self):
+        """Check if the game has ended (checkmate, stalemate or a draw rule)."""
+        return self.game_status().is_game_over
+
+    def king(self, color):
+        """Get the square of the king of the given color."""
+        return self.board.king(color)
+
+    def is_kings_step_move(self, move):
+        """Determine if a move is a King's Step move."""
+        # Convert string move to Move object if necessary
+        if isinstance(move, str):
+            try:
+                move = chess.Move.from_uci(move)
+            except ValueError:
+                return False
+        
+        # Legal moves carry their own tag from move generation
+        for tagged in self.tagged_legal_moves():
+            if tagged.move == move:
+                return tagged.is_kings_step
+            
+        piece = self.board.piece_at(move.from_square)
+        if piece is None or piece.piece_type in [chess.KING, chess.QUEEN]:
+            return False
+            
+        # Calculate Manhattan distance
+        from_file = chess.square_file(move.from_square)
+        from_rank = chess.square_rank(move.from_square)
+        to_file = chess.square_file(move.to_square)
+        to_rank = chess.square_rank(move.to_square)
+        
+        # King's Step is one square in any direction
+        file_diff = abs(from_file - to_file)
+        rank_diff = abs(from_rank - to_rank)
+        
+        # Basic King's Step check
+        is_kings_step = file_diff <= 1 and rank_diff <= 1 and not (file_diff == 0 and rank_diff == 0)
+        
+        # For pawns, normal forward moves and captures aren't King's Step
+        if piece.piece_type == chess.PAWN:
+            direction = 1 if piece.color == chess.WHITE else -1
+            
+            # Normal forward move
+            if file_diff == 0 and (to_rank - from_rank) == direction:
+                return False
+                
+            # Initial two-square move
+            if file_diff == 0 and from_rank in [1, 6] and abs(to_rank - from_rank) == 2:
+                return False
+                
+            # Normal capture
+            if file_diff == 1 and (to_rank - from_rank) == direction:
+                return False
+        
+        # For knights, L-shape moves aren't King's Step
+        if piece.piece_type == chess.KNIGHT:
+            if (file_diff == 1 and rank_diff == 2) or (file_diff == 2 and rank_diff == 1):
+                return False
+        
+        # For bishops, diagonal moves aren't King's Step
+        if piece.piece_type == chess.BISHOP:
+            if file_diff == rank_diff:
+                return False
+        
+        # For rooks, horizontal and vertical moves aren't King's Step
+        if piece.piece_type == chess.ROOK:
+            if file_diff == 0 or rank_diff == 0:
+                return False
+        
+        # If it passed all the above checks and is within 1 square, it's a King's Step
+        return is_kings_step
+
+
+        
+    def get_pin_direction_and_attacker(self, square):
+        """Get the direction of the pin and the attacker's square for a pinned piece.
+        
+        Returns a tuple (file_dir, rank_dir, attacker_square) or None if not pinned.
+        """
+        piece = self.board.piece_at(square)
+        if piece is None:
+            return None
+            
+        color = piece.color
+        king_square = self.board.king(color)
+        
+        # Check if pinned using our main method
+        is_pinned, file_dir, rank_dir = self.is_pinned_against_king(square)
+        if not is_pinned:
+            return None
+            
+        # Look for the attacker in the direction from the piece away from the king
+        piece_file = chess.square_file(square)
+        piece_rank = chess.square_rank(square)
+        attacker_square = None
+        current_file = piece_file + file_dir
+        current_rank = piece_rank + rank_dir
+        
+        while 0 <= current_file <= 7 and 0 <= current_rank <= 7:
+            current_square = chess.square(current_file, current_rank)
+            current_piece = self.board.piece_at(current_square)
+            
+            if current_piece is not None:
+                # Check if this piece could be pinning our piece
+                if current_piece.color != color:
+                    # Horizontal or vertical pin
+                    if (file_dir != 0 and rank_dir == 0) or (file_dir == 0 and rank_dir != 0):
+                        if current_piece.piece_type in [chess.ROOK, chess.QUEEN]:
+                            attacker_square = current_square
+                            break
+                    # Diagonal pin
+                    elif file_dir != 0 and rank_dir != 0:
+                        if current_piece.piece_type in [chess.BISHOP, chess.QUEEN]:
+                            attacker_square = current_square
+                            break
+                
+                # If we hit any other piece first, there's no pin from this direction
+                break
+                
+            current_file += file_dir
+            current_rank += rank_dir
+            
+        return (file_dir, rank_dir, attacker_square) if attacker_square is not None else None
+    
+    def is_move_along_pin_line(self, move):
+        """Check if a move is along the pin line (connecting the king, piece, and attacker).
+        
+        If a piece is pinned, it can only move along the line of the pin.
+        """
+        from_square = move.from_square
+        to_square = move.to_square
+        
+        # Get pin information
+        pin_info = self.get_pin_direction_and_attacker(from_square)
+        if pin_info is None:
+            # Not pinned, any move is allowed
+            return True
+            
+        file_dir, rank_dir, attacker_square = pin_info
+        
+        # Calculate positions
+        king_square = self.board.king(self.board.piece_at(from_square).color)
+        king_file = chess.square_file(king_square)
+        king_rank = chess.square_rank(king_square)
+        to_file = chess.square_file(to_square)
+        to_rank = chess.square_rank(to_square)
+        
+        # For a move to be along the pin line, it must:
+        # 1. Be on the same rank, file, or diagonal as the king and piece
+        # 2. Be between the king and the attacker or beyond the king in the opposite direction
+        
+        # Check if the target is on the same line as the king
+        if file_dir == 0:  # Vertical pin
+            if to_file != king_file:
+                return False
+        elif rank_dir == 0:  # Horizontal pin
+            if to_rank != king_rank:
+                return False
+        else:  # Diagonal pin
+            # Check if on the same diagonal
+            if abs(to_file - king_file) != abs(to_rank - king_rank):
+                return False
+                
+            # Check if the direction matches
+            to_file_dir = 1 if king_file < to_file else -1
+            to_rank_dir = 1 if king_rank < to_rank else -1
+            
+            if to_file_dir != file_dir or to_rank_dir != rank_dir:
+                # Allow moves in the opposite direction (away from the attacker, behind the king)
+                if to_file_dir != -file_dir or to_rank_dir != -rank_dir:
+                    return False
+        
+        return True
+
+def board_to_state(board):
+    """Serialize the board into a JSON-ready dict for the game store."""
+    return {
+        "fen": board.fen(),
+        "start_fen": board.start_fen,
+        "moves": board.move_history,
+        "position_history": board.position_history,
+        "last_move_uci": board.last_move.uci() if board.last_move else None,
+        "last_move_kings_step": board.last_move_kings_step,
+        "termination_reason": board.termination_reason,
+        "deltas": board.deltas,
+        "keyframes": board.keyframes
+    }
+
+def board_from_state(state):
+    """Rebuild a board from a dict produced by board_to_state."""
+    board = TwoHSChessBoard(fen=state['fen'])
+    if 'start_fen' in state:
+        board.start_fen = state['start_fen']
+        board.move_history = list(state.get('moves', []))
+        board.load_records(state.get('deltas'), state.get('keyframes'))
+    board.load_position_history(state.get('position_history'))
+    last_move_uci = state.get('last_move_uci')
+    if last_move_uci:
+        try:
+            board.last_move = chess.Move.from_uci(last_move_uci)
+            board.last_move_kings_step = state.get('last_move_kings_step', False)
+        except ValueError:
+            board.last_move = None  # Handle invalid UCI in stored state
+    board.termination_reason = state.get('termination_reason')
+    return board
@@ -0,0 +1,403 @@
+"""
+ASHA CHESS search engine.
+
+Negamax alpha-beta search on the variant move generator (movegen), with:
+- iterative deepening, so a result is always available when time runs out
+- a transposition table keyed by Zobrist key
+- move ordering: transposition table move, captures (most valuable victim
+  first), standard quiet moves, then King's Steps
+- quiescence search on classic captures only (King's Steps never capture)
+- a hard time and node budget per search
+- optional endgame tablebase probes (tablebase.py) for exact scores
+"""
+import time
+from collections import namedtuple
+
+import chess
+
+from movegen import generate_moves, MoveLists
+import zobrist
+
+PIECE_VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 300,
+    chess.BISHOP: 330,  # King's Steps let bishops change colour
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 0
+}
+
+MATE_SCORE = 100000
+# Scores beyond this are mates, stored relative to the node in the table
+MATE_THRESHOLD = MATE_SCORE - 1000
+MAX_DEPTH = 64
+
+# Transposition table entry flags
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# Bonus for knights and bishops on central squares: (mask, bonus) per ring
+_CENTER = chess.BB_D4 | chess.BB_E4 | chess.BB_D5 | chess.BB_E5
+_CENTER_BOX = ((chess.BB_FILE_C | chess.BB_FILE_D | chess.BB_FILE_E | chess.BB_FILE_F) &
+               (chess.BB_RANK_3 | chess.BB_RANK_4 | chess.BB_RANK_5 | chess.BB_RANK_6))
+_CENTER_RINGS = [(_CENTER, 14), (_CENTER_BOX & ~_CENTER, 8)]
+
+SearchResult = namedtuple('SearchResult', [
+    'best_move',        # chess.Move, or None when there are no legal moves
+    'is_kings_step',
+    'score',            # centipawns from the side to move's point of view
+    'depth',            # last fully completed iteration
+    'nodes',
+    'seconds',
+    'pv',               # principal variation, list of chess.Move
+    'book'              # True if the move came from the opening book
+], defaults=(False,))
+
+AnalysisLine = namedtuple('AnalysisLine', [
+    'move',
+    'is_kings_step',
+    'score',            # exact score of the move at this line's depth
+    'depth',
+    'pv'
+])
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node budget is exhausted."""
+
+
+def evaluate(board):
+    """Static evaluation in centipawns from the side to move's point of view."""
+    score = 0
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        occupied = board.occupied_co[color]
+        value = 0
+        for piece_type, mask in ((chess.PAWN, board.pawns), (chess.KNIGHT, board.knights),
+                                 (chess.BISHOP, board.bishops), (chess.ROOK, board.rooks),
+                                 (chess.QUEEN, board.queens)):
+            value += PIECE_VALUES[piece_type] * chess.popcount(mask & occupied)
+
+        minors = (board.knights | board.bishops) & occupied
+        for ring, bonus in _CENTER_RINGS:
+            value += bonus * chess.popcount(minors & ring)
+
+        # Advanced pawns are closer to promotion
+        pawns = board.pawns & occupied
+        for rank in range(1, 7):
+            advance = rank - 1 if color == chess.WHITE else 6 - rank
+            if advance:
+                value += 4 * advance * chess.popcount(pawns & chess.BB_RANKS[rank])
+        score += sign * value
+    return score if board.turn == chess.WHITE else -score
+
+
+def _capture_value(board, move):
+    victim = board.piece_type_at(move.to_square) or chess.PAWN  # en passant
+    attacker = board.piece_type_at(move.from_square)
+    return PIECE_VALUES[victim] * 10 - PIECE_VALUES[attacker]
+
+
+def order_moves(board, tagged_moves, tt_move=None):
+    """
+    Sort moves for the search: TT move, captures by MVV-LVA, promotions,
+    quiet standard moves, King's Steps.
+    """
+    def priority(tagged):
+        move = tagged.move
+        if move == tt_move:
+            return 1000000
+        if tagged.is_capture:
+            return 100000 + _capture_value(board, move)
+        if move.promotion:
+            return 50000 + PIECE_VALUES[move.promotion]
+        return 0 if tagged.is_kings_step else 1
+    return sorted(tagged_moves, key=priority, reverse=True)
+
+
+class Searcher:
+    """One search with its own budget, counters and transposition table."""
+
+    def __init__(self, time_limit=1.0, node_limit=None, tt_size=200000, should_stop=None,
+                 max_depth=MAX_DEPTH, tablebase=None):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        # Optional tablebase.Tablebase: exact scores once few enough men are left
+        self.tablebase = tablebase
+        # Optional callable polled during the search; returning True aborts it
+        self.should_stop = should_stop
+        self.tt_size = tt_size
+        self.tt = {}
+        self.nodes = 0
+        self._deadline = None
+        self._path = []
+        # Sibling nodes differ by a move or two: most piece move lists carry over
+        self._move_lists = MoveLists()
+
+    def search(self, board, history=()):
+        """
+        Search a chess.Board and return a SearchResult.
+
+        history holds the Zobrist keys of the game so far (e.g.
+        TwoHSChessBoard.position_history); repeating one of them scores as
+        a draw.
+        """
+        start = time.perf_counter()
+        self._deadline = start + self.time_limit if self.time_limit else None
+        self.nodes = 0
+        board = board.copy(stack=False)
+        key = zobrist.zobrist_hash(board)
+        self._path = list(history[:-1]) if history and history[-1] == key else list(history)
+
+        root_moves = generate_moves(board)
+        if not root_moves:
+            score = -MATE_SCORE if board.is_check() else 0
+            return SearchResult(None, False, score, 0, 0, time.perf_counter() - start, [])
+
+        best = order_moves(board, root_moves)[0]
+        best_score, completed_depth = 0, 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score, move = self._root(board, key, root_moves, depth, best.move)
+            except SearchAborted:
+                break
+            best_score, completed_depth = score, depth
+            best = next(tagged for tagged in root_moves if tagged.move == move)
+            if abs(score) >= MATE_THRESHOLD:
+                # A forced mate was found; deeper iterations cannot improve it
+                break
+
+        seconds = time.perf_counter() - start
+        return SearchResult(best.move, best.is_kings_step, best_score, completed_depth,
+                            self.nodes, seconds, self._principal_variation(board, key, best.move, max(completed_depth, 1)))
+
+    def analyse(self, board, history=(), moves=None):
+        """
+        Score root moves exactly (multi-PV) and return AnalysisLines, best first.
+
+        Unlike search(), every root move is searched with a full window, so
+        each line's score is exact rather than a bound. moves restricts the
+        analysis to a subset of the legal root moves (e.g. one worker's share
+        of a parallel analysis); by default all of them are analysed.
+        """
+        start = time.perf_counter()
+        self._deadline = start + self.time_limit if self.time_limit else None
+        self.nodes = 0
+        board = board.copy(stack=False)
+        key = zobrist.zobrist_hash(board)
+        self._path = list(history[:-1]) if history and history[-1] == key else list(history)
+
+        root_moves = generate_moves(board)
+        if moves is not None:
+            wanted = set(moves)
+            root_moves = [tagged for tagged in root_moves if tagged.move in wanted]
+        lines = {tagged.move: AnalysisLine(tagged.move, tagged.is_kings_step, 0, 0, [tagged.move])
+                 for tagged in root_moves}
+
+        ordered = order_moves(board, root_moves)
+        self._path.append(key)
+        try:
+            for depth in range(1, self.max_depth + 1):
+                for tagged in ordered:
+                    child_key = zobrist.push(board, tagged.move, key)
+                    try:
+                        score = -self._negamax(board, child_key, depth - 1,
+                                               -MATE_SCORE - 1, MATE_SCORE + 1, 1)
+                    finally:
+                        board.pop()
+                    lines[tagged.move] = AnalysisLine(
+                        tagged.move, tagged.is_kings_step, score, depth,
+                        self._principal_variation(board, key, tagged.move, depth))
+                # Search the most promising moves first in the next iteration
+                ordered.sort(key=lambda tagged: lines[tagged.move].score, reverse=True)
+        except SearchAborted:
+            pass
+        finally:
+            self._path.pop()
+
+        return sorted(lines.values(), key=lambda line: (line.depth > 0, line.score), reverse=True)
+
+    def _check_budget(self):
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            if self._deadline is not None and time.perf_counter() > self._deadline:
+                raise SearchAborted()
+            if self.should_stop is not None and self.should_stop():
+                raise SearchAborted()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+
+    def _root(self, board, key, root_moves, depth, previous_best):
+        alpha, beta = -MATE_SCORE - 1, MATE_SCORE + 1
+        best_move = previous_best
+        self._path.append(key)
+        try:
+            for tagged in order_moves(board, root_moves, previous_best):
+                child_key = zobrist.push(board, tagged.move, key)
+                try:
+                    score = -self._negamax(board, child_key, depth - 1, -beta, -alpha, 1)
+                finally:
+                    board.pop()
+                if score > alpha:
+                    alpha, best_move = score, tagged.move
+        finally:
+            self._path.pop()
+        self._store(key, depth, alpha, EXACT, best_move, 0)
+        return alpha, best_move
+
+    def _negamax(self, board, key, depth, alpha, beta, ply):
+        self._check_budget()
+
+        if key in self._path or board.halfmove_clock >= 100:
+            return 0
+        if self.tablebase is not None and chess.popcount(board.occupied) <= self.tablebase.max_men:
+            probe = self.tablebase.probe(board)
+            if probe is not None:
+                if probe.wdl == 0:
+                    return 0
+                mate_in = MATE_SCORE - ply - probe.dtm
+                return mate_in if probe.wdl > 0 else -mate_in
+        if depth <= 0:
+            return self._quiescence(board, alpha, beta, ply)
+
+        original_alpha = alpha
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, flag, tt_move = entry
+            if entry_depth >= depth:
+                score = self._from_tt(entry_score, ply)
+                if flag == EXACT:
+                    return score
+                if flag == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                elif flag == UPPER_BOUND:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        tagged_moves = generate_moves(board, self._move_lists)
+        if not tagged_moves:
+            return -(MATE_SCORE - ply) if board.is_check() else 0
+
+        best_score, best_move = -MATE_SCORE - 1, None
+        self._path.append(key)
+        try:
+            for tagged in order_moves(board, tagged_moves, tt_move):
+                child_key = zobrist.push(board, tagged.move, key)
+                try:
+                    score = -self._negamax(board, child_key, depth - 1, -beta, -alpha, ply + 1)
+                finally:
+                    board.pop()
+                if score > best_score:
+                    best_score, best_move = score, tagged.move
+                if score > alpha:
+                    alpha = score
+                if alpha >= beta:
+                    break
+        finally:
+            self._path.pop()
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self._store(key, depth, best_score, flag, best_move, ply)
+        return best_score
+
+    def _quiescence(self, board, alpha, beta, ply):
+        """
+        Search classic captures only, until the position is quiet. In check
+        every evasion is searched, so mates at the horizon are still seen.
+        """
+        in_check = board.is_check()
+        if not in_check:
+            stand_pat = evaluate(board)
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+
+        tagged_moves = generate_moves(board, self._move_lists)
+        if not tagged_moves:
+            return -(MATE_SCORE - ply) if in_check else 0
+
+        if in_check:
+            captures = tagged_moves
+        else:
+            captures = [tagged for tagged in tagged_moves if tagged.is_capture]
+        for tagged in order_moves(board, captures):
+            self._check_budget()
+            board.push(tagged.move)
+            try:
+                score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def _store(self, key, depth, score, flag, move, ply):
+        if len(self.tt) >= self.tt_size:
+            # Crude but bounded: start over rather than track entry ages
+            self.tt.clear()
+        self.tt[key] = (depth, self._to_tt(score, ply), flag, move)
+
+    @staticmethod
+    def _to_tt(score, ply):
+        # Mate scores are stored as distance from this node, not from the root
+        if score >= MATE_THRESHOLD:
+            return score + ply
+        if score <= -MATE_THRESHOLD:
+            return score - ply
+        return score
+
+    @staticmethod
+    def _from_tt(score, ply):
+        if score >= MATE_THRESHOLD:
+            return score - ply
+        if score <= -MATE_THRESHOLD:
+            return score + ply
+        return score
+
+    def _principal_variation(self, board, key, first_move, max_length):
+        """Follow the transposition table from the root to build the PV."""
+        pv = []
+        board = board.copy(stack=False)
+        move, seen = first_move, set()
+        while move is not None and len(pv) < max_length and key not in seen:
+            if move not in [tagged.move for tagged in generate_moves(board)]:
+                break
+            seen.add(key)
+            pv.append(move)
+            key = zobrist.push(board, move, key)
+            entry = self.tt.get(key)
+            move = entry[3] if entry is not None else None
+        return pv
+
+
+def book_move(book, key):
+    """SearchResult of a weighted opening book move for Zobrist key, or None if not in the book."""
+    tagged = book.choose_move(key)
+    if tagged is None:
+        return None
+    return SearchResult(tagged.move, tagged.is_kings_step, 0, 0, 0, 0.0, [tagged.move], True)
+
+
+def search(board, time_limit=1.0, node_limit=None, max_depth=MAX_DEPTH, tablebase=None, book=None):
+    """
+    Find the best move for the side to move of a TwoHSChessBoard.
+
+    A position in the opening book (opening_book.OpeningBook) is answered
+    with a weighted book move at once. Otherwise the search stops after
+    time_limit seconds, node_limit nodes or max_depth plies, whichever comes
+    first, and returns the result of the deepest completed iteration.
+    time_limit=None searches without a clock.
+    """
+    result = book_move(book, board.zobrist_key) if book is not None else None
+    if result is not None:
+        return result
+    searcher = Searcher(time_limit=time_limit, node_limit=node_limit, max_depth=max_depth,
+                        tablebase=tablebase)
+    return searcher.search(board.board, history=board.position_history)
@@ -0,0 +1,372 @@
+"""
+ASHA CHESS game records: PGN export, streaming import and validation.
+
+Games are stored as PGN with a few conventions for the variant:
+
+- a [Variant "ASHA"] tag, and [SetUp "1"] / [FEN "..."] for other starting
+  positions
+- moves in SAN, computed against the variant's legal moves: a King's Step
+  that shares its SAN with another move gets the usual file/rank
+  disambiguation (the pawn King's Step e2-d3 is "ed3" when the push d2-d3
+  is "d3")
+- every King's Step is followed by a {KS} comment, so standard PGN tools
+  keep the annotation and ASHA readers can check it
+
+The reader streams an archive line by line and yields one game at a time,
+so memory stays bounded whatever the file size. Each game is replayed and
+validated through TwoHSChessBoard.make_move.
+
+Usage:
+    python game_record.py validate games.pgn
+    python game_record.py validate games.pgn --processes 4 --json
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+
+from board import TwoHSChessBoard
+from movegen import generate_moves
+
+KINGS_STEP_COMMENT = 'KS'
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+RawGame = namedtuple('RawGame', ['headers', 'movetext'])
+
+_HEADER_RE = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+_TOKEN_RE = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s{}();]+')
+
+
+class GameRecordError(Exception):
+    """An invalid game: bad FEN tag, unknown or illegal move, bad annotation or result."""
+
+    def __init__(self, message, ply=None):
+        super().__init__(message if ply is None else 'ply %d: %s' % (ply, message))
+        self.ply = ply
+
+
+# --- SAN ---------------------------------------------------------------------
+
+def _san_parts(board, tagged):
+    """Piece letter, capture flag and the rest (target square, promotion)."""
+    move = tagged.move
+    piece_type = board.piece_type_at(move.from_square)
+    letter = '' if piece_type == chess.PAWN else chess.piece_symbol(piece_type).upper()
+    rest = chess.square_name(move.to_square)
+    if move.promotion:
+        rest += '=' + chess.piece_symbol(move.promotion).upper()
+    return letter, tagged.is_capture, rest
+
+
+def san_moves(board, tagged_moves=None):
+    """
+    Map the SAN (without check suffix) of every legal move of a chess.Board
+    to its movegen.TaggedMove. SANs are unique among the variant's moves.
+    """
+    if tagged_moves is None:
+        tagged_moves = generate_moves(board)
+
+    groups = {}
+    for tagged in tagged_moves:
+        if not tagged.is_kings_step and board.is_castling(tagged.move):
+            san = 'O-O' if chess.square_file(tagged.move.to_square) > chess.square_file(tagged.move.from_square) else 'O-O-O'
+            groups.setdefault(san, []).append((tagged, None))
+            continue
+        letter, is_capture, rest = _san_parts(board, tagged)
+        # Pawn captures always name the origin file
+        hint = chess.FILE_NAMES[chess.square_file(tagged.move.from_square)] if letter == '' and is_capture else ''
+        san = letter + hint + ('x' if is_capture else '') + rest
+        groups.setdefault(san, []).append((tagged, (letter, is_capture, rest)))
+
+    sans = {}
+    for san, group in groups.items():
+        if len(group) == 1:
+            sans[san] = group[0][0]
+            continue
+        standard = [tagged for tagged, _ in group if not tagged.is_kings_step]
+        # Same SAN for several moves: a lone standard move keeps its plain SAN,
+        # as in ordinary chess, and the others are disambiguated by file, rank
+        # or square
+        for tagged, (letter, is_capture, rest) in group:
+            if standard == [tagged]:
+                sans[san] = tagged
+                continue
+            origin = tagged.move.from_square
+            others = [other.move.from_square for other, _ in group if other is not tagged]
+            if all(chess.square_file(o) != chess.square_file(origin) for o in others):
+                hint = chess.FILE_NAMES[chess.square_file(origin)]
+            elif all(chess.square_rank(o) != chess.square_rank(origin) for o in others):
+                hint = chess.RANK_NAMES[chess.square_rank(origin)]
+            else:
+                hint = chess.square_name(origin)
+            sans[letter + hint + ('x' if is_capture else '') + rest] = tagged
+    return sans
+
+
+def move_san(board, tagged, tagged_moves=None):
+    """SAN of a legal move on a chess.Board, with '+' or '#' suffix."""
+    san = next(san for san, other in san_moves(board, tagged_moves).items() if other.move == tagged.move)
+    board.push(tagged.move)
+    try:
+        if board.is_check():
+            san += '#' if not generate_moves(board) else '+'
+    finally:
+        board.pop()
+    return san
+
+
+# --- Export ------------------------------------------------------------------
+
+def game_result(board):
+    """PGN result of a TwoHSChessBoard: '1-0', '0-1', '1/2-1/2' or '*'."""
+    status = board.game_status()
+    if not status.is_game_over:
+        return '*'
+    if status.is_checkmate:
+        return '0-1' if board.board.turn == chess.WHITE else '1-0'
+    return '1/2-1/2'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def write_game(start_fen, moves, headers=None, result='*'):
+    """
+    Format a game as PGN text.
+
+    start_fen is the starting position and moves the UCI moves played from
+    it. headers (dict) adds to or overrides the default tags.
+    """
+    board = chess.Board(start_fen)
+    tags = {
+        "Event": "ASHA CHESS game",
+        "Site": "?",
+        "Date": time.strftime('%Y.%m.%d'),
+        "Round": "-",
+        "White": "?",
+        "Black": "?",
+        "Result": result,
+        "Variant": "ASHA"
+    }
+    if board.fen() != TwoHSChessBoard.VARIANT_STARTING_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = board.fen()
+    tags.update(headers or {})
+
+    tokens = []
+    for i, uci in enumerate(moves):
+        tagged_moves = generate_moves(board)
+        move = chess.Move.from_uci(uci)
+        tagged = next((t for t in tagged_moves if t.move == move), None)
+        if tagged is None:
+            raise GameRecordError('illegal move %s' % uci, ply=i + 1)
+        if board.turn == chess.WHITE:
+            tokens.append('%d.' % board.fullmove_number)
+        elif i == 0:
+            tokens.append('%d...' % board.fullmove_number)
+        tokens.append(move_san(board, tagged, tagged_moves))
+        if tagged.is_kings_step:
+            tokens.append('{%s}' % KINGS_STEP_COMMENT)
+        board.push(move)
+    tokens.append(tags["Result"])
+
+    lines = ['[%s "%s"]' % (name, _escape(value)) for name, value in tags.items()]
+    lines.append('')
+    # PGN export format: movetext lines of at most 80 characters
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def export_game(board, headers=None):
+    """PGN of a TwoHSChessBoard's game, from its start position to now."""
+    extra = {}
+    if board.termination_reason:
+        extra["Termination"] = board.termination_reason
+    extra.update(headers or {})
+    return write_game(board.start_fen, board.move_history, headers=extra, result=game_result(board))
+
+
+# --- Import ------------------------------------------------------------------
+
+def read_games(lines):
+    """
+    Yield a RawGame for each game in an iterable of PGN lines (e.g. an open
+    file). Only the current game is held in memory.
+    """
+    headers, movetext = {}, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('%'):
+            continue
+        match = _HEADER_RE.match(line)
+        if match:
+            if movetext:
+                # A tag after movetext starts the next game
+                yield RawGame(headers, '\n'.join(movetext))
+                headers, movetext = {}, []
+            headers[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+        elif line:
+            movetext.append(line)
+    if headers or movetext:
+        yield RawGame(headers, '\n'.join(movetext))
+
+
+def parse_movetext(movetext):
+    """
+    Split movetext into (san, annotated_kings_step) pairs for the main line
+    and the result token (None if missing). Variations and NAGs are skipped.
+    """
+    moves, result, depth = [], None, 0
+    for token in _TOKEN_RE.findall(movetext):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(0, depth - 1)
+        elif depth or token[0] in ';$' or token[0].isdigit() and token.endswith('.'):
+            continue
+        elif token[0] == '{':
+            if token[1:-1].strip() == KINGS_STEP_COMMENT and moves:
+                moves[-1] = (moves[-1][0], True)
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append((token, False))
+    return moves, result
+
+
+def replay_game(game):
+    """
+    Replay a RawGame through TwoHSChessBoard.make_move and return the board.
+
+    Raises GameRecordError if the FEN tag is malformed, a move is unknown or
+    illegal, a {KS} comment follows a standard move, or the Result tag
+    contradicts a finished game.
+    """
+    fen = game.headers.get('FEN', TwoHSChessBoard.VARIANT_STARTING_FEN)
+    try:
+        board = TwoHSChessBoard(fen=fen)
+    except ValueError as e:
+        raise GameRecordError('invalid FEN tag %r: %s' % (fen, e))
+    moves, result = parse_movetext(game.movetext)
+
+    for ply, (san, annotated) in enumerate(moves, start=1):
+        stripped = san.rstrip('+#!?')
+        sans = san_moves(board.board, board.tagged_legal_moves())
+        tagged = sans.get(stripped)
+        if tagged is None:
+            # Also accept UCI, as written by simpler tools
+            try:
+                move = chess.Move.from_uci(stripped)
+            except ValueError:
+                move = None
+            tagged = next((t for t in board.tagged_legal_moves() if t.move == move), None)
+        if tagged is None:
+            raise GameRecordError('illegal or unknown move %s' % san, ply=ply)
+        if annotated and not tagged.is_kings_step:
+            raise GameRecordError('%s is annotated as a King\'s Step but is not one' % san, ply=ply)
+        if not board.make_move(tagged.move.uci()):
+            raise GameRecordError('move %s rejected (game over?)' % san, ply=ply)
+
+    result = result or game.headers.get('Result', '*')
+    if board.is_game_over() and result != '*' and result != game_result(board):
+        raise GameRecordError('result %s does not match the final position (%s)'
+                              % (result, board.termination_reason))
+    return board
+
+
+# --- Bulk validation ---------------------------------------------------------
+
+def validate_games(lines, shard=0, shards=1, max_errors=20):
+    """
+    Replay every game of a PGN line stream (or every shards-th game, starting
+    at index shard) and return the counts and the first errors.
+    """
+    stats = {"games": 0, "valid": 0, "invalid": 0, "plies": 0, "errors": []}
+    for index, game in enumerate(read_games(lines)):
+        if index % shards != shard:
+            continue
+        stats["games"] += 1
+        try:
+            board = replay_game(game)
+        except GameRecordError as e:
+            stats["invalid"] += 1
+            if len(stats["errors"]) < max_errors:
+                stats["errors"].append({"game": index + 1, "error": str(e)})
+            continue
+        stats["valid"] += 1
+        stats["plies"] += len(board.move_history)
+    return stats
+
+
+def _validate_shard(path, shard, shards, max_errors):
+    # Worker process entry point: every worker streams the whole file but
+    # only replays its own games, so no game text crosses process boundaries
+    with open(path) as f:
+        return validate_games(f, shard, shards, max_errors)
+
+
+def validate_archive(path, processes=1, max_errors=20):
+    """Validate a PGN archive, optionally sharded over processes; returns a report."""
+    start = time.perf_counter()
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_validate_shard, [path] * processes, range(processes),
+                                  [processes] * processes, [max_errors] * processes))
+    elif path == '-':
+        parts = [validate_games(sys.stdin, max_errors=max_errors)]
+    else:
+        parts = [_validate_shard(path, 0, 1, max_errors)]
+    seconds = time.perf_counter() - start
+
+    report = {"path": path, "processes": processes}
+    for name in ("games", "valid", "invalid", "plies"):
+        report[name] = sum(part[name] for part in parts)
+    report["errors"] = sorted((e for part in parts for e in part["errors"]),
+                              key=lambda e: e["game"])[:max_errors]
+    report["seconds"] = round(seconds, 3)
+    report["gamesPerSecond"] = round(report["games"] / seconds, 1) if seconds > 0 else None
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASHA CHESS game record tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    validate = subparsers.add_parser('validate', help="replay and validate every game of a PGN file")
+    validate.add_argument('path', help="PGN file, or - for standard input")
+    validate.add_argument('--processes', type=int, default=1,
+                          help="worker processes, each replaying a share of the games")
+    validate.add_argument('--max-errors', type=int, default=20)
+    validate.add_argument('--json', action='store_true', help="print the report as JSON")
+
+    args = parser.parse_args(argv)
+    if args.path == '-' and args.processes > 1:
+        parser.error("--processes needs a file, not standard input")
+
+    report = validate_archive(args.path, processes=args.processes, max_errors=args.max_errors)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for error in report["errors"]:
+            print('game %d: %s' % (error["game"], error["error"]))
+        print('%d games (%d valid, %d invalid), %d plies in %.3fs, %.1f games/s' % (
+            report["games"], report["valid"], report["invalid"], report["plies"],
+            report["seconds"], report["gamesPerSecond"] or 0))
+    return 1 if report["invalid"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+GameStatus: everything the API reports about a position, computed once.
+
+The /api/board and /api/move routes used to ask the board for checkmate,
+stalemate, each draw rule and the move info separately, and several of those
+questions regenerated or re-scanned the legal moves. A GameStatus is built
+from a single legal move generation pass and serialized directly.
+
+The parts that depend only on the position (moves, move info, check) are
+kept in a PositionInfo, which can be shared between games through the
+position cache. Repetition, the fifty-move rule and the last move depend on
+the game's history and are evaluated per request.
+
+A GameStatus serializes two ways: to_dict is the original format, with
+square names and one boolean per status; to_compact_dict packs each move
+into about a byte (pack_moves) and the statuses into one bit field, for
+clients that ask for it (see the "Compact Responses" section of the README),
+optionally as the changes since a state the client acknowledged.
+"""
+import base64
+
+import chess
+
+from movegen import generate_moves
+
+# Bits of the "flags" field of the compact format
+FLAG_CHECK = 1
+FLAG_GAME_OVER = 2
+FLAG_CHECKMATE = 4
+FLAG_STALEMATE = 8
+FLAG_THREEFOLD_REPETITION = 16
+FLAG_FIFTY_MOVES = 32
+FLAG_INSUFFICIENT_MATERIAL = 64
+
+
+def pack_move(move, is_kings_step=False, is_capture=False):
+    """
+    A chess.Move as one integer: from square | to square << 6 | capture << 12
+    | King's Step << 13 | promotion piece type << 14 (squares 0-63, a1 = 0).
+    """
+    return (move.from_square | move.to_square << 6 | is_capture << 12 | is_kings_step << 13 |
+            (move.promotion or 0) << 14)
+
+
+def move_groups(tagged_moves):
+    """
+    Legal moves (TaggedMoves) grouped by origin square for the compact
+    format: {origin: bytes}, a byte per target with the square, bit 6 set
+    for a capture and bit 7 for a King's Step. The four promotions of a
+    pawn move share one target.
+    """
+    groups = {}
+    for tagged in tagged_moves:
+        target = tagged.move.to_square | tagged.is_capture << 6 | tagged.is_kings_step << 7
+        targets = groups.setdefault(tagged.move.from_square, [])
+        if target not in targets:
+            targets.append(target)
+    return {from_square: bytes(targets) for from_square, targets in groups.items()}
+
+
+def encode_move_groups(groups):
+    """
+    Base64 of move groups ({origin: bytes of targets}): per origin, a byte
+    with its square and a byte with its number of targets, then the targets.
+    """
+    data = bytearray()
+    for from_square, targets in groups.items():
+        data.append(from_square)
+        data.append(len(targets))
+        data.extend(targets)
+    return base64.b64encode(data).decode('ascii')
+
+
+def pack_moves(tagged_moves):
+    """Encode legal moves (TaggedMoves) for the compact format, see move_groups."""
+    return encode_move_groups(move_groups(tagged_moves))
+
+
+def diff_move_groups(old, new):
+    """
+    The move groups of new whose targets differ from old, encoded like
+    pack_moves; an origin that has no moves any more gets an empty group.
+    """
+    changed = {from_square: targets for from_square, targets in new.items()
+               if old.get(from_square) != targets}
+    for from_square in old:
+        if from_square not in new:
+            changed[from_square] = b''
+    return encode_move_groups(changed)
+
+
+class PositionInfo:
+    """
+    Legal moves of a position and everything derived from them alone.
+    Treat it as read-only: it may be shared between games.
+    """
+    __slots__ = ('tagged_moves', 'is_check', 'check_square', 'is_insufficient_material', '_move_info',
+                 '_move_groups', '_packed_moves')
+
+    def __init__(self, tagged_moves, is_check, check_square, is_insufficient_material):
+        self.tagged_moves = tagged_moves  # list of movegen.TaggedMove
+        self.is_check = is_check
+        self.check_square = check_square  # name of the king's square when in check, else None
+        self.is_insufficient_material = is_insufficient_material
+        self._move_info = None
+        self._move_groups = None
+        self._packed_moves = None
+
+    @property
+    def move_info(self):
+        """Moves grouped by origin square, split into quiet moves and captures."""
+        # Built on first use: searches and perft never need it
+        if self._move_info is None:
+            move_info = {}
+            for tagged in self.tagged_moves:
+                entry = move_info.setdefault(chess.square_name(tagged.move.from_square),
+                                             {"moves": [], "captures": []})
+                if tagged.is_capture:
+                    entry["captures"].append(chess.square_name(tagged.move.to_square))
+                else:
+                    entry["moves"].append(chess.square_name(tagged.move.to_square))
+            self._move_info = move_info
+        return self._move_info
+
+    @property
+    def move_groups(self):
+        """The legal moves grouped by move_groups, for the compact format and its deltas."""
+        if self._move_groups is None:
+            self._move_groups = move_groups(self.tagged_moves)
+        return self._move_groups
+
+    @property
+    def packed_moves(self):
+        """The legal moves encoded by pack_moves, for the compact format."""
+        if self._packed_moves is None:
+            self._packed_moves = encode_move_groups(self.move_groups)
+        return self._packed_moves
+
+
+def is_insufficient_material(board, tablebase=None):
+    """
+    Whether neither side can ever checkmate on a chess.Board.
+
+    python-chess's rule is for standard chess: it also draws bishops that all
+    stand on one colour, but King's Steps let bishops change colour. Only a
+    lone knight or bishop against a bare king has no mate position at all (the
+    loser has no pieces to step with, and attacks are the standard ones). If a
+    tablebase (see tablebase.py) covers the material it decides instead.
+    """
+    if tablebase is not None:
+        can_mate = tablebase.can_mate(board)
+        if can_mate is not None:
+            return not can_mate
+    if board.pawns or board.rooks or board.queens:
+        return False
+    return chess.popcount(board.knights | board.bishops) <= 1
+
+
+def compute_position_info(board, move_lists=None, tablebase=None):
+    """
+    Generate the legal moves of a chess.Board and wrap them in a PositionInfo.
+    move_lists is an optional movegen.MoveLists kept by the caller between
+    positions, tablebase an optional tablebase.Tablebase for the material rule.
+    """
+    tagged_moves = generate_moves(board, move_lists)
+
+    is_check = board.is_check()
+    king = board.king(board.turn)
+    check_square = chess.square_name(king) if is_check and king is not None else None
+
+    return PositionInfo(tagged_moves, is_check, check_square,
+                        is_insufficient_material(board, tablebase))
+
+
+class GameStatus:
+    """Snapshot of a TwoHSChessBoard position for the UI and the API."""
+
+    def __init__(self, board):
+        info = board.position_info()
+
+        self.fen = board.fen()
+        self.extended_fen = board.get_extended_fen()
+        self.turn = "white" if board.board.turn else "black"
+        self.ply = len(board.move_history)
+        self.tag = board.state_tag()
+        self.is_check = info.is_check
+        self.check_square = info.check_square
+        self._info = info
+
+        has_moves = bool(info.tagged_moves)
+        self.is_checkmate = self.is_check and not has_moves
+        self.is_stalemate = not self.is_check and not has_moves
+        self.is_insufficient_material = info.is_insufficient_material
+        self.is_threefold_repetition = board.is_threefold_repetition()
+        self.is_fifty_moves = board.is_fifty_moves()
+
+        # Same priority order as the termination reasons recorded by make_move
+        self.game_over_reason = None
+        if self.is_checkmate:
+            self.game_over_reason = "checkmate"
+        elif self.is_stalemate:
+            self.game_over_reason = "stalemate"
+        elif self.is_insufficient_material:
+            self.game_over_reason = "insufficient_material"
+        elif self.is_threefold_repetition:
+            self.game_over_reason = "threefold_repetition"
+        elif self.is_fifty_moves:
+            self.game_over_reason = "fifty_moves"
+        self.is_game_over = self.game_over_reason is not None
+
+        # Last move information for UI highlighting
+        self.last_move = None
+        self.packed_last_move = None
+        if board.last_move:
+            self.last_move = {
+                "from": chess.square_name(board.last_move.from_square),
+                "to": chess.square_name(board.last_move.to_square),
+                "isKingsStep": board.last_move_kings_step
+            }
+            self.packed_last_move = pack_move(board.last_move, board.last_move_kings_step)
+
+    @property
+    def move_info(self):
+        # Only the full format needs the grouped square names
+        return self._info.move_info
+
+    def to_dict(self):
+        """JSON-ready dict in the format the frontend expects."""
+        return {
+            "fen": self.fen,
+            "extendedFen": self.extended_fen,
+            "turn": self.turn,
+            "ply": self.ply,
+            "moveInfo": self.move_info,
+            "isCheck": self.is_check,
+            "isGameOver": self.is_game_over,
+            "gameOverReason": self.game_over_reason,
+            "isCheckmate": self.is_checkmate,
+            "isStalemate": self.is_stalemate,
+            "isThreefoldRepetition": self.is_threefold_repetition,
+            "isFiftyMoves": self.is_fifty_moves,
+            "isInsufficientMaterial": self.is_insufficient_material,
+            "inCheck": self.check_square,
+            "lastMove": self.last_move
+        }
+
+    def to_compact_dict(self, delta=None):
+        """
+        JSON-ready dict of the compact format: the state tag, ply and FEN,
+        the legal moves (pack_moves), the statuses as FLAG_* bits, the game
+        over reason if any and the last move (pack_move) if any. Given a
+        delta (see TwoHSChessBoard.state_delta), its fields replace the FEN
+        and the legal moves.
+        """
+        flags = ((FLAG_CHECK if self.is_check else 0) |
+                 (FLAG_GAME_OVER if self.is_game_over else 0) |
+                 (FLAG_CHECKMATE if self.is_checkmate else 0) |
+                 (FLAG_STALEMATE if self.is_stalemate else 0) |
+                 (FLAG_THREEFOLD_REPETITION if self.is_threefold_repetition else 0) |
+                 (FLAG_FIFTY_MOVES if self.is_fifty_moves else 0) |
+                 (FLAG_INSUFFICIENT_MATERIAL if self.is_insufficient_material else 0))
+        state = {
+            "tag": self.tag,
+            "ply": self.ply
+        }
+        if delta is None:
+            state["fen"] = self.fen
+            state["moves"] = self._info.packed_moves
+        else:
+            state.update(delta)
+        state["flags"] = flags
+        if self.game_over_reason is not None:
+            state["reason"] = self.game_over_reason
+        if self.packed_last_move is not None:
+            state["last"] = self.packed_last_move
+        return state
+
+    def game_over_dict(self):
+        """The game-over fields only, for rejecting moves after the game ended."""
+        return {
+            "isGameOver": self.is_game_over,
+            "gameOverReason": self.game_over_reason,
+            "isCheckmate": self.is_checkmate,
+            "isStalemate": self.is_stalemate,
+            "isThreefoldRepetition": self.is_threefold_repetition,
+            "isFiftyMoves": self.is_fifty_moves,
+            "isInsufficientMaterial": self.is_insufficient_material
+        }
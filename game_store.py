@@ -0,0 +1,177 @@
+"""
+Server-side storage for game state, keyed by game id.
+
+The session cookie only carries the game id; the board state itself (FEN,
+position history, last move, termination reason) lives in a game store:
+
+- MemoryGameStore: in-process LRU with a size limit and an idle TTL. Fast,
+  but games are lost on restart and not shared between worker processes.
+- SQLiteGameStore: a local SQLite database, shared by all workers on the
+  machine and surviving restarts.
+
+Pick one with create_game_store(), which reads the GAME_STORE* environment
+variables. SQLite is the default: with the memory store, each gunicorn
+worker would see only the games it created.
+"""
+from abc import ABC, abstractmethod
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Games idle for longer than this are dropped (seconds)
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_GAMES = 10000
+# Next to the app, whatever directory it is started from
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'games.sqlite3')
+
+
+class GameStore(ABC):
+    """Interface of a game store. States are JSON-serializable dicts."""
+
+    @abstractmethod
+    def get(self, game_id):
+        """Return the stored state for game_id, or None if unknown or expired."""
+
+    @abstractmethod
+    def put(self, game_id, state):
+        """Store (or replace) the state for game_id."""
+
+    @abstractmethod
+    def delete(self, game_id):
+        """Forget game_id. Unknown ids are ignored."""
+
+
+class MemoryGameStore(GameStore):
+    """In-memory LRU game store with a maximum size and an idle TTL."""
+
+    def __init__(self, max_games=DEFAULT_MAX_GAMES, ttl=DEFAULT_TTL):
+        self.max_games = max_games
+        self.ttl = ttl
+        self._games = OrderedDict()  # game_id -> (last_access, state)
+        self._lock = threading.Lock()
+
+    def get(self, game_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is None:
+                return None
+            if self.ttl and now - entry[0] > self.ttl:
+                del self._games[game_id]
+                return None
+            self._games[game_id] = (now, entry[1])
+            self._games.move_to_end(game_id)
+            return entry[1]
+
+    def put(self, game_id, state):
+        now = time.monotonic()
+        with self._lock:
+            self._games[game_id] = (now, state)
+            self._games.move_to_end(game_id)
+            self._evict(now)
+
+    def delete(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def __len__(self):
+        return len(self._games)
+
+    def _evict(self, now):
+        # Least recently used games sit at the front
+        while len(self._games) > self.max_games:
+            self._games.popitem(last=False)
+        while self._games and self.ttl:
+            oldest_id, (last_access, _) = next(iter(self._games.items()))
+            if now - last_access <= self.ttl:
+                break
+            del self._games[oldest_id]
+
+
+class SQLiteGameStore(GameStore):
+    """
+    Game store persisted in a local SQLite database. The database is opened
+    (and created) on first use, not when the store is built.
+    """
+
+    # How often expired games are purged (seconds)
+    PURGE_INTERVAL = 10 * 60
+    # A read marks the game as used if its timestamp is older than this
+    # (seconds), so that reading every second does not write every second
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._last_purge = 0
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            # WAL lets several worker processes read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS games ("
+                    "game_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+            self._local.conn = conn
+        return conn
+
+    def get(self, game_id):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT state, updated_at FROM games WHERE game_id = ?", (game_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl and now - row[1] > self.ttl:
+            self.delete(game_id)
+            return None
+        # The TTL counts from the last use, as in the memory store
+        if self.ttl and now - row[1] > self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE games SET updated_at = ? WHERE game_id = ?", (now, game_id))
+        return json.loads(row[0])
+
+    def put(self, game_id, state):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO games (game_id, state, updated_at) VALUES (?, ?, ?)",
+                (game_id, json.dumps(state, separators=(',', ':')), now)
+            )
+            if self.ttl and now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                conn.execute("DELETE FROM games WHERE updated_at < ?", (now - self.ttl,))
+
+    def delete(self, game_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+
+
+def create_game_store():
+    """
+    Build the game store configured by the environment:
+
+    GAME_STORE            "sqlite" (default) or "memory" (single worker process only)
+    GAME_STORE_PATH       SQLite database file (default: games.sqlite3 next to this module)
+    GAME_STORE_MAX_GAMES  maximum games kept by the memory store
+    GAME_STORE_TTL        seconds an idle game is kept, 0 to keep forever
+    """
+    kind = os.environ.get('GAME_STORE', 'sqlite').lower()
+    ttl = int(os.environ.get('GAME_STORE_TTL', DEFAULT_TTL))
+    if kind == 'sqlite':
+        return SQLiteGameStore(os.environ.get('GAME_STORE_PATH', DEFAULT_PATH), ttl=ttl)
+    if kind == 'memory':
+        max_games = int(os.environ.get('GAME_STORE_MAX_GAMES', DEFAULT_MAX_GAMES))
+        return MemoryGameStore(max_games=max_games, ttl=ttl)
+    raise ValueError("Unknown GAME_STORE %r (expected 'memory' or 'sqlite')" % kind)
@@ -0,0 +1,487 @@
+"""
+HTTP load test for the ASHA CHESS API.
+
+Simulates concurrent players, each with its own session cookie and
+keep-alive connection, playing random legal games against a server
+started locally: every turn a player reloads the board (GET /api/board)
+and plays one of the legal moves it lists (POST /api/move). When the game
+ends, or after --max-plies, the player starts a new one (POST
+/api/reset).
+
+Concurrency is ramped in stages (--concurrency 1,4,16): players that
+joined in a stage keep playing their game in the next ones. Each stage
+runs for --duration seconds after a --warmup, and reports the throughput
+and the p50/p95/p99 latency of every endpoint. Runs are saved as JSON so
+a run can be compared with an earlier one, e.g. before and after a
+deploy.
+
+Everything runs on this machine and needs no network access. The server
+is started for the run (Flask development server or gunicorn, as in
+requirements.txt), or an already running one is used with --url. The
+players are threads in this process, so on a small machine they compete
+with the server for the CPU: compare runs made on the same machine with
+the same options.
+
+Usage:
+    python loadtest.py run --concurrency 1,4,16 --duration 20 --out before.json
+    python loadtest.py run --server gunicorn --workers 4 --threads 4 --out after.json
+    python loadtest.py run --url http://127.0.0.1:5000 --concurrency 8
+    python loadtest.py compare before.json after.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+ENDPOINTS = ('GET /api/board', 'POST /api/move', 'POST /api/reset')
+PERCENTILES = (50, 95, 99)
+DEFAULT_PORT = 5055
+SERVER_START_TIMEOUT = 30
+
+
+class Player:
+    """One simulated player: a session cookie, a connection and a game in progress."""
+
+    def __init__(self, host, port, rng, max_plies=200, think=0.0, timeout=30):
+        self.host = host
+        self.port = port
+        self.rng = rng
+        self.max_plies = max_plies
+        self.think = think
+        self.timeout = timeout
+        self.connection = None
+        self.cookies = {}
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}  # seconds
+        self.errors = dict.fromkeys(ENDPOINTS, 0)
+        self.recording = False
+
+    def request(self, method, path, body=None):
+        """Send a request and record its latency. Returns (status, JSON data or None)."""
+        endpoint = '%s %s' % (method, path)
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            self.connection = None
+            if self.recording:
+                self.errors[endpoint] += 1
+            return None, None
+        seconds = time.perf_counter() - start
+
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.coded_value
+        if self.recording:
+            self.latencies[endpoint].append(seconds)
+            if response.status >= 400:
+                self.errors[endpoint] += 1
+        try:
+            return response.status, json.loads(payload)
+        except ValueError:
+            return response.status, None
+
+    def turn(self):
+        """Reload the board and play a random legal move, or start a new game."""
+        status, state = self.request('GET', '/api/board')
+        if status != 200 or state is None:
+            return
+        move = None
+        if not state['isGameOver'] and state['ply'] < self.max_plies:
+            move = choose_move(state, self.rng)
+        if move is None:
+            self.request('POST', '/api/reset')
+            return
+        self.request('POST', '/api/move', {"move": move})
+
+    def play(self, record_from, deadline):
+        """Take turns until deadline; requests are recorded from record_from on."""
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            self.recording = now >= record_from
+            self.turn()
+            if self.think:
+                time.sleep(self.think)
+        self.recording = False
+
+    def take_results(self):
+        """The latencies and errors recorded so far, resetting them."""
+        latencies, errors = self.latencies, self.errors
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = dict.fromkeys(ENDPOINTS, 0)
+        return latencies, errors
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def choose_move(state, rng):
+    """A random legal move (UCI) from a /api/board state, or None if there is none."""
+    moves = []
+    for from_square, entry in state['moveInfo'].items():
+        moves.extend((from_square, to_square, False) for to_square in entry['moves'])
+        moves.extend((from_square, to_square, True) for to_square in entry['captures'])
+    if not moves:
+        return None
+    from_square, to_square, is_capture = rng.choice(moves)
+    move = from_square + to_square
+    # moveInfo lists squares only. A pawn capturing onto the last rank
+    # promotes; its forward step there may promote or be a King's Step.
+    piece = piece_at(state['fen'], from_square)
+    if (piece, from_square[1], to_square[1]) in (('P', '7', '8'), ('p', '2', '1')):
+        if is_capture or (from_square[0] == to_square[0] and rng.random() < 0.5):
+            move += 'q'
+    return move
+
+
+def piece_at(fen, square):
+    """The FEN letter of the piece on a square ('' if empty)."""
+    file, rank = ord(square[0]) - ord('a'), int(square[1])
+    row = fen.split()[0].split('/')[8 - rank]
+    column = 0
+    for char in row:
+        if char.isdigit():
+            column += int(char)
+        else:
+            if column == file:
+                return char
+            column += 1
+        if column > file:
+            break
+    return ''
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, errors, seconds):
+    """Throughput and latency statistics (milliseconds) of one endpoint or of all of them."""
+    values = sorted(latencies)
+    summary = {
+        "requests": len(values),
+        "errors": errors,
+        "throughput": round(len(values) / seconds, 2) if seconds > 0 else None
+    }
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary["p%d" % p] = round(value * 1000, 3) if value is not None else None
+    summary["mean"] = round(sum(values) / len(values) * 1000, 3) if values else None
+    summary["max"] = round(values[-1] * 1000, 3) if values else None
+    return summary
+
+
+def run_stage(players, duration, warmup):
+    """Let every player play for warmup + duration seconds; statistics cover the duration."""
+    start = time.monotonic()
+    record_from = start + warmup
+    deadline = record_from + duration
+    threads = [threading.Thread(target=player.play, args=(record_from, deadline), daemon=True)
+               for player in players]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Requests still in flight at the deadline finish late; count the real span
+    seconds = max(time.monotonic() - record_from, duration)
+
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    errors = dict.fromkeys(ENDPOINTS, 0)
+    for player in players:
+        player_latencies, player_errors = player.take_results()
+        for endpoint in ENDPOINTS:
+            latencies[endpoint].extend(player_latencies[endpoint])
+            errors[endpoint] += player_errors[endpoint]
+
+    every = [value for endpoint in ENDPOINTS for value in latencies[endpoint]]
+    return {
+        "concurrency": len(players),
+        "seconds": round(seconds, 3),
+        "total": summarize(every, sum(errors.values()), seconds),
+        "endpoints": {endpoint: summarize(latencies[endpoint], errors[endpoint], seconds)
+                      for endpoint in ENDPOINTS}
+    }
+
+
+def run_load_test(host, port, concurrency, duration, warmup=2.0, max_plies=200, think=0.0,
+                  seed=None, progress=None):
+    """
+    Ramp the number of players through the concurrency levels and return
+    one result per stage (see run_stage).
+    """
+    rng = random.Random(seed)
+    players, stages = [], []
+    try:
+        for level in concurrency:
+            while len(players) < level:
+                players.append(Player(host, port, random.Random(rng.random()), max_plies=max_plies,
+                                      think=think))
+            stage = run_stage(players[:level], duration, warmup)
+            stages.append(stage)
+            if progress is not None:
+                progress(stage)
+    finally:
+        for player in players:
+            player.close()
+    return stages
+
+
+# --- Server ------------------------------------------------------------------
+
+class LocalServer:
+    """
+    The app started in a subprocess for a run: the Flask development
+    server (threaded) or gunicorn. The server log and the game store of
+    the run go to a temporary directory, removed by stop().
+    """
+
+    def __init__(self, kind='dev', port=DEFAULT_PORT, workers=1, threads=8):
+        self.kind = kind
+        self.host = '127.0.0.1'
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.process = None
+        self.directory = None
+
+    def describe(self):
+        description = {"kind": self.kind}
+        if self.kind == 'gunicorn':
+            description.update(workers=self.workers, threads=self.threads)
+        description["gameStore"] = self.env().get('GAME_STORE', 'sqlite')
+        return description
+
+    def env(self):
+        env = dict(os.environ)
+        # Every worker must sign and read the same session cookies
+        env.setdefault('SECRET_KEY', 'loadtest')
+        if env.get('GAME_STORE', 'sqlite') == 'sqlite' and 'GAME_STORE_PATH' not in env:
+            # A fresh database per run, seen by every worker
+            env['GAME_STORE_PATH'] = os.path.join(self.directory or '', 'games.sqlite3')
+        return env
+
+    def command(self):
+        if self.kind == 'gunicorn':
+            return [sys.executable, '-m', 'gunicorn', '--workers', str(self.workers),
+                    '--threads', str(self.threads), '--bind', '%s:%d' % (self.host, self.port),
+                    '--log-level', 'warning', 'app:app']
+        return [sys.executable, '-m', 'flask', 'run', '--host', self.host, '--port', str(self.port),
+                '--with-threads', '--no-reload']
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix='asha-loadtest-')
+        env = self.env()
+        env['FLASK_APP'] = 'app'
+        log = open(os.path.join(self.directory, 'server.log'), 'wb')
+        self.process = subprocess.Popen(self.command(), cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        env=env, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=2)
+            try:
+                connection.request('GET', '/metrics')
+                connection.getresponse().read()
+                return
+            except (OSError, http.client.HTTPException):
+                time.sleep(0.2)
+            finally:
+                connection.close()
+        with open(os.path.join(self.directory, 'server.log'), 'rb') as f:
+            output = f.read().decode(errors='replace')
+        self.stop()
+        raise RuntimeError("%s server did not start on port %d:\n%s" % (self.kind, self.port, output))
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+# --- Reports -----------------------------------------------------------------
+
+def print_stage(stage):
+    print('concurrency %d  %.1fs  %d requests  %.1f req/s  %d errors' % (
+        stage['concurrency'], stage['seconds'], stage['total']['requests'],
+        stage['total']['throughput'] or 0, stage['total']['errors']))
+    for endpoint in ENDPOINTS:
+        summary = stage['endpoints'][endpoint]
+        if not summary['requests']:
+            continue
+        print('  %-16s %7.1f req/s  p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  max %8.2fms  %d errors' % (
+            endpoint, summary['throughput'], summary['p50'], summary['p95'], summary['p99'],
+            summary['max'], summary['errors']))
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return '%8s' % '-'
+    if old == 0:
+        return '%8s' % ('0%' if new == 0 else 'new')
+    return '%+7.1f%%' % (100.0 * (new - old) / old)
+
+
+def compare_runs(base, run):
+    """
+    Compare two runs stage by stage (matched by concurrency): one line per
+    endpoint with the base and new throughput and percentiles, and the
+    change. Lower latency and higher throughput are better.
+    """
+    lines = ['base: %s (%s)' % (base.get('label') or '-', base.get('date')),
+             'new:  %s (%s)' % (run.get('label') or '-', run.get('date'))]
+    base_stages = {stage['concurrency']: stage for stage in base['stages']}
+    for stage in run['stages']:
+        old_stage = base_stages.get(stage['concurrency'])
+        if old_stage is None:
+            lines.append('concurrency %d: not in the base run' % stage['concurrency'])
+            continue
+        lines.append('concurrency %d' % stage['concurrency'])
+        for endpoint in ('total',) + ENDPOINTS:
+            old = old_stage['total'] if endpoint == 'total' else old_stage['endpoints'][endpoint]
+            new = stage['total'] if endpoint == 'total' else stage['endpoints'][endpoint]
+            if not old['requests'] and not new['requests']:
+                continue
+            parts = ['  %-16s req/s %8.1f -> %8.1f %s' % (
+                endpoint, old['throughput'] or 0, new['throughput'] or 0,
+                _change(old['throughput'], new['throughput']))]
+            for p in PERCENTILES:
+                key = 'p%d' % p
+                parts.append('%s %7.2f -> %7.2fms %s' % (key, old[key] or 0, new[key] or 0,
+                                                         _change(old[key], new[key])))
+            lines.append('  '.join(parts))
+            if new['errors'] != old['errors']:
+                lines.append('  %-16s errors %d -> %d' % ('', old['errors'], new['errors']))
+    return '\n'.join(lines)
+
+
+def load_run(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP load test for the ASHA CHESS API.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="play random games with concurrent players")
+    run.add_argument('--server', choices=('dev', 'gunicorn'), default='dev',
+                     help="server to start for the run (default: Flask development server)")
+    run.add_argument('--url', default=None, help="use a running server instead of starting one")
+    run.add_argument('--port', type=int, default=DEFAULT_PORT)
+    run.add_argument('--workers', type=int, default=1, help="gunicorn worker processes")
+    run.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker")
+    run.add_argument('--concurrency', default='1,2,4,8,16',
+                     help="comma-separated numbers of players, one stage each")
+    run.add_argument('--duration', type=float, default=10.0, help="measured seconds per stage")
+    run.add_argument('--warmup', type=float, default=2.0, help="unmeasured seconds before each stage")
+    run.add_argument('--max-plies', type=int, default=200, help="start a new game after this many plies")
+    run.add_argument('--think', type=float, default=0.0, help="seconds a player waits between turns")
+    run.add_argument('--seed', type=int, default=None)
+    run.add_argument('--label', default=None, help="name of the run in reports")
+    run.add_argument('--out', default=None, help="save the run as JSON")
+    run.add_argument('--compare', default=None, metavar='BASE', help="compare with a saved run")
+
+    compare = subparsers.add_parser('compare', help="compare two saved runs")
+    compare.add_argument('base')
+    compare.add_argument('run')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        print(compare_runs(load_run(args.base), load_run(args.run)))
+        return 0
+
+    try:
+        concurrency = [int(level) for level in args.concurrency.split(',')]
+    except ValueError:
+        parser.error('--concurrency must be comma-separated integers')
+    if not concurrency or min(concurrency) < 1:
+        parser.error('--concurrency levels must be at least 1')
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+        server_info = {"kind": "external", "url": args.url}
+    else:
+        server = LocalServer(args.server, port=args.port, workers=args.workers, threads=args.threads)
+        server.start()
+        host, port = server.host, server.port
+        server_info = server.describe()
+
+    try:
+        print('%s server on %s:%d' % (server_info['kind'], host, port))
+        stages = run_load_test(host, port, concurrency, args.duration, warmup=args.warmup,
+                               max_plies=args.max_plies, think=args.think, seed=args.seed,
+                               progress=print_stage)
+    finally:
+        if server is not None:
+            server.stop()
+
+    result = {
+        "label": args.label,
+        "date": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "server": server_info,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "maxPlies": args.max_plies,
+        "think": args.think,
+        "stages": stages
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+        print('saved to %s' % args.out)
+    if args.compare:
+        print()
+        print(compare_runs(load_run(args.compare), result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
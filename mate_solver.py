@@ -0,0 +1,608 @@
+"""
+ASHA CHESS forced-mate solver and puzzle miner.
+
+The solver is a depth-first proof-number search (df-pn) on the variant move
+generator: every position is an AND/OR node, "the attacker mates within the
+remaining plies" is the proposition, and the search always expands the
+most-proving node with thresholds, so it stores only a transposition table
+rather than a tree. Transposition entries are keyed by (position key, plies
+left), which bounds every line and rules out the graph-history problems of
+df-pn on cyclic games. The shortest mate is found by solving mate in 1, 2,
+3, ... in turn; a node and time budget per position makes "unknown" a
+possible answer.
+
+King's Steps count as ordinary moves of both sides: a mate is only a mate
+if no King's Step escapes it, and quiet King's Steps often weave the nets.
+
+The miner scans game archives (PGN or self-play record files) for positions
+with a forced mate of a requested length and writes them as NDJSON puzzles.
+Games are cut into fixed chunks that a process pool solves; after each
+chunk the progress file is rewritten atomically, so a scan of many hours
+can be interrupted and resumed with the same command.
+
+Usage:
+    python mate_solver.py solve "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1" --max-moves 3
+    python mate_solver.py mine games.pgn selfplay.bin --out puzzles.ndjson --mate-in 2-3 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import chess
+
+from movegen import generate_moves, position_key, MoveLists, _attacks
+
+INFINITY = 10 ** 9
+
+DEFAULT_MAX_MOVES = 3
+DEFAULT_NODE_LIMIT = 200000
+DEFAULT_CHUNK_GAMES = 100
+DEFAULT_LAST_PLIES = 20
+
+MateResult = namedtuple('MateResult', [
+    'status',           # 'mate', 'no_mate' (none within max_moves) or 'unknown' (budget exhausted)
+    'mate_in',          # moves of the attacker, or None
+    'pv',               # list of TaggedMove, the defender resisting longest
+    'nodes',
+    'seconds'
+])
+
+
+class SolveAborted(Exception):
+    """Raised inside the solver when the time or node budget is exhausted."""
+
+
+def _check_squares(board):
+    """
+    Where the side to move may give check from: every move giving check
+    starts on a line through the enemy king (discovered checks) or lands on
+    a square its piece attacks the king from. Castling and en passant are
+    left to the exact test.
+    """
+    king = board.king(not board.turn)
+    if king is None:
+        return chess.BB_ALL, {}
+    occupied = board.occupied
+    targets = {piece_type: _attacks(piece_type, king, occupied)
+               for piece_type in (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN)}
+    targets[chess.PAWN] = chess.BB_PAWN_ATTACKS[not board.turn][king]
+    targets[chess.KING] = chess.BB_EMPTY
+    return _attacks(chess.QUEEN, king, chess.BB_EMPTY), targets
+
+
+class MateSolver:
+    """
+    Proves or disproves forced mates from the side to move's point of view.
+
+    The node and time limits cover everything one solve() does (all mate
+    lengths and the principal variation); the tables are kept between
+    calls, so solving several positions of one game reuses work.
+    """
+
+    def __init__(self, node_limit=DEFAULT_NODE_LIMIT, time_limit=None, tt_size=500000):
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.tt_size = tt_size
+        self.tt = {}  # (position key, plies left) -> (phi, delta)
+        self._children = {}  # (position key, checks only) -> (tagged moves, child keys)
+        self._move_lists = MoveLists()
+        self.nodes = 0
+        self._deadline = None
+
+    def solve(self, board, max_moves=DEFAULT_MAX_MOVES):
+        """Find the shortest mate of at most max_moves moves in a chess.Board; returns a MateResult."""
+        start = time.perf_counter()
+        self.nodes = 0
+        self._deadline = start + self.time_limit if self.time_limit else None
+        board = board.copy(stack=False)
+        key = position_key(board)
+        try:
+            for moves in range(1, max_moves + 1):
+                if self._prove(board, key, 2 * moves - 1):
+                    pv = self._principal_variation(board, key, 2 * moves - 1)
+                    return MateResult('mate', moves, pv, self.nodes, time.perf_counter() - start)
+        except SolveAborted:
+            return MateResult('unknown', None, [], self.nodes, time.perf_counter() - start)
+        return MateResult('no_mate', None, [], self.nodes, time.perf_counter() - start)
+
+    def solutions(self, board, mate_in):
+        """The first moves (TaggedMoves) of a chess.Board that mate in mate_in moves."""
+        board = board.copy(stack=False)
+        key = position_key(board)
+        plies = 2 * mate_in - 1
+        moves, child_keys = self._expand(board, key, plies == 1)
+        found = []
+        for tagged, child_key in zip(moves, child_keys):
+            board.push(tagged.move)
+            try:
+                if self._prove(board, child_key, plies - 1):
+                    found.append(tagged)
+            finally:
+                board.pop()
+        return found
+
+    # --- df-pn ---------------------------------------------------------------
+
+    def _prove(self, board, key, plies):
+        """
+        True if the attacker mates within plies, False if it cannot. The
+        attacker is the side to move when plies is odd, the other side when
+        it is even.
+        """
+        self._mid(board, key, plies, INFINITY, INFINITY)
+        phi, delta = self.tt[(key, plies)]
+        return phi == 0 if plies % 2 == 1 else delta == 0
+
+    def _expand(self, board, key, checks_only):
+        cache_key = (key, checks_only)
+        children = self._children.get(cache_key)
+        if children is None:
+            moves, child_keys = [], []
+            if checks_only:
+                lines, targets = _check_squares(board)
+            for tagged in generate_moves(board, self._move_lists):
+                move = tagged.move
+                if checks_only and not (
+                        chess.BB_SQUARES[move.from_square] & lines or
+                        chess.BB_SQUARES[move.to_square] & targets[move.promotion or board.piece_type_at(move.from_square)] or
+                        board.is_castling(move) or move.to_square == board.ep_square):
+                    continue
+                board.push(move)
+                # A last attacker move must give check to mate
+                if not checks_only or board.is_check():
+                    moves.append(tagged)
+                    child_keys.append(position_key(board))
+                board.pop()
+            if len(self._children) >= self.tt_size // 4:
+                self._children.clear()
+            children = self._children[cache_key] = (moves, child_keys)
+        return children
+
+    def _store(self, key, plies, phi, delta):
+        if len(self.tt) >= self.tt_size:
+            self.tt.clear()
+        self.tt[(key, plies)] = (phi, delta)
+
+    def _check_budget(self):
+        self.nodes += 1
+        if self.node_limit and self.nodes > self.node_limit:
+            raise SolveAborted()
+        if self.nodes & 1023 == 0 and self._deadline and time.perf_counter() > self._deadline:
+            raise SolveAborted()
+
+    def _mid(self, board, key, plies, threshold_phi, threshold_delta):
+        """
+        Multiple iterative deepening at one node. phi is the node's own
+        proof number (cost to show the side to move wins), delta its
+        disproof number; the side to move is the attacker when plies is odd.
+        """
+        self._check_budget()
+        if plies == 0:
+            # After the attacker's last move: only a mate will do, no need to expand
+            if board.is_check() and not generate_moves(board, self._move_lists):
+                self._store(key, plies, INFINITY, 0)
+            else:
+                self._store(key, plies, 0, INFINITY)
+            return
+
+        attacker = plies % 2 == 1
+        moves, child_keys = self._expand(board, key, attacker and plies == 1)
+        if not moves:
+            if attacker or board.is_check():
+                # The attacker has no (checking) move, or the defender is mated
+                self._store(key, plies, INFINITY, 0)
+            else:
+                # Stalemate
+                self._store(key, plies, 0, INFINITY)
+            return
+
+        child_plies = plies - 1
+        tt = self.tt
+        while True:
+            phi, delta, delta_2 = INFINITY, 0, INFINITY
+            best = None
+            for index, child_key in enumerate(child_keys):
+                child_phi, child_delta = tt.get((child_key, child_plies), (1, 1))
+                delta += child_phi
+                if child_delta < phi:
+                    delta_2, phi, best = phi, child_delta, index
+                elif child_delta < delta_2:
+                    delta_2 = child_delta
+            delta = min(delta, INFINITY)
+            if phi >= threshold_phi or delta >= threshold_delta:
+                self._store(key, plies, phi, delta)
+                return
+
+            best_phi = tt.get((child_keys[best], child_plies), (1, 1))[0]
+            child_threshold_phi = min(INFINITY, threshold_delta + best_phi - delta)
+            child_threshold_delta = min(threshold_phi, delta_2 + 1)
+            board.push(moves[best].move)
+            try:
+                self._mid(board, child_keys[best], child_plies, child_threshold_phi, child_threshold_delta)
+            finally:
+                board.pop()
+
+    def _mate_length(self, board, key, max_plies):
+        """The fewest plies within which the side to move mates, known to be at most max_plies (odd)."""
+        for plies in range(1, max_plies, 2):
+            if self._prove(board, key, plies):
+                return plies
+        return max_plies
+
+    def _principal_variation(self, board, key, plies):
+        """The mating line: the attacker's fastest mate, the defender's longest resistance."""
+        board = board.copy(stack=False)
+        pv = []
+        while plies > 0:
+            moves, child_keys = self._expand(board, key, plies == 1)
+            if not moves:
+                break
+            if plies % 2 == 1:
+                # Attacker: the child with the shortest remaining mate
+                choice, best = None, None
+                for index, child_key in enumerate(child_keys):
+                    board.push(moves[index].move)
+                    try:
+                        if not self._prove(board, child_key, plies - 1):
+                            continue
+                        length = 0 if not generate_moves(board) else self._mate_length_after(board, child_key, plies - 1)
+                    finally:
+                        board.pop()
+                    if best is None or length < best:
+                        choice, best = index, length
+                        if length == 0:
+                            break
+            else:
+                # Defender: the reply the attacker needs the longest to mate
+                choice, best = None, -1
+                for index, child_key in enumerate(child_keys):
+                    board.push(moves[index].move)
+                    try:
+                        length = self._mate_length(board, child_key, plies - 1)
+                    finally:
+                        board.pop()
+                    if length > best:
+                        choice, best = index, length
+            pv.append(moves[choice])
+            key = child_keys[choice]
+            board.push(moves[choice].move)
+            plies = best
+        return pv
+
+    def _mate_length_after(self, board, key, max_plies):
+        # A defender node: it survives as many plies as its longest reply
+        longest = 0
+        moves, child_keys = self._expand(board, key, False)
+        for tagged, child_key in zip(moves, child_keys):
+            board.push(tagged.move)
+            try:
+                longest = max(longest, self._mate_length(board, child_key, max_plies - 1) + 1)
+            finally:
+                board.pop()
+        return longest
+
+
+def solve_mate(board, max_moves=DEFAULT_MAX_MOVES, node_limit=DEFAULT_NODE_LIMIT, time_limit=None):
+    """Convenience wrapper: the shortest forced mate of a chess.Board as a MateResult."""
+    return MateSolver(node_limit=node_limit, time_limit=time_limit).solve(board, max_moves)
+
+
+# --- Puzzle mining -----------------------------------------------------------
+
+def parse_mate_lengths(spec):
+    """'2' -> [2], '2-4' -> [2, 3, 4]."""
+    low, _, high = spec.partition('-')
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise ValueError("mate length must be N or A-B, got %r" % spec)
+    if not 1 <= low <= high:
+        raise ValueError("mate length must be N or A-B with 1 <= A <= B, got %r" % spec)
+    return list(range(low, high + 1))
+
+
+def _is_selfplay_file(path):
+    from selfplay import HEADER, MAGIC
+    with open(path, 'rb') as f:
+        return f.read(HEADER.size)[:len(MAGIC)] == MAGIC
+
+
+def iter_games(paths):
+    """
+    Yield (path, game number, game) for every game of PGN and self-play
+    record files, in order. A game is a game_record.RawGame for PGN (replayed
+    in the workers) or a (start FEN, UCI moves) pair for self-play.
+    """
+    for path in paths:
+        if _is_selfplay_file(path):
+            from selfplay import iter_records
+            number, game, moves = 0, None, []
+            for record in iter_records(path):
+                if record[0] != game:
+                    if moves:
+                        number += 1
+                        yield path, number, (chess.STARTING_FEN, moves)
+                    game, moves = record[0], []
+                moves.append(chess.Move(record[7], record[8], record[9] or None).uci())
+            if moves:
+                yield path, number + 1, (chess.STARTING_FEN, moves)
+        else:
+            from game_record import read_games
+            with open(path) as f:
+                for number, game in enumerate(read_games(f), start=1):
+                    yield path, number, game
+
+
+def iter_chunks(paths, chunk_games):
+    """Yield (chunk id, [(path, game number, game), ...]) with chunk_games games per chunk."""
+    chunk_id, chunk = 0, []
+    for item in iter_games(paths):
+        chunk.append(item)
+        if len(chunk) == chunk_games:
+            yield chunk_id, chunk
+            chunk_id, chunk = chunk_id + 1, []
+    if chunk:
+        yield chunk_id, chunk
+
+
+def _game_moves(game):
+    if isinstance(game[1], list):
+        return game  # self-play: already (start FEN, UCI moves)
+    from game_record import replay_game
+    board = replay_game(game)
+    return board.start_fen, board.move_history
+
+
+def find_puzzle(board, solver, mate_lengths, unique=False):
+    """
+    Solve a chess.Board and return (puzzle, MateResult). The puzzle is a dict
+    if the shortest forced mate has one of mate_lengths moves (and, with
+    unique, a single winning first move), else None.
+    """
+    result = solver.solve(board, max(mate_lengths))
+    if result.status != 'mate' or result.mate_in not in mate_lengths:
+        return None, result
+    puzzle = {
+        "fen": board.fen(),
+        "mateIn": result.mate_in,
+        "moves": [tagged.move.uci() for tagged in result.pv],
+        "kingsSteps": [tagged.move.uci() for tagged in result.pv if tagged.is_kings_step],
+        "nodes": result.nodes,
+        "seconds": round(result.seconds, 3)
+    }
+    if unique:
+        try:
+            solutions = solver.solutions(board, result.mate_in)
+        except SolveAborted:
+            return None, result
+        if len(solutions) != 1:
+            return None, result
+    return puzzle, result
+
+
+def mine_chunk(chunk_id, games, mate_lengths, last_plies=DEFAULT_LAST_PLIES,
+               node_limit=DEFAULT_NODE_LIMIT, time_limit=None, unique=False):
+    """
+    Worker entry point: solve the positions of one chunk of games. Only the
+    last last_plies positions of each game are tried (0: all of them).
+    Returns (chunk id, puzzles, stats).
+    """
+    stats = {"games": 0, "invalid": 0, "positions": 0, "unknown": 0, "puzzles": 0, "nodes": 0}
+    puzzles, seen = [], set()
+    solver = MateSolver(node_limit=node_limit, time_limit=time_limit)
+    for path, number, game in games:
+        stats["games"] += 1
+        try:
+            start_fen, moves = _game_moves(game)
+        except Exception:
+            stats["invalid"] += 1
+            continue
+        board = chess.Board(start_fen)
+        first = max(0, len(moves) + 1 - last_plies) if last_plies else 0
+        for ply in range(len(moves) + 1):
+            if ply >= first:
+                epd = board.epd()
+                if epd not in seen:
+                    seen.add(epd)
+                    stats["positions"] += 1
+                    puzzle, result = find_puzzle(board, solver, mate_lengths, unique)
+                    stats["nodes"] += result.nodes
+                    if result.status == 'unknown':
+                        stats["unknown"] += 1
+                    if puzzle is not None:
+                        puzzle.update({"source": path, "game": number, "ply": ply, "chunk": chunk_id})
+                        puzzles.append(puzzle)
+            if ply < len(moves):
+                board.push(chess.Move.from_uci(moves[ply]))
+    stats["puzzles"] = len(puzzles)
+    return chunk_id, puzzles, stats
+
+
+class MiningProgress:
+    """
+    The resumable state of a mining run: the options it was started with
+    and the ids of the chunks whose puzzles are in the output file.
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        self.options = options
+        self.done = set()
+        self.totals = {}
+
+    def load(self):
+        """Read the progress file, if any. Raises ValueError if it was made with other options."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state["options"] != self.options:
+            raise ValueError("%s was written with other options; use --restart to start over" % self.path)
+        self.done = set(state["done"])
+        self.totals = state["totals"]
+        return True
+
+    def add(self, chunk_id, stats):
+        self.done.add(chunk_id)
+        for name, value in stats.items():
+            self.totals[name] = self.totals.get(name, 0) + value
+
+    def save(self):
+        state = {"options": self.options, "done": sorted(self.done), "totals": self.totals}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def _clean_output(path, done):
+    """
+    Keep only the puzzles of finished chunks: a run interrupted between
+    writing a chunk's puzzles and saving the progress leaves them behind.
+    Returns the EPDs of the kept puzzles.
+    """
+    seen = set()
+    if not os.path.exists(path):
+        return seen
+    with open(path) as f, open(path + '.tmp', 'w') as out:
+        for line in f:
+            try:
+                puzzle = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            if puzzle.get("chunk") in done:
+                out.write(line)
+                seen.add(chess.Board(puzzle["fen"]).epd())
+    os.replace(path + '.tmp', path)
+    return seen
+
+
+def mine_archives(paths, out_path, mate_lengths, workers=1, chunk_games=DEFAULT_CHUNK_GAMES,
+                  last_plies=DEFAULT_LAST_PLIES, node_limit=DEFAULT_NODE_LIMIT, time_limit=None,
+                  unique=False, progress_path=None, restart=False, log=None):
+    """
+    Mine puzzles from game archives into an NDJSON file, resuming a previous
+    run with the same options. Returns the totals over all runs.
+    """
+    progress_path = progress_path or out_path + '.progress.json'
+    options = {"inputs": [os.path.abspath(path) for path in paths], "mateIn": mate_lengths,
+               "chunkGames": chunk_games, "lastPlies": last_plies, "nodeLimit": node_limit,
+               "timeLimit": time_limit, "unique": unique}
+    progress = MiningProgress(progress_path, options)
+    if restart:
+        for path in (out_path, progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+    elif progress.load() and log:
+        log('resuming: %d chunks already done' % len(progress.done))
+    seen = _clean_output(out_path, progress.done)
+
+    settings = (mate_lengths, last_plies, node_limit, time_limit, unique)
+    start = time.perf_counter()
+
+    def finish(chunk_id, puzzles, stats, out):
+        for puzzle in puzzles:
+            epd = chess.Board(puzzle["fen"]).epd()
+            if epd in seen:
+                continue
+            seen.add(epd)
+            out.write(json.dumps(puzzle) + '\n')
+        out.flush()
+        os.fsync(out.fileno())
+        progress.add(chunk_id, stats)
+        progress.save()
+        if log:
+            log('chunk %d: %d games, %d positions, %d puzzles (%.0fs)'
+                % (chunk_id, stats["games"], stats["positions"], stats["puzzles"], time.perf_counter() - start))
+
+    chunks = ((chunk_id, games) for chunk_id, games in iter_chunks(paths, chunk_games)
+              if chunk_id not in progress.done)
+    with open(out_path, 'a') as out:
+        if workers <= 1:
+            for chunk_id, games in chunks:
+                finish(*mine_chunk(chunk_id, games, *settings), out=out)
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            pending = set()
+            try:
+                for chunk_id, games in chunks:
+                    pending.add(pool.submit(mine_chunk, chunk_id, games, *settings))
+                    if len(pending) >= workers * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            finish(*future.result(), out=out)
+                for future in pending:
+                    finish(*future.result(), out=out)
+                pool.shutdown()
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    return progress.totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASHA CHESS mate solver and puzzle miner.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    solve = subparsers.add_parser('solve', help="find the shortest forced mate of a position")
+    solve.add_argument('fen')
+    solve.add_argument('--max-moves', type=int, default=DEFAULT_MAX_MOVES)
+    solve.add_argument('--node-limit', type=int, default=DEFAULT_NODE_LIMIT)
+    solve.add_argument('--time-limit', type=float, default=None, help="seconds")
+
+    mine = subparsers.add_parser('mine', help="mine mate puzzles from PGN and self-play files")
+    mine.add_argument('inputs', nargs='+')
+    mine.add_argument('--out', required=True, help="NDJSON puzzle file (appended to when resuming)")
+    mine.add_argument('--mate-in', default='2', help="mate length in moves, N or A-B (default 2)")
+    mine.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    mine.add_argument('--chunk-games', type=int, default=DEFAULT_CHUNK_GAMES)
+    mine.add_argument('--last-plies', type=int, default=DEFAULT_LAST_PLIES,
+                      help="positions tried at the end of each game (0: all)")
+    mine.add_argument('--node-limit', type=int, default=DEFAULT_NODE_LIMIT, help="per position")
+    mine.add_argument('--time-limit', type=float, default=None, help="seconds per position")
+    mine.add_argument('--unique', action='store_true', help="only puzzles with a single winning first move")
+    mine.add_argument('--progress', default=None, help="progress file (default: OUT.progress.json)")
+    mine.add_argument('--restart', action='store_true', help="discard the output and progress of a previous run")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'solve':
+        try:
+            board = chess.Board(args.fen)
+        except ValueError as e:
+            parser.error(str(e))
+        result = solve_mate(board, args.max_moves, args.node_limit, args.time_limit)
+        if result.status == 'mate':
+            print('mate in %d: %s' % (result.mate_in, ' '.join(
+                tagged.move.uci() + (' (KS)' if tagged.is_kings_step else '') for tagged in result.pv)))
+        elif result.status == 'no_mate':
+            print('no mate in %d' % args.max_moves)
+        else:
+            print('unknown: budget exhausted')
+        print('%d nodes in %.2fs' % (result.nodes, result.seconds))
+        return 0 if result.status == 'mate' else 1
+
+    try:
+        mate_lengths = parse_mate_lengths(args.mate_in)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        totals = mine_archives(args.inputs, args.out, mate_lengths, workers=args.workers,
+                               chunk_games=args.chunk_games, last_plies=args.last_plies,
+                               node_limit=args.node_limit, time_limit=args.time_limit,
+                               unique=args.unique, progress_path=args.progress,
+                               restart=args.restart, log=print)
+    except ValueError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        print('interrupted; run the same command again to resume')
+        return 130
+    print(json.dumps(totals))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
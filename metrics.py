@@ -0,0 +1,350 @@
+"""
+Request instrumentation and Prometheus metrics.
+
+Every HTTP request gets a RequestRecord, reachable from anywhere in the
+request's thread through current_request(). The record collects:
+
+- stage timings: session load and save, move generation, GameStatus
+  building, JSON serialization (stages may nest: "status" includes the
+  "movegen" it triggers)
+- the moves generated, and where each PositionInfo came from (the
+  board's own cache, the shared position cache, the game's pondered
+  positions, the opening book, or a fresh move generation)
+- the FENs of the positions it generated moves for
+
+When the request ends, the record is folded into the process-wide
+RequestMetrics: latency histograms per route, stage histograms, moves
+per request, and PositionInfo source counters. render() writes them,
+plus the position cache stats, in the Prometheus text format for the
+/metrics route. Outside requests (perft, self-play, the engine)
+current_request() is None and nothing is recorded.
+
+The slowest requests can be kept for offline reproduction (opt-in, see
+create_request_metrics). Each is kept with its route, stages and FENs, and
+a sampled fraction of requests is also run under cProfile.
+
+Metrics live in the worker process: with several gunicorn workers, each
+one reports its own.
+"""
+import cProfile
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MOVES_BUCKETS = (0, 50, 100, 200, 500, 1000, 5000, 20000)
+POSITION_SOURCES = ('board', 'cache', 'ponder', 'book', 'generated')
+# FENs kept per request for the slow request log
+MAX_FENS = 8
+
+_local = threading.local()
+
+
+def current_request():
+    """The RequestRecord of the request handled by this thread, or None."""
+    return getattr(_local, 'record', None)
+
+
+class RequestRecord:
+    """Timings and counters of one request."""
+    __slots__ = ('route', 'method', 'status', 'streamed', 'start', 'stages', 'moves', 'sources', 'fens',
+                 'profile')
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.status = None
+        self.streamed = False
+        self.start = time.perf_counter()
+        self.stages = {}  # stage -> seconds
+        self.moves = 0
+        self.sources = dict.fromkeys(POSITION_SOURCES, 0)
+        self.fens = []
+        self.profile = None
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def position_info(self, source, fen=None, moves=0, seconds=0.0):
+        """Count a PositionInfo lookup; fen, moves and seconds are for fresh generations."""
+        self.sources[source] += 1
+        if source == 'generated':
+            self.moves += moves
+            self.add_stage('movegen', seconds)
+            if len(self.fens) < MAX_FENS:
+                self.fens.append(fen)
+
+    def stage(self, stage):
+        return _Stage(self, stage)
+
+
+class _Stage:
+    """Context manager adding the time spent in its block to a stage."""
+    __slots__ = ('record', 'name', 'start')
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.record.add_stage(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Time a block as a stage of the current request (no-op outside requests)."""
+    record = current_request()
+    return record.stage(name) if record is not None else _NO_STAGE
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '%s_bucket%s %d' % (name, _labels(labels, le=_number(bound)), cumulative)
+        yield '%s_bucket%s %d' % (name, _labels(labels, le='+Inf'), self.count)
+        yield '%s_sum%s %s' % (name, _labels(labels), _number(self.sum))
+        yield '%s_count%s %d' % (name, _labels(labels), self.count)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, _escape(value)) for key, value in pairs)
+
+
+class RequestMetrics:
+    """Process-wide request metrics, fed by finished RequestRecords."""
+
+    def __init__(self, slow_log=None):
+        self.slow_log = slow_log
+        self._lock = threading.Lock()
+        self._requests = {}  # (route, method, status) -> count
+        self._latency = {}  # (route, method) -> Histogram
+        self._stages = {}  # stage -> Histogram
+        self._moves = Histogram(MOVES_BUCKETS)
+        self._sources = dict.fromkeys(POSITION_SOURCES, 0)
+
+    def start(self, route, method):
+        """Open the record of the request handled by this thread."""
+        record = RequestRecord(route, method)
+        _local.record = record
+        if self.slow_log is not None:
+            self.slow_log.start_profile(record)
+        return record
+
+    def finish(self, status=None):
+        """Close the current request's record and fold it into the metrics."""
+        record = current_request()
+        if record is None:
+            return
+        _local.record = None
+        seconds = time.perf_counter() - record.start
+        status = status or record.status or 500
+        with self._lock:
+            key = (record.route, record.method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            latency = self._latency.get((record.route, record.method))
+            if latency is None:
+                latency = self._latency[(record.route, record.method)] = Histogram(LATENCY_BUCKETS)
+            latency.observe(seconds)
+            for name, stage_seconds in record.stages.items():
+                histogram = self._stages.get(name)
+                if histogram is None:
+                    histogram = self._stages[name] = Histogram(LATENCY_BUCKETS)
+                histogram.observe(stage_seconds)
+            self._moves.observe(record.moves)
+            for source, count in record.sources.items():
+                self._sources[source] += count
+        if self.slow_log is not None:
+            self.slow_log.finish(record, status, seconds)
+
+    def render(self, position_cache=None, ponder=None):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, text):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        with self._lock:
+            family('asha_http_requests_total', 'counter', "HTTP requests by route, method and status.")
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append('asha_http_requests_total%s %d' % (
+                    _labels([('route', route), ('method', method), ('status', status)]), count))
+
+            family('asha_http_request_duration_seconds', 'histogram', "Request latency by route.")
+            for (route, method), histogram in sorted(self._latency.items()):
+                lines.extend(histogram.lines('asha_http_request_duration_seconds',
+                                             [('route', route), ('method', method)]))
+
+            family('asha_request_stage_seconds', 'histogram',
+                   "Time per request spent in each stage (stages may nest).")
+            for name, histogram in sorted(self._stages.items()):
+                lines.extend(histogram.lines('asha_request_stage_seconds', [('stage', name)]))
+
+            family('asha_moves_generated_per_request', 'histogram',
+                   "Legal moves generated per request (cached positions generate none).")
+            lines.extend(self._moves.lines('asha_moves_generated_per_request', []))
+
+            family('asha_position_info_total', 'counter',
+                   "PositionInfo lookups by where they were answered.")
+            for source in POSITION_SOURCES:
+                lines.append('asha_position_info_total%s %d' % (_labels([('source', source)]),
+                                                                self._sources[source]))
+
+        if position_cache is not None:
+            stats = position_cache.stats()
+            family('asha_position_cache_entries', 'gauge', "Entries in the shared position cache.")
+            lines.append('asha_position_cache_entries %d' % stats['size'])
+            family('asha_position_cache_max_entries', 'gauge', "Size limit of the shared position cache.")
+            lines.append('asha_position_cache_max_entries %d' % stats['maxSize'])
+            family('asha_position_cache_hits_total', 'counter', "Shared position cache hits.")
+            lines.append('asha_position_cache_hits_total %d' % stats['hits'])
+            family('asha_position_cache_misses_total', 'counter', "Shared position cache misses.")
+            lines.append('asha_position_cache_misses_total %d' % stats['misses'])
+            family('asha_position_cache_hit_ratio', 'gauge', "Shared position cache hit rate.")
+            lines.append('asha_position_cache_hit_ratio %s' % _number(stats['hitRate']))
+
+        if ponder is not None:
+            stats = ponder.stats()
+            family('asha_ponder_positions', 'gauge', "Pondered positions kept for the next moves.")
+            lines.append('asha_ponder_positions %d' % stats['positions'])
+            family('asha_ponder_jobs_total', 'counter', "Positions whose replies were pondered.")
+            lines.append('asha_ponder_jobs_total %d' % stats['jobs'])
+            family('asha_ponder_skipped_total', 'counter', "Pondering skipped because the queue was full.")
+            lines.append('asha_ponder_skipped_total %d' % stats['skipped'])
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestLog:
+    """
+    Keeps the slowest requests in a directory: slowest.json lists them
+    (route, status, seconds, stages, moves, FENs), slowest first, and
+    sampled requests also get a cProfile dump (<id>.prof, readable with
+    pstats or snakeviz).
+    """
+
+    def __init__(self, directory, keep=20, sample_rate=0.01):
+        self.directory = directory
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self._slowest = []  # min-heap of (seconds, id, entry)
+        self._lock = threading.Lock()
+        # cProfile cannot run twice at once, so one request is profiled at a time
+        self._profiling = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start_profile(self, record):
+        if self.sample_rate > 0 and random.random() < self.sample_rate and \
+                self._profiling.acquire(blocking=False):
+            try:
+                record.profile = cProfile.Profile()
+                record.profile.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) is active
+                record.profile = None
+                self._profiling.release()
+
+    def finish(self, record, status, seconds):
+        profile = record.profile
+        if profile is not None:
+            profile.disable()
+            self._profiling.release()
+
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return
+            entry_id = uuid.uuid4().hex[:12]
+            entry = {
+                "id": entry_id,
+                "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "route": record.route,
+                "method": record.method,
+                "status": status,
+                "seconds": round(seconds, 6),
+                "stages": {name: round(value, 6) for name, value in record.stages.items()},
+                "moves": record.moves,
+                "fens": record.fens,
+                "profile": None
+            }
+            if profile is not None:
+                entry["profile"] = entry_id + '.prof'
+                profile.dump_stats(os.path.join(self.directory, entry["profile"]))
+            heapq.heappush(self._slowest, (seconds, entry_id, entry))
+            if len(self._slowest) > self.keep:
+                _, _, dropped = heapq.heappop(self._slowest)
+                if dropped["profile"]:
+                    try:
+                        os.remove(os.path.join(self.directory, dropped["profile"]))
+                    except OSError:
+                        pass
+            entries = [item[2] for item in sorted(self._slowest, reverse=True)]
+            path = os.path.join(self.directory, 'slowest.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(path + '.tmp', path)
+
+
+def create_request_metrics():
+    """
+    Build the request metrics configured by the environment. The slow
+    request log is off unless SLOW_REQUEST_DIR is set:
+
+    SLOW_REQUEST_DIR          directory for slowest.json and the profiles
+    SLOW_REQUEST_KEEP         number of slowest requests kept (default 20)
+    SLOW_REQUEST_SAMPLE_RATE  fraction of requests run under cProfile (default 0.01)
+    """
+    directory = os.environ.get('SLOW_REQUEST_DIR')
+    slow_log = None
+    if directory:
+        slow_log = SlowRequestLog(directory,
+                                  keep=int(os.environ.get('SLOW_REQUEST_KEEP', 20)),
+                                  sample_rate=float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 0.01)))
+    return RequestMetrics(slow_log=slow_log)
@@ -0,0 +1,326 @@
+"""
+Bitboard move generation for ASHA CHESS.
+
+Moves are generated straight from python-chess's bitboards. King's Step
+targets come from the precomputed king-step masks ANDed with the empty-square
+mask, and legality is decided with an evasion (check) mask and pin masks
+computed once per position instead of copying the board for every candidate
+move. The result matches validating every candidate by simulation, which is
+what TwoHSChessBoard.legal_moves used to do.
+"""
+from collections import namedtuple
+
+import chess
+
+# A generated move tagged with how it is played.
+# is_kings_step: the move is only possible through the King's Step rule
+# is_capture: the move removes an opponent piece (King's Steps never do,
+#             except for the en passant quirk described in _is_en_passant_step)
+TaggedMove = namedtuple('TaggedMove', ['move', 'is_kings_step', 'is_capture'])
+
+# One-square moves in every direction, indexed by square
+KINGS_STEP_MASKS = chess.BB_KING_ATTACKS
+
+# Empty-board lines used to find sliders aligned with the king
+_ROOK_LINES = [chess.BB_RANK_ATTACKS[sq][0] | chess.BB_FILE_ATTACKS[sq][0] for sq in chess.SQUARES]
+_BISHOP_LINES = [chess.BB_DIAG_ATTACKS[sq][0] for sq in chess.SQUARES]
+
+
+def _pawn_push_steps(color):
+    # One-square pawn pushes that stay short of the last rank are standard moves
+    last_rank = chess.BB_RANK_8 if color == chess.WHITE else chess.BB_RANK_1
+    masks = []
+    for sq in chess.SQUARES:
+        push = sq + 8 if color == chess.WHITE else sq - 8
+        masks.append(chess.BB_SQUARES[push] & ~last_rank if 0 <= push < 64 else chess.BB_EMPTY)
+    return masks
+
+
+_PAWN_PUSH_STEPS = [_pawn_push_steps(chess.BLACK), _pawn_push_steps(chess.WHITE)]
+
+# King's Step targets that are NOT also a standard move of the piece, indexed
+# by [color][piece_type][square]. Bishops already step diagonally, rooks
+# orthogonally, and pawns push one square forward, so those steps are standard.
+KINGS_STEP_ONLY_MASKS = [
+    {
+        chess.PAWN: [KINGS_STEP_MASKS[sq] & ~_PAWN_PUSH_STEPS[color][sq] for sq in chess.SQUARES],
+        chess.KNIGHT: list(KINGS_STEP_MASKS),
+        chess.BISHOP: [KINGS_STEP_MASKS[sq] & _ROOK_LINES[sq] for sq in chess.SQUARES],
+        chess.ROOK: [KINGS_STEP_MASKS[sq] & _BISHOP_LINES[sq] for sq in chess.SQUARES],
+    }
+    for color in (chess.BLACK, chess.WHITE)
+]
+
+
+def position_key(board):
+    """
+    Cheap hashable key for everything move generation depends on.
+
+    Unlike the FEN it ignores the move clocks, and it avoids string building.
+    """
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.turn, board.castling_rights, board.ep_square)
+
+
+def kings_step_pieces(board, color):
+    """Bitboard of the pieces of the given color that may take a King's Step."""
+    return (board.pawns | board.knights | board.bishops | board.rooks) & board.occupied_co[color]
+
+
+def evasion_mask(board, king):
+    """
+    Squares a move by any piece other than the king may land on.
+
+    BB_ALL when not in check, the checker and the squares between it and the
+    king when in check by a single piece, and nothing for double check.
+    """
+    checkers = board.attackers_mask(not board.turn, king)
+    if not checkers:
+        return chess.BB_ALL
+    if checkers & (checkers - 1):
+        return chess.BB_EMPTY
+    return chess.between(king, chess.msb(checkers)) | checkers
+
+
+def pin_masks(board, king):
+    """
+    Map each pinned piece of the side to move to the line it may move along.
+
+    A piece is pinned when it is the only piece between its king and an
+    enemy slider that moves along that line.
+    """
+    them = board.occupied_co[not board.turn]
+    snipers = ((_ROOK_LINES[king] & (board.rooks | board.queens)) |
+               (_BISHOP_LINES[king] & (board.bishops | board.queens))) & them
+
+    pins = {}
+    for sniper in chess.scan_reversed(snipers):
+        blocker = chess.between(king, sniper) & board.occupied
+        if blocker and not blocker & (blocker - 1) and blocker & board.occupied_co[board.turn]:
+            pins[chess.msb(blocker)] = chess.ray(king, sniper)
+    return pins
+
+
+def _attacks(piece_type, square, occupied):
+    """Standard attacks of a knight, bishop, rook or queen on the given square."""
+    if piece_type == chess.KNIGHT:
+        return chess.BB_KNIGHT_ATTACKS[square]
+    attacks = chess.BB_EMPTY
+    if piece_type != chess.ROOK:
+        attacks |= chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+    if piece_type != chess.BISHOP:
+        attacks |= (chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+                    chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied])
+    return attacks
+
+
+def _is_legal_by_simulation(board, move):
+    """Play the move on a copy and check that our own king is not attacked."""
+    try:
+        temp_board = board.copy(stack=False)
+        temp_board.push(move)
+        king_square = temp_board.king(board.turn)
+        return not temp_board.is_attacked_by(not board.turn, king_square)
+    except Exception:
+        return False
+
+
+def _is_en_passant_step(board, from_square, to_square):
+    """
+    True for a pawn King's Step diagonally onto the en passant square.
+
+    python-chess plays any diagonal pawn move onto the en passant square as
+    an en passant capture, so these rare moves are validated by simulation.
+    """
+    return (board.ep_square == to_square and
+            abs(to_square - from_square) in (7, 9) and
+            bool(board.pawns & chess.BB_SQUARES[from_square]))
+
+
+class MoveLists:
+    """
+    Per-piece move lists kept between calls of generate_moves, so that
+    only the pieces affected by the moves played since are regenerated.
+
+    The moves of a knight, bishop, rook, queen or pawn before check and
+    pins are taken into account depend only on the occupants of a few
+    squares: its own, the squares it attacks (up to and including the
+    first blocker of each ray), those it may step or push to, and the en
+    passant square. Each list is kept with the mask of those squares. The
+    next time the same side is to move, the squares whose occupant changed
+    since are compared with the mask, and untouched lists are reused as
+    they are. Check and pins are applied afterwards, as a filter.
+
+    The lists validate themselves against the board, so any sequence of
+    positions is fine: pushes, pops, or a different game altogether (which
+    just regenerates more lists). King moves, castling and en passant are
+    always generated.
+    """
+    __slots__ = ('_sides',)
+
+    def __init__(self):
+        # Per color: (white pieces, black pieces, en passant mask, {square: entry})
+        # as of the last generation for that side
+        self._sides = [None, None]
+
+    def lists_for(self, board):
+        """The still valid piece lists of the side to move, {square: (piece type, mask, moves)}."""
+        white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+        ep_mask = chess.BB_SQUARES[board.ep_square] if board.ep_square is not None else chess.BB_EMPTY
+        side = self._sides[board.turn]
+        if side is None:
+            entries = {}
+        else:
+            old_white, old_black, old_ep_mask, entries = side
+            changed = (old_white ^ white) | (old_black ^ black)
+            if old_ep_mask != ep_mask:
+                changed |= old_ep_mask | ep_mask
+            if changed:
+                # Drop every list the changes touch, including those of pieces
+                # not on their square now, which would not be refreshed
+                entries = {square: entry for square, entry in entries.items() if not entry[1] & changed}
+        self._sides[board.turn] = (white, black, ep_mask, entries)
+        return entries
+
+
+def _filtered(piece_moves, allowed):
+    """The moves of a list that land on an allowed square."""
+    bb_squares = chess.BB_SQUARES
+    return [tagged for tagged in piece_moves if bb_squares[tagged[0].to_square] & allowed]
+
+
+def generate_moves(board, move_lists=None):
+    """
+    Generate all legal moves for the side to move as a list of TaggedMove.
+
+    Moves that are legal in standard chess are tagged as standard moves,
+    every other legal one-square move into an empty square by a pawn, knight,
+    bishop or rook is tagged as a King's Step. Castling and en passant are
+    left to python-chess; everything else is built from attack masks
+    restricted by the evasion and pin masks.
+
+    Pass a MoveLists to reuse the move lists of the pieces that the moves
+    played since the previous call did not affect.
+    """
+    turn = board.turn
+    king = board.king(turn)
+    if king is None:
+        # Without a king there is nothing to keep safe, and no legal moves
+        return []
+
+    us = board.occupied_co[turn]
+    them = board.occupied_co[not turn]
+    empty = ~board.occupied & chess.BB_ALL
+    ep_square = board.ep_square
+    ep_mask = chess.BB_SQUARES[ep_square] if ep_square is not None else chess.BB_EMPTY
+    evasions = evasion_mask(board, king)
+    pins = pin_masks(board, king)
+    step_only = KINGS_STEP_ONLY_MASKS[turn]
+    entries = move_lists.lists_for(board) if move_lists is not None else None
+
+    # Hot loops: bind globals locally and build the namedtuples directly
+    bb_squares = chess.BB_SQUARES
+    scan_reversed = chess.scan_reversed
+    Move = chess.Move
+    new_tagged = tuple.__new__
+    BB_ALL = chess.BB_ALL
+    moves = []
+
+    # King moves may not land on attacked squares; the king itself is taken
+    # off the board so that it cannot hide behind itself from a slider
+    occupied = board.occupied
+    without_king = occupied & ~bb_squares[king]
+    for to_square in scan_reversed(chess.BB_KING_ATTACKS[king] & ~us):
+        if not board.attackers_mask(not turn, to_square, without_king):
+            moves.append(new_tagged(TaggedMove, (Move(king, to_square), False, bool(bb_squares[to_square] & them))))
+    if board.castling_rights:
+        for move in board.generate_castling_moves():
+            moves.append(new_tagged(TaggedMove, (move, False, False)))
+
+    # Standard moves of the other pieces, plus King's Steps for all but the queen
+    for piece_type in (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+        piece_steps = step_only.get(piece_type)
+        for from_square in scan_reversed(board.pieces_mask(piece_type, turn)):
+            entry = entries.get(from_square) if entries is not None else None
+            if entry is not None and entry[0] == piece_type:
+                piece_moves = entry[2]
+            else:
+                attacks = _attacks(piece_type, from_square, occupied)
+                piece_moves = [new_tagged(TaggedMove, (Move(from_square, to_square), False,
+                                                       bool(bb_squares[to_square] & them)))
+                               for to_square in scan_reversed(attacks & ~us)]
+                depends_on = attacks | bb_squares[from_square]
+                if piece_steps is not None:
+                    for to_square in scan_reversed(piece_steps[from_square] & empty & ~ep_mask):
+                        piece_moves.append(new_tagged(TaggedMove, (Move(from_square, to_square), True, False)))
+                    depends_on |= piece_steps[from_square]
+                if entries is not None:
+                    entries[from_square] = (piece_type, depends_on, piece_moves)
+
+            allowed = evasions & pins[from_square] if from_square in pins else evasions
+            if allowed == BB_ALL:
+                moves.extend(piece_moves)
+            else:
+                moves.extend(_filtered(piece_moves, allowed))
+
+    # Pawn captures, pushes and King's Steps
+    forward = 8 if turn == chess.WHITE else -8
+    double_push_ranks = (chess.BB_RANK_3 | chess.BB_RANK_4) if turn == chess.WHITE else (chess.BB_RANK_6 | chess.BB_RANK_5)
+    pawn_attacks = chess.BB_PAWN_ATTACKS[turn]
+    pawn_steps = step_only[chess.PAWN]
+    for from_square in scan_reversed(board.pawns & us):
+        entry = entries.get(from_square) if entries is not None else None
+        if entry is not None and entry[0] == chess.PAWN:
+            piece_moves = entry[2]
+        else:
+            piece_moves = []
+            targets = pawn_attacks[from_square] & them
+            depends_on = pawn_attacks[from_square] | pawn_steps[from_square] | bb_squares[from_square]
+
+            push = from_square + forward
+            if 0 <= push < 64:
+                depends_on |= bb_squares[push]
+                if bb_squares[push] & empty:
+                    targets |= bb_squares[push]
+                    double_push = push + forward
+                    if 0 <= double_push < 64:
+                        depends_on |= bb_squares[double_push]
+                        if bb_squares[double_push] & empty & double_push_ranks:
+                            piece_moves.append(new_tagged(TaggedMove, (Move(from_square, double_push), False, False)))
+
+            for to_square in scan_reversed(targets):
+                is_capture = bool(bb_squares[to_square] & them)
+                if bb_squares[to_square] & chess.BB_BACKRANKS:
+                    for promotion in (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT):
+                        piece_moves.append(new_tagged(TaggedMove, (Move(from_square, to_square, promotion), False, is_capture)))
+                else:
+                    piece_moves.append(new_tagged(TaggedMove, (Move(from_square, to_square), False, is_capture)))
+
+            for to_square in scan_reversed(pawn_steps[from_square] & empty & ~ep_mask):
+                piece_moves.append(new_tagged(TaggedMove, (Move(from_square, to_square), True, False)))
+            if entries is not None:
+                entries[from_square] = (chess.PAWN, depends_on, piece_moves)
+
+        allowed = evasions & pins[from_square] if from_square in pins else evasions
+        if allowed == BB_ALL:
+            moves.extend(piece_moves)
+        else:
+            moves.extend(_filtered(piece_moves, allowed))
+
+    if ep_mask & empty:
+        standard_ep = list(board.generate_legal_ep())
+        for move in standard_ep:
+            moves.append(new_tagged(TaggedMove, (move, False, True)))
+
+        # Steps onto the en passant square were left out above: python-chess
+        # plays a diagonal pawn move there as an en passant capture
+        for from_square in scan_reversed(KINGS_STEP_MASKS[ep_square] & kings_step_pieces(board, turn)):
+            if not step_only[board.piece_type_at(from_square)][from_square] & ep_mask:
+                continue
+            move = Move(from_square, ep_square)
+            if _is_en_passant_step(board, from_square, ep_square):
+                if move not in standard_ep and _is_legal_by_simulation(board, move):
+                    moves.append(new_tagged(TaggedMove, (move, True, board.is_capture(move))))
+            elif ep_mask & evasions & pins.get(from_square, chess.BB_ALL):
+                moves.append(new_tagged(TaggedMove, (move, True, False)))
+    return moves
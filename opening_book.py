@@ -0,0 +1,300 @@
+"""
+Memory-mapped opening book for ASHA CHESS.
+
+Every game starts from the same position, so the first plies are played
+over and over. The book maps the Zobrist key of each common opening
+position to:
+
+- all legal moves of the position with their King's Step and capture tags,
+  plus the check and insufficient material flags, i.e. everything the API
+  needs, so a book position costs a binary search instead of a move
+  generation
+- the moves played from it in the source games, weighted by how often
+
+File layout: a header, N fixed-width index entries (key, offset, length)
+sorted by key for binary search, then the entry payloads. The file is
+read through mmap, so all gunicorn workers on a machine share one copy in
+the page cache.
+
+Build it from PGN archives (see game_record.py) and self-play record files
+(see selfplay.py):
+
+    python opening_book.py build games.pgn selfplay.bin --out opening_book.bin
+    python opening_book.py show --book opening_book.bin
+    python opening_book.py show --book opening_book.bin --fen "<FEN>"
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import chess
+
+from movegen import TaggedMove, generate_moves
+import zobrist
+from game_status import PositionInfo, is_insufficient_material
+from game_record import read_games, replay_game, GameRecordError
+
+MAGIC = b'ASHABK'
+VERSION = 2
+# magic, version, number of entries
+HEADER = struct.Struct('<6sHI')
+# Zobrist key, payload offset, payload length
+INDEX_ENTRY = struct.Struct('<QII')
+
+# Payload: flags, check square, legal move count, then the packed legal
+# moves, the book move count and (legal move index, weight) pairs. Counts
+# and indexes of legal moves take two bytes: with King's Steps, a position
+# can have more than 255 legal moves.
+_PAYLOAD_HEAD = struct.Struct('<BBH')
+_PACKED_MOVE = struct.Struct('<I')
+_BOOK_MOVE = struct.Struct('<HI')
+
+FLAG_CHECK = 1
+FLAG_INSUFFICIENT_MATERIAL = 2
+NO_SQUARE = 64
+
+DEFAULT_MAX_PLIES = 20
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book.bin')
+
+
+def pack_move(tagged):
+    """A TaggedMove as from | to << 6 | promotion << 12 | King's Step << 15 | capture << 16."""
+    move = tagged.move
+    return (move.from_square | move.to_square << 6 | (move.promotion or 0) << 12 |
+            tagged.is_kings_step << 15 | tagged.is_capture << 16)
+
+
+def unpack_move(packed):
+    promotion = (packed >> 12) & 7
+    move = chess.Move(packed & 63, (packed >> 6) & 63, promotion or None)
+    return TaggedMove(move, bool(packed >> 15 & 1), bool(packed >> 16 & 1))
+
+
+class BookEntry:
+    """One book position: its legal moves, flags and weighted book moves."""
+    __slots__ = ('tagged_moves', 'is_check', 'check_square', 'is_insufficient_material', 'book_moves')
+
+    def __init__(self, payload):
+        flags, check_square, count = _PAYLOAD_HEAD.unpack_from(payload, 0)
+        offset = _PAYLOAD_HEAD.size
+        self.tagged_moves = []
+        for _ in range(count):
+            self.tagged_moves.append(unpack_move(_PACKED_MOVE.unpack_from(payload, offset)[0]))
+            offset += _PACKED_MOVE.size
+        self.is_check = bool(flags & FLAG_CHECK)
+        self.check_square = None if check_square == NO_SQUARE else chess.square_name(check_square)
+        self.is_insufficient_material = bool(flags & FLAG_INSUFFICIENT_MATERIAL)
+        book_count = payload[offset]
+        offset += 1
+        self.book_moves = []  # (TaggedMove, weight), most played first
+        for _ in range(book_count):
+            index, weight = _BOOK_MOVE.unpack_from(payload, offset)
+            self.book_moves.append((self.tagged_moves[index], weight))
+            offset += _BOOK_MOVE.size
+
+    def position_info(self):
+        return PositionInfo(self.tagged_moves, self.is_check, self.check_square,
+                            self.is_insufficient_material)
+
+
+class OpeningBook:
+    """Read-only opening book file, memory-mapped on first lookup."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._data = None
+        self._count = 0
+
+    def _open(self):
+        f = open(self.path, 'rb')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            data.close()
+            f.close()
+            raise ValueError("%s is not a version %d opening book" % (self.path, VERSION))
+        self._file, self._data, self._count = f, data, count
+
+    def __len__(self):
+        if self._data is None:
+            self._open()
+        return self._count
+
+    def lookup(self, key):
+        """The BookEntry for a Zobrist key, or None."""
+        if self._data is None:
+            self._open()
+        data = self._data
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_key, offset, length = INDEX_ENTRY.unpack_from(data, HEADER.size + mid * INDEX_ENTRY.size)
+            if entry_key < key:
+                lo = mid + 1
+            elif entry_key > key:
+                hi = mid
+            else:
+                return BookEntry(data[offset:offset + length])
+        return None
+
+    def choose_move(self, key, rng=random):
+        """A book move (TaggedMove) for a Zobrist key, picked by weight, or None."""
+        entry = self.lookup(key)
+        if entry is None or not entry.book_moves:
+            return None
+        moves, weights = zip(*entry.book_moves)
+        return rng.choices(moves, weights=weights)[0]
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._file.close()
+            self._data = self._file = None
+
+
+def open_book(path):
+    """An OpeningBook for path, or None if the file does not exist."""
+    return OpeningBook(path) if path and os.path.exists(path) else None
+
+
+# --- Building ----------------------------------------------------------------
+
+class BookBuilder:
+    """Collects (position, move) occurrences and writes the book file."""
+
+    def __init__(self, max_plies=DEFAULT_MAX_PLIES):
+        self.max_plies = max_plies
+        self.positions = {}  # Zobrist key -> (FEN, {uci: count})
+
+    def add_game(self, start_fen, moves):
+        """Count the first max_plies moves (UCI) of a game played from start_fen."""
+        board = chess.Board(start_fen)
+        key = zobrist.zobrist_hash(board)
+        for uci in moves[:self.max_plies]:
+            fen, counts = self.positions.setdefault(key, (board.fen(), {}))
+            counts[uci] = counts.get(uci, 0) + 1
+            key = zobrist.push(board, chess.Move.from_uci(uci), key)
+
+    def add_pgn(self, path):
+        """Add the games of a PGN archive; invalid games are skipped. Returns (added, skipped)."""
+        added = skipped = 0
+        with open(path) as f:
+            for game in read_games(f):
+                try:
+                    board = replay_game(game)
+                except GameRecordError:
+                    skipped += 1
+                    continue
+                self.add_game(board.start_fen, board.move_history)
+                added += 1
+        return added, skipped
+
+    def add_selfplay(self, path):
+        """Add the games of a self-play record file. Returns (added, 0)."""
+        from selfplay import iter_records
+        added, game, moves = 0, None, []
+        for record in iter_records(path):
+            if record[0] != game:
+                if moves:
+                    self.add_game(chess.STARTING_FEN, moves)
+                    added += 1
+                game, moves = record[0], []
+            if record[1] < self.max_plies:
+                moves.append(chess.Move(record[7], record[8], record[9] or None).uci())
+        if moves:
+            self.add_game(chess.STARTING_FEN, moves)
+            added += 1
+        return added, 0
+
+    def write(self, path, min_count=1):
+        """
+        Write the book with every position that has a move played at least
+        min_count times. Returns the number of positions written.
+        """
+        entries = []
+        for key, (fen, counts) in self.positions.items():
+            counts = {uci: n for uci, n in counts.items() if n >= min_count}
+            if counts:
+                entries.append((key, self._payload(fen, counts)))
+        entries.sort()
+
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+            offset = HEADER.size + len(entries) * INDEX_ENTRY.size
+            for key, payload in entries:
+                f.write(INDEX_ENTRY.pack(key, offset, len(payload)))
+                offset += len(payload)
+            for _, payload in entries:
+                f.write(payload)
+        os.replace(path + '.tmp', path)
+        return len(entries)
+
+    @staticmethod
+    def _payload(fen, counts):
+        board = chess.Board(fen)
+        tagged_moves = generate_moves(board)
+        is_check = board.is_check()
+        flags = ((FLAG_CHECK if is_check else 0) |
+                 (FLAG_INSUFFICIENT_MATERIAL if is_insufficient_material(board) else 0))
+        king = board.king(board.turn)
+        check_square = king if is_check and king is not None else NO_SQUARE
+
+        parts = [_PAYLOAD_HEAD.pack(flags, check_square, len(tagged_moves))]
+        parts.extend(_PACKED_MOVE.pack(pack_move(tagged)) for tagged in tagged_moves)
+        index = {tagged.move.uci(): i for i, tagged in enumerate(tagged_moves)}
+        # Most played first; at most 255 moves, as the count is a byte
+        book_moves = sorted(counts.items(), key=lambda item: -item[1])[:255]
+        parts.append(bytes([len(book_moves)]))
+        parts.extend(_BOOK_MOVE.pack(index[uci], min(n, 0xFFFFFFFF)) for uci, n in book_moves)
+        return b''.join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASHA CHESS opening book.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="build a book from PGN and self-play record files")
+    build.add_argument('sources', nargs='+', help="*.pgn files and selfplay.py record files")
+    build.add_argument('--out', default=DEFAULT_PATH)
+    build.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES,
+                       help="book depth in plies from the start of each game")
+    build.add_argument('--min-count', type=int, default=2,
+                       help="drop moves played fewer times than this")
+
+    show = subparsers.add_parser('show', help="print the book moves of a position")
+    show.add_argument('--book', default=DEFAULT_PATH)
+    show.add_argument('--fen', default=chess.STARTING_FEN)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        builder = BookBuilder(max_plies=args.max_plies)
+        for source in args.sources:
+            if source.endswith('.pgn'):
+                added, skipped = builder.add_pgn(source)
+            else:
+                added, skipped = builder.add_selfplay(source)
+            print('%s: %d games added, %d invalid games skipped' % (source, added, skipped))
+        count = builder.write(args.out, min_count=args.min_count)
+        print('%d positions written to %s' % (count, args.out))
+        return 0
+
+    book = OpeningBook(args.book)
+    board = chess.Board(args.fen)
+    entry = book.lookup(zobrist.zobrist_hash(board))
+    if entry is None:
+        print('position not in the book (%d positions)' % len(book))
+        return 1
+    total = sum(weight for _, weight in entry.book_moves)
+    for tagged, weight in entry.book_moves:
+        print('%-8s %6d  %5.1f%%%s' % (tagged.move.uci(), weight, 100.0 * weight / total,
+                                      "  (King's Step)" if tagged.is_kings_step else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
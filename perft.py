@@ -0,0 +1,193 @@
+"""
+Perft and divide for ASHA CHESS, built on TwoHSChessBoard.
+
+Perft counts the leaf nodes of the legal move tree to a fixed depth. The
+counts pin down move generation exactly (any missing or extra King's Step
+changes them) and the time it takes measures move generation speed.
+
+Usage:
+    python perft.py perft --depth 3                  # variant starting position
+    python perft.py perft --depth 2 --fen "<FEN>"
+    python perft.py divide --depth 2 --fen "<FEN>"   # node count per root move
+    python perft.py check                            # compare against perft_baseline.json
+    python perft.py bench --json                     # timing JSON for the baseline positions
+    python perft.py check --update-baseline          # rewrite the baseline counts
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import chess
+
+from board import TwoHSChessBoard
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perft_baseline.json')
+
+
+def perft(board, depth):
+    """Count the leaf nodes of the legal move tree below the current position."""
+    if depth == 0:
+        return 1
+
+    moves = board.legal_moves()
+    if depth == 1:
+        # Bulk counting: the leaves are the legal moves themselves
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        board.board.push(move)
+        nodes += perft(board, depth - 1)
+        board.board.pop()
+    return nodes
+
+
+def divide(board, depth):
+    """Return a dict mapping each legal root move (UCI) to its perft count."""
+    counts = {}
+    for move in board.legal_moves():
+        board.board.push(move)
+        counts[move.uci()] = perft(board, depth - 1)
+        board.board.pop()
+    return counts
+
+
+def timed_perft(fen, depth):
+    """Run perft on a fresh board and return (nodes, seconds)."""
+    board = TwoHSChessBoard(fen=fen)
+    # Measure move generation, not the shared position cache
+    board.position_cache = None
+    start = time.perf_counter()
+    nodes = perft(board, depth)
+    return nodes, time.perf_counter() - start
+
+
+def load_baseline(path=BASELINE_PATH):
+    """Load the curated positions and their known-good node counts."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(baseline, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+        f.write('\n')
+
+
+def check_baseline(baseline, update=False):
+    """
+    Compare perft counts against the baseline, one line per position and depth.
+
+    Returns the number of mismatches. With update=True the baseline is
+    rewritten with the freshly computed counts instead.
+    """
+    mismatches = 0
+    for entry in baseline['positions']:
+        for depth, expected in enumerate(entry['nodes'], start=1):
+            nodes, seconds = timed_perft(entry['fen'], depth)
+            status = 'ok'
+            if nodes != expected:
+                status = 'updated' if update else 'MISMATCH (expected %d)' % expected
+                mismatches += 1
+                entry['nodes'][depth - 1] = nodes
+            print('%-24s depth %d  %10d nodes  %8.3fs  %s' % (entry['name'], depth, nodes, seconds, status))
+    if update:
+        save_baseline(baseline)
+    return mismatches
+
+
+def benchmark(baseline, depth=None):
+    """
+    Time perft on every baseline position and return machine-readable results.
+
+    By default each position runs to the deepest baseline depth.
+    """
+    results = []
+    for entry in baseline['positions']:
+        position_depth = depth or len(entry['nodes'])
+        nodes, seconds = timed_perft(entry['fen'], position_depth)
+        results.append({
+            "name": entry['name'],
+            "fen": entry['fen'],
+            "depth": position_depth,
+            "nodes": nodes,
+            "seconds": round(seconds, 6),
+            "nps": int(nodes / seconds) if seconds > 0 else None
+        })
+
+    total_nodes = sum(r['nodes'] for r in results)
+    total_seconds = sum(r['seconds'] for r in results)
+    return {
+        "python": platform.python_version(),
+        "chess": chess.__version__,
+        "positions": results,
+        "totalNodes": total_nodes,
+        "totalSeconds": round(total_seconds, 6),
+        "nps": int(total_nodes / total_seconds) if total_seconds > 0 else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft and divide for ASHA CHESS move generation.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('perft', 'divide'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--depth', type=int, default=3)
+        sub.add_argument('--fen', default=TwoHSChessBoard.VARIANT_STARTING_FEN)
+
+    check = subparsers.add_parser('check', help="verify the counts in perft_baseline.json")
+    check.add_argument('--update-baseline', action='store_true',
+                       help="rewrite the baseline with the current counts")
+
+    bench = subparsers.add_parser('bench', help="time perft on the baseline positions")
+    bench.add_argument('--depth', type=int, default=None,
+                       help="override the depth for every position")
+    bench.add_argument('--json', action='store_true', help="print the results as JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'perft':
+        for depth in range(1, args.depth + 1):
+            nodes, seconds = timed_perft(args.fen, depth)
+            nps = int(nodes / seconds) if seconds > 0 else 0
+            print('depth %d  %10d nodes  %8.3fs  %10d nps' % (depth, nodes, seconds, nps))
+        return 0
+
+    if args.command == 'divide':
+        board = TwoHSChessBoard(fen=args.fen)
+        board.position_cache = None
+        counts = divide(board, args.depth)
+        for uci in sorted(counts):
+            print('%s: %d' % (uci, counts[uci]))
+        print()
+        print('Moves: %d' % len(counts))
+        print('Nodes: %d' % sum(counts.values()))
+        return 0
+
+    baseline = load_baseline()
+
+    if args.command == 'check':
+        mismatches = check_baseline(baseline, update=args.update_baseline)
+        if mismatches and not args.update_baseline:
+            print('%d mismatch(es) against %s' % (mismatches, BASELINE_PATH))
+            return 1
+        return 0
+
+    results = benchmark(baseline, depth=args.depth)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results['positions']:
+            print('%-24s depth %d  %10d nodes  %8.3fs  %10d nps' % (
+                r['name'], r['depth'], r['nodes'], r['seconds'], r['nps'] or 0))
+        print('total %d nodes in %.3fs, %d nps' % (
+            results['totalNodes'], results['totalSeconds'], results['nps'] or 0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Speculative precomputation of the positions a game may reach next.
+
+While a player thinks, the server is idle. Pondering uses that time: after
+a response that leaves a game waiting for a move, a background thread
+generates the PositionInfo (legal moves, grouped move info, check) of the
+positions after the most likely replies, or after every reply when there
+are few enough. The player's next move then usually finds its position
+already computed, and /api/move answers without a move generation.
+
+The replies are tried in likely order: opening book moves by weight, then
+the engine's move ordering (captures, promotions, quiet standard moves,
+King's Steps). Each game keeps only the positions pondered from its
+current position; when the game moves on, the next pondering replaces
+them and a job still running for the old position stops.
+
+Everything is bounded: a fixed number of threads, a limit on queued jobs
+(beyond it pondering is skipped, it is only speculation), and a limit on
+the positions kept over all games, evicting the least recently pondered
+games first. Pondering shares the worker process's CPU with the requests
+(threads, one interpreter lock), so it is opt-in: see create_ponder_service.
+Under gevent it is always off: its threads would be greenlets on the event
+loop, and a pondering job would hold up every request until it yields.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from movegen import position_key, MoveLists
+from game_status import compute_position_info
+import engine
+
+DEFAULT_MAX_REPLIES = 64
+DEFAULT_MAX_POSITIONS = 4096
+DEFAULT_MAX_GAMES = 1000
+
+
+class _Pondering:
+    """The positions pondered from one position of a game."""
+    __slots__ = ('parent', 'infos', 'cancelled')
+
+    def __init__(self, parent):
+        self.parent = parent  # position_key of the position being thought about
+        self.infos = {}  # position_key -> PositionInfo
+        self.cancelled = False
+
+
+def likely_replies(board, limit):
+    """Up to limit TaggedMoves of a TwoHSChessBoard, most likely to be played first."""
+    tagged_moves = board.tagged_legal_moves()
+    replies, seen = [], set()
+    if board.opening_book is not None:
+        entry = board.opening_book.lookup(board.zobrist_key)
+        if entry is not None:
+            for tagged, _ in entry.book_moves:
+                replies.append(tagged)
+                seen.add(tagged.move)
+    replies.extend(tagged for tagged in engine.order_moves(board.board, tagged_moves)
+                   if tagged.move not in seen)
+    return replies[:limit]
+
+
+class PonderService:
+    """Background pondering for the games of a worker process."""
+
+    def __init__(self, workers=1, max_replies=DEFAULT_MAX_REPLIES, max_positions=DEFAULT_MAX_POSITIONS,
+                 max_games=DEFAULT_MAX_GAMES, max_pending=None):
+        self.max_replies = max_replies
+        self.max_positions = max_positions
+        self.max_games = max_games
+        self.max_pending = max_pending or workers * 4
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ponder')
+        self._games = OrderedDict()  # game_id -> _Pondering, least recently pondered first
+        self._positions = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.skipped = 0
+
+    def pondered(self, game_id):
+        """The positions pondered for a game ({position_key: PositionInfo}), or None."""
+        entry = self._games.get(game_id)
+        return entry.infos if entry is not None else None
+
+    def ponder(self, game_id, board):
+        """
+        Start pondering the replies to a TwoHSChessBoard, the current
+        position of a game, unless they are already being pondered.
+        """
+        parent = position_key(board.board)
+        info = board.position_info()
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is not None:
+                if entry.parent == parent:
+                    self._games.move_to_end(game_id)
+                    return
+                # The game moved on: the old replies are of no more use
+                self._drop(game_id)
+            if self._pending >= self.max_pending:
+                self.skipped += 1
+                return
+            entry = self._games[game_id] = _Pondering(parent)
+            # The position itself too, for when the shared position cache is off
+            entry.infos[parent] = info
+            self._positions += 1
+            while len(self._games) > self.max_games:
+                self._drop(next(iter(self._games)))
+            self._pending += 1
+            self.jobs += 1
+
+        try:
+            replies = likely_replies(board, self.max_replies)
+            self._executor.submit(self._run, entry, board.board.copy(stack=False), replies,
+                                  board.position_cache, board.tablebase)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def _drop(self, game_id):
+        # Called with the lock held
+        entry = self._games.pop(game_id)
+        entry.cancelled = True
+        self._positions -= len(entry.infos)
+
+    def _run(self, entry, board, replies, position_cache, tablebase):
+        try:
+            move_lists = MoveLists()
+            for tagged in replies:
+                if entry.cancelled:
+                    break
+                board.push(tagged.move)
+                key = position_key(board)
+                if position_cache is None or key not in position_cache:
+                    info = compute_position_info(board, move_lists, tablebase)
+                    # Built now rather than by the request, in both response formats
+                    info.move_info
+                    info.packed_moves
+                    if not self._add(entry, key, info):
+                        board.pop()
+                        break
+                board.pop()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _add(self, entry, key, info):
+        """Keep a pondered position, evicting other games if needed. False if there is no room."""
+        with self._lock:
+            if entry.cancelled:
+                return False
+            while self._positions >= self.max_positions:
+                oldest = next(iter(self._games))
+                if self._games[oldest] is entry:
+                    return False
+                self._drop(oldest)
+            entry.infos[key] = info
+            self._positions += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "games": len(self._games),
+                "positions": self._positions,
+                "maxPositions": self.max_positions,
+                "pending": self._pending,
+                "jobs": self.jobs,
+                "skipped": self.skipped
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for entry in self._games.values():
+                entry.cancelled = True
+        self._executor.shutdown(wait=True)
+
+
+def create_ponder_service(cooperative=False):
+    """
+    Build the ponder service configured by the environment, or None when
+    pondering is off (the default, and always when cooperative is True,
+    i.e. gevent has patched threading):
+
+    PONDER_WORKERS        pondering threads (default 0: off)
+    PONDER_MAX_REPLIES    replies pondered per position (default 64)
+    PONDER_MAX_POSITIONS  pondered positions kept over all games (default 4096)
+    PONDER_MAX_GAMES      games with pondered positions (default 1000)
+    """
+    workers = int(os.environ.get('PONDER_WORKERS', 0))
+    if workers <= 0 or cooperative:
+        return None
+    return PonderService(
+        workers=workers,
+        max_replies=int(os.environ.get('PONDER_MAX_REPLIES', DEFAULT_MAX_REPLIES)),
+        max_positions=int(os.environ.get('PONDER_MAX_POSITIONS', DEFAULT_MAX_POSITIONS)),
+        max_games=int(os.environ.get('PONDER_MAX_GAMES', DEFAULT_MAX_GAMES))
+    )
@@ -0,0 +1,76 @@
+"""
+Process-wide cache of per-position move information.
+
+Every game starts from the same position and openings repeat heavily, but a
+TwoHSChessBoard is rebuilt for every request, so its own cache never sees a
+second lookup. This bounded LRU cache is shared by all boards (and all
+request threads) of a worker process, so a popular position costs a
+dictionary lookup instead of a move generation. Each gunicorn worker holds
+its own copy.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_SIZE = 50000
+
+
+class PositionCache:
+    """Thread-safe LRU cache with hit/miss counters."""
+
+    def __init__(self, max_size=DEFAULT_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache value under key, evicting the least recently used entries."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # Not a lookup: leaves the counters and the LRU order alone
+        return key in self._entries
+
+    def stats(self):
+        """Size and hit/miss counters, e.g. for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Shared by every TwoHSChessBoard in this process; POSITION_CACHE_SIZE=0 disables it
+shared_position_cache = PositionCache(max_size=int(os.environ.get('POSITION_CACHE_SIZE', DEFAULT_SIZE)))
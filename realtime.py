@@ -0,0 +1,316 @@
+"""
+Real-time channels: WebSocket connections of the players of a game, and
+Server-Sent Events streams of its spectators.
+
+Every client of a game (two players in different browsers, or one player
+with several tabs) keeps one WebSocket open. Moves go up the socket, and
+each new state is serialized once and pushed to every connection of the
+game, including the opponent's. Connections in the compact format get
+only the changes since the state they got last.
+
+Idle games cost nothing here: only games with open connections have an
+entry, and a connection is a socket plus a lock. Moves on a game are
+serialized with a per-game lock (striped, so the number of locks is
+fixed), which also covers moves made through the HTTP API.
+
+Spectators only read, so they get a one-way SSE stream (SpectatorHub).
+A new state is serialized once into an SSE frame and the same bytes are
+queued for every spectator, so a spectator costs the bytes written, not
+a move generation. A spectator that cannot keep up skips to the latest
+state. The last frames of watched games are kept so a reconnecting
+spectator can resume from the ply it last saw. A stream waits for frames
+in its own thread, so on a threaded server the number of streams is
+capped to keep threads for requests; under gevent a stream only holds a
+greenlet.
+
+Subscriptions live in the worker process. Run the real-time channel on a
+single gevent worker (gunicorn -k gevent --workers 1, see the README), so
+all connections of a game meet in the same process and an idle connection
+costs a greenlet rather than a thread.
+"""
+from collections import deque, OrderedDict
+import json
+import threading
+import zlib
+
+
+class Connection:
+    """A WebSocket shared by the receiving thread and broadcasts from other threads."""
+    __slots__ = ('ws', 'compact', 'tag', '_lock')
+
+    def __init__(self, ws, compact=False):
+        self.ws = ws
+        self.compact = compact  # the client asked for the compact state format
+        self.tag = None  # state tag of the last state sent, the base of compact deltas
+        self._lock = threading.Lock()
+
+    def send(self, message, tag=None):
+        """Send a message; tag is the state tag of a state message."""
+        with self._lock:
+            self.ws.send(message)
+            if tag is not None:
+                self.tag = tag
+
+
+class GameChannels:
+    """Connections subscribed to each game, and a lock per game for moves."""
+
+    LOCK_STRIPES = 64
+
+    def __init__(self):
+        self._subscribers = {}  # game_id -> set of Connection
+        self._lock = threading.Lock()
+        self._game_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def game_lock(self, game_id):
+        """Lock to hold while loading, changing and saving a game."""
+        return self._game_locks[zlib.crc32(game_id.encode()) % self.LOCK_STRIPES]
+
+    def subscribe(self, game_id, connection):
+        with self._lock:
+            self._subscribers.setdefault(game_id, set()).add(connection)
+
+    def unsubscribe(self, game_id, connection):
+        with self._lock:
+            connections = self._subscribers.get(game_id)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self._subscribers[game_id]
+
+    def has_subscribers(self, game_id):
+        return game_id in self._subscribers
+
+    def broadcast(self, game_id, messages):
+        """
+        Send a new state (StateMessages) to every connection of a game: the
+        full format, or for compact connections the changes since the state
+        they got last. Call it with the game lock held.
+        """
+        with self._lock:
+            connections = list(self._subscribers.get(game_id, ()))
+        for connection in connections:
+            try:
+                if connection.compact:
+                    connection.send(messages.delta(connection.tag), messages.tag)
+                else:
+                    connection.send(messages.full(), messages.tag)
+            except Exception:
+                # Closed or broken socket; its receiving thread cleans up too
+                self.unsubscribe(game_id, connection)
+
+
+class Spectator:
+    """Frames waiting to be written to one SSE stream."""
+    __slots__ = ('compact', 'pending', 'ready')
+
+    # Frames a slow spectator may fall behind before skipping to the latest
+    BACKLOG = 8
+
+    def __init__(self, compact=False):
+        self.compact = compact  # frames in the compact format
+        self.pending = deque()
+        self.ready = threading.Event()
+
+    def push(self, frame):
+        if len(self.pending) >= self.BACKLOG:
+            # Every state is a full snapshot, so the latest one is enough
+            self.pending.clear()
+        self.pending.append(frame)
+        self.ready.set()
+
+    def take(self, timeout):
+        """The frames queued since the last call; empty after timeout."""
+        if not self.ready.wait(timeout):
+            return []
+        self.ready.clear()
+        frames = []
+        while self.pending:
+            frames.append(self.pending.popleft())
+        return frames
+
+
+class SpectatorHub:
+    """SSE spectators of each game, and the last frames of recently watched games."""
+
+    RESUME_PLIES = 64
+    MAX_GAMES = 256
+    KEEPALIVE = 15  # seconds between comments on an idle stream
+
+    def __init__(self, max_streams=0):
+        self.max_streams = max_streams  # open streams allowed at once, 0 for no limit
+        self._spectators = {}  # game_id -> set of Spectator
+        # game_id -> deque of (ply, frame, compact frame), LRU order
+        self._frames = OrderedDict()
+        self._streams = 0
+        self._lock = threading.Lock()
+
+    def has_spectators(self, game_id):
+        return game_id in self._spectators
+
+    def is_full(self):
+        """True if no more streams may be opened (see max_streams)."""
+        return bool(self.max_streams) and self._streams >= self.max_streams
+
+    def is_watched(self, game_id):
+        """True if new states of the game are kept for resuming spectators."""
+        return game_id in self._frames
+
+    def publish(self, game_id, ply, messages):
+        """Queue a new state (StateMessages) for the spectators of a game."""
+        frame = sse_frame(ply, messages.full())
+        compact_frame = sse_frame(ply, messages.compact())
+        with self._lock:
+            self._remember(game_id, ply, frame, compact_frame)
+            spectators = list(self._spectators.get(game_id, ()))
+        for spectator in spectators:
+            spectator.push(compact_frame if spectator.compact else frame)
+
+    def _remember(self, game_id, ply, frame, compact_frame):
+        frames = self._frames.get(game_id)
+        if frames is None:
+            frames = self._frames[game_id] = deque(maxlen=self.RESUME_PLIES)
+            self._evict()
+        else:
+            self._frames.move_to_end(game_id)
+        # After a takeback or reset the ply goes down; older frames no longer apply
+        while frames and frames[-1][0] >= ply:
+            frames.pop()
+        frames.append((ply, frame, compact_frame))
+
+    def _evict(self):
+        # Called with the lock held. Only games nobody watches any more are
+        # forgotten, least recently published first; games with open
+        # streams are kept even beyond MAX_GAMES.
+        excess = len(self._frames) - self.MAX_GAMES
+        if excess <= 0:
+            return
+        for game_id in [game_id for game_id in self._frames if game_id not in self._spectators][:excess]:
+            del self._frames[game_id]
+
+    def stream(self, game_id, since, snapshot, compact=False):
+        """
+        Generator of SSE frames for a new spectator, in the compact format
+        if asked. since is the last ply the spectator has (None for a new
+        one); snapshot() returns the current (ply, StateMessages) and is
+        called only when no frame is kept.
+        """
+        spectator = Spectator(compact)
+        with self._lock:
+            self._streams += 1
+            self._spectators.setdefault(game_id, set()).add(spectator)
+            frames = list(self._frames.get(game_id, ()))
+        try:
+            if not frames:
+                ply, messages = snapshot()
+                frame = sse_frame(ply, messages.full())
+                compact_frame = sse_frame(ply, messages.compact())
+                with self._lock:
+                    kept = self._frames.get(game_id)
+                    if not kept or kept[-1][0] < ply:
+                        self._remember(game_id, ply, frame, compact_frame)
+                frames = [(ply, frame, compact_frame)]
+            frames = [(ply, compact_frame if compact else frame) for ply, frame, compact_frame in frames]
+            # Resume after since if the kept frames reach back that far,
+            # otherwise start from the latest state
+            if since is None or since < frames[0][0] - 1 or since > frames[-1][0]:
+                frames = frames[-1:]
+            else:
+                frames = [(ply, frame) for ply, frame in frames if ply > since]
+            yield b''.join(frame for _, frame in frames) or b': up to date\n\n'
+            last = frames[-1][0] if frames else since
+
+            while True:
+                batch = spectator.take(self.KEEPALIVE)
+                if not batch:
+                    yield b': keepalive\n\n'
+                    continue
+                # Drop frames already sent from the kept ones
+                batch = [frame for frame in batch if frame_ply(frame) != last]
+                if batch:
+                    last = frame_ply(batch[-1])
+                    yield b''.join(batch)
+        finally:
+            with self._lock:
+                self._streams -= 1
+                spectators = self._spectators.get(game_id)
+                if spectators is not None:
+                    spectators.discard(spectator)
+                    if not spectators:
+                        del self._spectators[game_id]
+
+
+def cooperative():
+    """
+    True if gevent has patched threading (gunicorn -k gevent): a stream
+    waiting for frames then holds a greenlet instead of an OS thread.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def sse_frame(ply, message):
+    """An SSE event for a state message; the event id is the ply, for resuming."""
+    return ('id: %d\nevent: state\ndata: %s\n\n' % (ply, message)).encode()
+
+
+def frame_ply(frame):
+    return int(frame[4:frame.index(b'\n')])
+
+
+def state_message(game_id, board, compact=False, delta=None):
+    """
+    The state push for a TwoHSChessBoard: the /api/board fields, in the full
+    or the compact format (with a delta, see GameStatus.to_compact_dict),
+    and the game id.
+    """
+    status = board.game_status()
+    return json.dumps({
+        "type": "state",
+        "gameId": game_id,
+        **(status.to_compact_dict(delta) if compact else status.to_dict())
+    }, separators=(',', ':'))
+
+
+class StateMessages:
+    """
+    The pushes of one new state of a game, each serialized at most once
+    however many clients get it: the full format, the compact format, and
+    compact deltas against the states the connections got last (usually
+    all the same one, the state before the move).
+    """
+
+    def __init__(self, game_id, board):
+        self.game_id = game_id
+        self.board = board
+        self.tag = board.state_tag()
+        self._full = None
+        self._compact = None
+        self._deltas = {}  # acknowledged tag -> message
+
+    def full(self):
+        if self._full is None:
+            self._full = state_message(self.game_id, self.board)
+        return self._full
+
+    def compact(self):
+        if self._compact is None:
+            self._compact = state_message(self.game_id, self.board, compact=True)
+        return self._compact
+
+    def delta(self, ack):
+        """The changes since the state tagged ack; the compact state if it is not part of the game."""
+        if ack is None:
+            return self.compact()
+        if ack not in self._deltas:
+            delta = self.board.state_delta(ack)
+            self._deltas[ack] = (self.compact() if delta is None else
+                                 state_message(self.game_id, self.board, compact=True, delta=delta))
+        return self._deltas[ack]
+
+
+def error_message(error, **fields):
+    return json.dumps({"type": "error", "error": error, **fields}, separators=(',', ':'))
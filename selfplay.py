@@ -0,0 +1,358 @@
+"""
+Self-play tournaments for ASHA CHESS, writing binary training data.
+
+Two move-selection policies play a series of games against each other,
+alternating colours, in parallel worker processes. Policies:
+
+    random              uniformly random legal move
+    greedy              best classic capture by victim value, else random
+    search              engine search to depth 2
+    search:depth=3      engine search to a fixed depth
+    search:time=0.05    engine search for a fixed time per move (seconds)
+    search:nodes=5000   engine search with a fixed node budget per move
+
+Every position of every game is written to a record file as one fixed-width
+record (see RECORD), after a 16-byte file header. The file can be
+memory-mapped directly, e.g. with numpy:
+
+    numpy.memmap(path, dtype=RECORD_NUMPY_DTYPE, mode='r', offset=HEADER.size)
+
+Games are written as soon as they finish, so the runner never holds more
+than the games in flight in memory, however many positions it produces.
+
+Usage:
+    python selfplay.py play random greedy --games 1000 --out games.bin
+    python selfplay.py play greedy search:depth=2 --games 200 --workers 4 --json
+    python selfplay.py stats games.bin
+"""
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import chess
+
+from board import TwoHSChessBoard
+import engine
+
+MAGIC = b'ASHASP'
+VERSION = 1
+# magic, version, record size, reserved
+HEADER = struct.Struct('<6sHI4x')
+
+# One position and the move played from it:
+#   game       uint32  game number in the file
+#   ply        uint16  0 for the starting position
+#   squares    32 bytes, one nibble per square (a1 = low nibble of byte 0):
+#              0 empty, 1-6 white pawn..king, 9-14 black pawn..king
+#   turn       uint8   1 white, 0 black
+#   castling   uint8   bits: 1 K, 2 Q, 4 k, 8 q
+#   ep_square  uint8   64 if none
+#   halfmove   uint8   halfmove clock, capped at 255
+#   from, to   uint8   move squares
+#   promotion  uint8   piece type, 0 if none
+#   flags      uint8   bits: 1 King's Step, 2 capture
+#   result     int8    game result for white: 1 win, 0 draw or unfinished, -1 loss
+#   termination uint8  index into TERMINATIONS
+RECORD = struct.Struct('<IH32sBBBBBBBBbB')
+RECORD_NUMPY_DTYPE = [
+    ('game', '<u4'), ('ply', '<u2'), ('squares', 'u1', (32,)), ('turn', 'u1'),
+    ('castling', 'u1'), ('ep_square', 'u1'), ('halfmove', 'u1'), ('from', 'u1'),
+    ('to', 'u1'), ('promotion', 'u1'), ('flags', 'u1'), ('result', 'i1'), ('termination', 'u1')
+]
+
+FLAG_KINGS_STEP = 1
+FLAG_CAPTURE = 2
+NO_SQUARE = 64
+
+TERMINATIONS = ('max_plies', 'checkmate', 'stalemate', 'insufficient_material',
+                'threefold_repetition', 'fifty_moves')
+
+
+# --- Policies ----------------------------------------------------------------
+
+def parse_policy(spec):
+    """Validate a policy spec such as 'random' or 'search:depth=2'; returns (name, options)."""
+    name, _, args = spec.partition(':')
+    options = {}
+    for arg in filter(None, args.split(',')):
+        key, _, value = arg.partition('=')
+        if key not in ('depth', 'time', 'nodes'):
+            raise ValueError("Unknown policy option %r in %r" % (key, spec))
+        options[key] = float(value) if key == 'time' else int(value)
+    if name not in ('random', 'greedy', 'search'):
+        raise ValueError("Unknown policy %r" % spec)
+    if name != 'search' and options:
+        raise ValueError("Policy %r takes no options" % name)
+    return name, options
+
+
+def choose_move(policy, board, rng):
+    """Pick a legal move (movegen.TaggedMove) of a TwoHSChessBoard with a parsed policy."""
+    name, options = policy
+    tagged_moves = board.tagged_legal_moves()
+    if name == 'greedy':
+        captures = [tagged for tagged in tagged_moves if tagged.is_capture]
+        if captures:
+            def victim_value(tagged):
+                victim = board.board.piece_type_at(tagged.move.to_square) or chess.PAWN
+                return engine.PIECE_VALUES[victim]
+            best = max(victim_value(tagged) for tagged in captures)
+            return rng.choice([tagged for tagged in captures if victim_value(tagged) == best])
+    if name == 'search':
+        # Plain "search" means depth 2; a time or node budget alone sets no depth limit
+        default_depth = engine.MAX_DEPTH if options else 2
+        searcher = engine.Searcher(time_limit=options.get('time'), node_limit=options.get('nodes'),
+                                   max_depth=options.get('depth', default_depth))
+        result = searcher.search(board.board, history=board.position_history)
+        return next(tagged for tagged in tagged_moves if tagged.move == result.best_move)
+    return rng.choice(tagged_moves)
+
+
+# --- Records -----------------------------------------------------------------
+
+def pack_squares(board):
+    """The 32-byte nibble encoding of a chess.Board's pieces."""
+    nibbles = [0] * 64
+    for square, piece in board.piece_map().items():
+        nibbles[square] = piece.piece_type | (0 if piece.color == chess.WHITE else 8)
+    return bytes(nibbles[i] | (nibbles[i + 1] << 4) for i in range(0, 64, 2))
+
+
+def unpack_squares(squares):
+    """Inverse of pack_squares: a dict square -> chess.Piece."""
+    pieces = {}
+    for i, byte in enumerate(squares):
+        for square, nibble in ((2 * i, byte & 15), (2 * i + 1, byte >> 4)):
+            if nibble:
+                pieces[square] = chess.Piece(nibble & 7, not nibble & 8)
+    return pieces
+
+
+def _castling_bits(board):
+    bits = 0
+    for bit, corner in ((1, chess.BB_H1), (2, chess.BB_A1), (4, chess.BB_H8), (8, chess.BB_A8)):
+        if board.castling_rights & corner:
+            bits |= bit
+    return bits
+
+
+def play_game(game, white, black, seed, max_plies=300, random_opening=0):
+    """
+    Play one game between two policy specs and return (records, summary).
+
+    records holds the game's packed position records; summary is a dict with
+    the result, termination reason and length.
+    """
+    rng = random.Random(seed)
+    policies = {chess.WHITE: parse_policy(white), chess.BLACK: parse_policy(black)}
+    board = TwoHSChessBoard()
+    # Skip the shared cache: a worker process never sees the same game twice
+    board.position_cache = None
+
+    positions = []
+    while len(positions) < max_plies and not board.is_game_over():
+        b = board.board
+        if len(positions) < random_opening:
+            tagged = rng.choice(board.tagged_legal_moves())
+        else:
+            tagged = choose_move(policies[b.turn], board, rng)
+        move = tagged.move
+        flags = (FLAG_KINGS_STEP if tagged.is_kings_step else 0) | (FLAG_CAPTURE if tagged.is_capture else 0)
+        positions.append((len(positions), pack_squares(b), int(b.turn), _castling_bits(b),
+                          NO_SQUARE if b.ep_square is None else b.ep_square,
+                          min(b.halfmove_clock, 255), move.from_square, move.to_square,
+                          move.promotion or 0, flags))
+        board.make_move(move.uci())
+
+    reason = board.termination_reason or 'max_plies'
+    result = 0
+    if reason == 'checkmate':
+        result = -1 if board.board.turn == chess.WHITE else 1
+    termination = TERMINATIONS.index(reason)
+    records = b''.join(RECORD.pack(game, *position, result, termination) for position in positions)
+    summary = {"game": game, "white": white, "black": black, "result": result,
+               "termination": reason, "plies": len(positions)}
+    return records, summary
+
+
+# --- Tournament --------------------------------------------------------------
+
+class TournamentStats:
+    """Running aggregates of finished games."""
+
+    def __init__(self, policy_a, policy_b):
+        self.policies = (policy_a, policy_b)
+        self.games = 0
+        self.plies = 0
+        self.wins = {policy_a: 0, policy_b: 0}
+        self.draws = 0
+        self.white_wins = 0
+        self.black_wins = 0
+        self.terminations = {}
+
+    def add(self, summary):
+        self.games += 1
+        self.plies += summary["plies"]
+        self.terminations[summary["termination"]] = self.terminations.get(summary["termination"], 0) + 1
+        if summary["result"] > 0:
+            self.white_wins += 1
+            self.wins[summary["white"]] += 1
+        elif summary["result"] < 0:
+            self.black_wins += 1
+            self.wins[summary["black"]] += 1
+        else:
+            self.draws += 1
+
+    def to_dict(self):
+        games = self.games or 1
+        return {
+            "games": self.games,
+            "positions": self.plies,
+            "averagePlies": round(self.plies / games, 1),
+            "winRate": {policy: round(self.wins[policy] / games, 4) for policy in self.policies},
+            "drawRate": round(self.draws / games, 4),
+            "whiteWinRate": round(self.white_wins / games, 4),
+            "blackWinRate": round(self.black_wins / games, 4),
+            "terminations": dict(sorted(self.terminations.items()))
+        }
+
+
+def write_header(f):
+    f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+
+def run_tournament(policy_a, policy_b, games, out_path, workers=None, seed=0,
+                   max_plies=300, random_opening=0):
+    """
+    Play games between two policies (alternating colours) and write their
+    records to out_path. Returns the aggregate stats as a dict.
+    """
+    parse_policy(policy_a)
+    parse_policy(policy_b)
+    workers = workers or os.cpu_count() or 1
+    stats = TournamentStats(policy_a, policy_b)
+    # Enough games in flight to keep the workers busy, and no more
+    max_in_flight = workers * 4
+
+    start = time.perf_counter()
+    with open(out_path, 'wb') as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        write_header(f)
+        pending = set()
+        next_game = 0
+        while next_game < games or pending:
+            while next_game < games and len(pending) < max_in_flight:
+                white, black = (policy_a, policy_b) if next_game % 2 == 0 else (policy_b, policy_a)
+                pending.add(pool.submit(play_game, next_game, white, black, seed * 1000003 + next_game,
+                                        max_plies, random_opening))
+                next_game += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                records, summary = future.result()
+                f.write(records)
+                stats.add(summary)
+    seconds = time.perf_counter() - start
+
+    report = stats.to_dict()
+    report.update({
+        "policies": [policy_a, policy_b],
+        "out": out_path,
+        "bytes": HEADER.size + stats.plies * RECORD.size,
+        "seconds": round(seconds, 3),
+        "gamesPerSecond": round(stats.games / seconds, 2) if seconds > 0 else None
+    })
+    return report
+
+
+# --- Reading -----------------------------------------------------------------
+
+def iter_records(path):
+    """Yield the records of a file as tuples in RECORD field order, via mmap."""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        magic, version, record_size = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError("%s is not a version %d self-play record file" % (path, VERSION))
+        if os.fstat(f.fileno()).st_size == HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from RECORD.iter_unpack(memoryview(data)[HEADER.size:])
+
+
+def file_stats(path):
+    """Aggregate stats of a record file, streamed record by record."""
+    games, positions = 0, 0
+    results = {1: 0, 0: 0, -1: 0}
+    terminations = {}
+    last_game = None
+    for record in iter_records(path):
+        positions += 1
+        game, result, termination = record[0], record[-2], record[-1]
+        if game != last_game:
+            last_game = game
+            games += 1
+            results[result] += 1
+            name = TERMINATIONS[termination]
+            terminations[name] = terminations.get(name, 0) + 1
+    total = games or 1
+    return {
+        "games": games,
+        "positions": positions,
+        "averagePlies": round(positions / total, 1),
+        "whiteWinRate": round(results[1] / total, 4),
+        "blackWinRate": round(results[-1] / total, 4),
+        "drawRate": round(results[0] / total, 4),
+        "terminations": dict(sorted(terminations.items()))
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASHA CHESS self-play tournaments.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    play = subparsers.add_parser('play', help="play games between two policies")
+    play.add_argument('policy_a')
+    play.add_argument('policy_b')
+    play.add_argument('--games', type=int, default=100)
+    play.add_argument('--out', default='selfplay.bin', help="record file to write")
+    play.add_argument('--workers', type=int, default=None, help="worker processes (default: CPUs)")
+    play.add_argument('--seed', type=int, default=0)
+    play.add_argument('--max-plies', type=int, default=300,
+                      help="stop unfinished games after this many plies")
+    play.add_argument('--random-opening', type=int, default=0,
+                      help="play this many random plies first, for varied games")
+    play.add_argument('--json', action='store_true', help="print the report as JSON")
+
+    stats = subparsers.add_parser('stats', help="aggregate stats of a record file")
+    stats.add_argument('path')
+    stats.add_argument('--json', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'play':
+        try:
+            parse_policy(args.policy_a)
+            parse_policy(args.policy_b)
+        except ValueError as e:
+            parser.error(str(e))
+        report = run_tournament(args.policy_a, args.policy_b, args.games, args.out,
+                                workers=args.workers, seed=args.seed, max_plies=args.max_plies,
+                                random_opening=args.random_opening)
+    else:
+        report = file_stats(args.path)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print('%-14s %s' % (key, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
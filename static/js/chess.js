@@ -20,6 +20,22 @@ document.addEventListener('DOMContentLoaded', () => {
     let draggedPiece = null;
     let draggedPieceSquare = null;
     let isDragging = false;  // Flag to track if a drag operation is in progress
+    let socket = null;  // Real-time game channel; moves fall back to HTTP while it is down
+    let socketRetry = null;
+    let socketState = null;  // Last state received on the socket: the base of its deltas
+    
+    // Game states are fetched in the compact format: moves packed into
+    // integers, statuses as bits, and only the changes since the state we
+    // hold (its tag) when the server can send them
+    const FLAG_CHECK = 1;
+    const FLAG_GAME_OVER = 2;
+    const FLAG_CHECKMATE = 4;
+    const FLAG_STALEMATE = 8;
+    const FLAG_THREEFOLD_REPETITION = 16;
+    const FLAG_FIFTY_MOVES = 32;
+    const FLAG_INSUFFICIENT_MATERIAL = 64;
+    const MOVE_KINGS_STEP = 1 << 13;  // in a packed last move
+    const TARGET_CAPTURE = 64;  // in a target byte of the packed legal moves
     
     // Popup functionality
     manifestBtn.addEventListener('click', () => {
@@ -218,15 +234,121 @@ document.addEventListener('DOMContentLoaded', () => {
         fetchBoardState();
     }
     
+    // Request headers asking for a compact state, relative to the one we hold
+    function stateHeaders() {
+        const headers = { 'X-State-Format': 'compact' };
+        if (boardState && boardState.tag) {
+            headers['X-State-Ack'] = boardState.tag;
+        }
+        return headers;
+    }
+    
+    function squareName(index) {
+        return String.fromCharCode(97 + (index & 7)) + ((index >> 3) + 1);
+    }
+    
+    // Pieces of a FEN's placement field by square index (a1 = 0), '' when empty
+    function fenSquares(fen) {
+        const squares = [];
+        fen.split(' ')[0].split('/').reverse().forEach(rank => {
+            for (const char of rank) {
+                if (isNaN(char)) {
+                    squares.push(char);
+                } else {
+                    for (let i = 0; i < parseInt(char); i++) {
+                        squares.push('');
+                    }
+                }
+            }
+        });
+        return squares;
+    }
+    
+    function placementFen(squares) {
+        const ranks = [];
+        for (let rank = 7; rank >= 0; rank--) {
+            let text = '';
+            let empty = 0;
+            for (let file = 0; file < 8; file++) {
+                const piece = squares[rank * 8 + file];
+                if (piece) {
+                    text += (empty || '') + piece;
+                    empty = 0;
+                } else {
+                    empty++;
+                }
+            }
+            ranks.push(text + (empty || ''));
+        }
+        return ranks.join('/');
+    }
+    
+    // Turn a compact state (a full one, or changes since previous) into the
+    // shape the rest of the page works with
+    function expandState(data, previous) {
+        let fen = data.fen;
+        if (!fen) {
+            const squares = fenSquares(previous.fen);
+            data.squares.forEach(([square, piece]) => { squares[square] = piece; });
+            fen = `${placementFen(squares)} ${data.fenTail}`;
+        }
+        
+        // Legal moves: per origin square, its index, a target count, then one byte per target.
+        // A delta has only the origins whose moves changed; an empty group removes one.
+        const moveInfo = data.moves !== undefined ? {} : { ...previous.moveInfo };
+        const bytes = atob(data.moves !== undefined ? data.moves : data.changedMoves);
+        for (let i = 0; i < bytes.length; ) {
+            const origin = squareName(bytes.charCodeAt(i));
+            const count = bytes.charCodeAt(i + 1);
+            const entry = { moves: [], captures: [] };
+            for (let j = i + 2; j < i + 2 + count; j++) {
+                const target = bytes.charCodeAt(j);
+                (target & TARGET_CAPTURE ? entry.captures : entry.moves).push(squareName(target & 63));
+            }
+            if (count) {
+                moveInfo[origin] = entry;
+            } else {
+                delete moveInfo[origin];
+            }
+            i += 2 + count;
+        }
+        
+        const turn = fen.split(' ')[1] === 'w' ? 'white' : 'black';
+        const isCheck = Boolean(data.flags & FLAG_CHECK);
+        const king = fenSquares(fen).indexOf(turn === 'white' ? 'K' : 'k');
+        return {
+            success: data.success,
+            tag: data.tag,
+            ply: data.ply,
+            fen: fen,
+            turn: turn,
+            moveInfo: moveInfo,
+            isCheck: isCheck,
+            inCheck: isCheck && king >= 0 ? squareName(king) : null,
+            isGameOver: Boolean(data.flags & FLAG_GAME_OVER),
+            gameOverReason: data.reason || null,
+            isCheckmate: Boolean(data.flags & FLAG_CHECKMATE),
+            isStalemate: Boolean(data.flags & FLAG_STALEMATE),
+            isThreefoldRepetition: Boolean(data.flags & FLAG_THREEFOLD_REPETITION),
+            isFiftyMoves: Boolean(data.flags & FLAG_FIFTY_MOVES),
+            isInsufficientMaterial: Boolean(data.flags & FLAG_INSUFFICIENT_MATERIAL),
+            lastMove: data.last === undefined ? null : {
+                from: squareName(data.last & 63),
+                to: squareName((data.last >> 6) & 63),
+                isKingsStep: Boolean(data.last & MOVE_KINGS_STEP)
+            }
+        };
+    }
+    
     // Fetch the current board state from the server
     function fetchBoardState() {
         // Clear any existing highlights first
         clearHighlights();
         
-        fetch('/api/board')
+        fetch('/api/board', { headers: stateHeaders() })
             .then(response => response.json())
             .then(data => {
-                boardState = data;
+                boardState = expandState(data, boardState);
                 updateBoard();
                 updateGameStatus();
                 
@@ -234,10 +356,124 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (boardState.isGameOver) {
                     disableBoardInteraction();
                 }
+                
+                // The session's game exists now, so its channel can be opened
+                connectSocket();
             })
             .catch(error => console.error('Error fetching board state:', error));
     }
     
+    // Open the WebSocket channel of the current game
+    function connectSocket() {
+        if (socket || !('WebSocket' in window)) {
+            return;
+        }
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const ws = new WebSocket(`${protocol}//${window.location.host}/ws/game?format=compact`);
+        socket = ws;
+        // A new connection starts with a full state
+        socketState = null;
+        
+        ws.addEventListener('message', event => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'state') {
+                // Make the address a link to this game, e.g. for the opponent
+                history.replaceState(null, '', `/?game=${data.gameId}`);
+                // The server sends deltas against what it sent on this socket,
+                // which the board shown may have moved on from by HTTP
+                const previous = socketState;
+                socketState = expandState(data, previous);
+                applyState(socketState, previous);
+            } else if (data.type === 'error') {
+                handleMoveError(data);
+            }
+        });
+        
+        ws.addEventListener('close', () => {
+            if (socket === ws) {
+                // Lost the connection; use HTTP and try again in a few seconds
+                socket = null;
+                socketRetry = setTimeout(connectSocket, 3000);
+            }
+        });
+    }
+    
+    function closeSocket() {
+        clearTimeout(socketRetry);
+        if (socket) {
+            const ws = socket;
+            socket = null;
+            ws.close();
+        }
+    }
+    
+    // Apply a state pushed on the channel, by this player's move or the opponent's.
+    // previous is the socket's state before it, if any.
+    function applyState(data, previous) {
+        // Tags, not plies: after a takeback, the same ply can be another position
+        if (data.tag === boardState.tag) {
+            return;
+        }
+        if (previous && previous.tag === boardState.tag && data.ply === boardState.ply + 1 && data.lastMove) {
+            applyMove(boardState, data, data.lastMove.from, data.lastMove.to);
+        } else {
+            // Out of step (e.g. reconnected after several moves): redraw without history
+            boardState = data;
+            updateBoard();
+            updateGameStatus();
+            if (data.isGameOver) {
+                disableBoardInteraction();
+            }
+        }
+    }
+    
+    // Record a move in the history and show the position after it
+    function applyMove(previousBoardState, data, from, to) {
+        // Get move details for history
+        const movedPiece = getPieceAt(from, previousBoardState.fen);
+        const isCapture = (data.lastMove && data.lastMove.isCapture) || getPieceAt(to, previousBoardState.fen) !== null;
+        const isCheck = data.isCheck;
+        const isCheckmate = data.isCheckmate || data.isGameOver;
+        const isKingsStep = data.lastMove && data.lastMove.isKingsStep;
+        
+        // Add move to history
+        addMoveToHistory(
+            { from: from, to: to },
+            movedPiece,
+            isCapture,
+            isCheck,
+            isCheckmate,
+            isKingsStep
+        );
+        
+        // Update board state with new data
+        boardState = data;
+        updateBoard();
+        updateGameStatus();
+        
+        // Deselect the current square
+        selectedSquare = null;
+        
+        // If game is over after this move, disable board
+        if (data.isGameOver) {
+            const winner = previousBoardState.turn === 'white' ? 'White' : 'Black';
+            const gameOverTitle = data.gameOverReason === 'checkmate' ? `${winner} Wins!` : 'Game Over';
+            disableBoardInteraction(gameOverTitle);
+        }
+    }
+    
+    function handleMoveError(error) {
+        console.error('Error making move:', error);
+        
+        // If this was an invalid move due to game over, update UI
+        if (error.isGameOver) {
+            boardState.isGameOver = error.isGameOver;
+            boardState.isCheckmate = error.isCheckmate;
+            updateGameStatus();
+            disableBoardInteraction();
+        }
+    }
+    
     // Update the board display based on current state
     function updateBoard() {
         // Clear previous highlights
@@ -707,13 +943,20 @@ document.addEventListener('DOMContentLoaded', () => {
         // Clear any existing highlights
         clearHighlights();
         
+        // Over the channel, the new state comes back as a push to every player
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'move', move: move }));
+            return;
+        }
+        
         // Store previous board state to track move details
         const previousBoardState = JSON.parse(JSON.stringify(boardState));
         
         fetch('/api/move', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                ...stateHeaders()
             },
             body: JSON.stringify({ move: move })
         })
@@ -723,54 +966,13 @@ document.addEventListener('DOMContentLoaded', () => {
             }
             return response.json();
         })
+        .then(data => expandState(data, previousBoardState))
         .then(data => {
-            if (data.success) {
-                // Get move details for history
-                const from = move.substring(0, 2);
-                const to = move.substring(2, 4);
-                const movedPiece = getPieceAt(from, previousBoardState.fen);
-                const isCapture = data.lastMove && data.lastMove.isCapture;
-                const isCheck = data.isCheck;
-                const isCheckmate = data.isCheckmate || data.isGameOver;
-                const isKingsStep = data.lastMove && data.lastMove.isKingsStep;
-                
-                // Add move to history
-                addMoveToHistory(
-                    { from: from, to: to },
-                    movedPiece,
-                    isCapture,
-                    isCheck,
-                    isCheckmate,
-                    isKingsStep
-                );
-                
-                // Update board state with new data
-                boardState = data;
-                updateBoard();
-                updateGameStatus();
-                
-                // Deselect the current square
-                selectedSquare = null;
-                
-                // If game is over after this move, disable board
-                if (data.isGameOver) {
-                    const winner = previousBoardState.turn === 'white' ? 'White' : 'Black';
-                    const gameOverTitle = data.gameOverReason === 'checkmate' ? `${winner} Wins!` : 'Game Over';
-                    disableBoardInteraction(gameOverTitle);
-                }
+            if (data.success && data.ply !== previousBoardState.ply) {
+                applyMove(previousBoardState, data, move.substring(0, 2), move.substring(2, 4));
             }
         })
-        .catch(error => {
-            console.error('Error making move:', error);
-            
-            // If this was an invalid move due to game over, update UI
-            if (error.isGameOver) {
-                boardState.isGameOver = error.isGameOver;
-                boardState.isCheckmate = error.isCheckmate;
-                updateGameStatus();
-                disableBoardInteraction();
-            }
-        });
+        .catch(handleMoveError);
     }
     
     // Helper function to get piece at square from FEN
@@ -821,6 +1023,9 @@ document.addEventListener('DOMContentLoaded', () => {
             resetMessage.remove();
         }
         
+        // The next game gets its own channel
+        closeSocket();
+        
         // Reset game state
         fetch('/api/reset', {
             method: 'POST',
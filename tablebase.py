@@ -0,0 +1,481 @@
+"""
+Endgame tablebases for ASHA CHESS.
+
+King's Steps change endgame theory (bishops can change colour, every minor
+piece and rook gains mobility), so standard tablebases and python-chess's
+standard-chess assumptions do not apply. This module generates exact
+tables for small pawnless piece sets by retrograde analysis on the variant
+move generator, and probes them.
+
+A table covers one material signature such as "KRvK" or "KBNvK" (white
+pieces, "v", black pieces; the stronger side is white, the other colouring
+is probed by mirroring the board). Every placement of the pieces, with
+either side to move, has one byte:
+
+    0        draw
+    1..254   DTM + 1, where DTM is the number of plies to mate with best
+             play: odd DTM means the side to move wins, even DTM that it
+             loses (DTM 0: it is mated)
+    255      not a legal position
+
+so a table of n men is 2 * 64**n bytes after a small header: 512 KB for
+3 men and 32 MB for 4 men. Tables are opened lazily and probed through mmap,
+so only the pages that are actually touched are read.
+
+Generation is pure Python and takes up to a minute for a 3-man table and
+the better part of an hour for a 4-man one. Tables are capped at 4 men: a
+5-man table would take 2 GB and days to generate.
+
+Pawns, castling rights and the fifty-move rule are not covered: probes of
+such positions return None.
+
+Usage:
+    python tablebase.py generate KRvK KQvK --dir tablebases
+    python tablebase.py probe "8/8/8/4k3/8/8/8/R3K3 w - - 0 1" --dir tablebases
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+import chess
+
+from movegen import generate_moves, KINGS_STEP_MASKS
+
+MAGIC = b'ASHATB'
+VERSION = 1
+# magic, version, number of men, reserved
+HEADER = struct.Struct('<6sHB7x')
+
+DRAW = 0
+INVALID = 255
+MAX_DTM = 253
+MAX_MEN = 4
+
+PIECE_ORDER = 'KQRBN'
+_PIECE_VALUE = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3}
+_KINGS_STEP_TYPES = (chess.KNIGHT, chess.BISHOP, chess.ROOK)
+
+# wdl: 1 win, 0 draw, -1 loss for the side to move; dtm: plies to mate, None for draws
+ProbeResult = namedtuple('ProbeResult', ['wdl', 'dtm'])
+
+
+class TablebaseError(Exception):
+    """Unsupported material signature or malformed table file."""
+
+
+# --- Material signatures -----------------------------------------------------
+
+def _sorted_side(pieces):
+    return ''.join(sorted(pieces, key=PIECE_ORDER.index))
+
+
+def canonical_name(white, black):
+    """
+    Table name for the given piece letters of each side, and whether the
+    colours are swapped in it (the stronger side is always white).
+    """
+    white, black = _sorted_side(white.upper()), _sorted_side(black.upper())
+
+    def strength(side):
+        return (len(side), sum(_PIECE_VALUE[p] for p in side), [-PIECE_ORDER.index(p) for p in side])
+
+    if strength(black) > strength(white):
+        return black + 'v' + white, True
+    return white + 'v' + black, False
+
+
+def parse_name(name):
+    """Split a table name into (white, black) piece letters, validating it."""
+    white, sep, black = name.upper().partition('V')
+    if (not sep or not white.startswith('K') or not black.startswith('K') or
+            white.count('K') != 1 or black.count('K') != 1 or
+            any(p not in PIECE_ORDER for p in white + black)):
+        raise TablebaseError("Invalid table name %r (expected e.g. 'KRvK', pawnless)" % name)
+    if len(white) + len(black) > MAX_MEN:
+        raise TablebaseError("%s has more than %d men" % (name, MAX_MEN))
+    canonical, swapped = canonical_name(white, black)
+    if swapped or canonical != _sorted_side(white) + 'v' + _sorted_side(black):
+        raise TablebaseError("%r is not canonical; use %r" % (name, canonical))
+    return white, black
+
+
+def material_name(board):
+    """(table name, swapped) for the material of a chess.Board."""
+    white = ''.join(p.symbol().upper() for p in board.piece_map().values() if p.color == chess.WHITE)
+    black = ''.join(p.symbol().upper() for p in board.piece_map().values() if p.color == chess.BLACK)
+    return canonical_name(white, black)
+
+
+def table_pieces(name):
+    """The (color, piece_type) of each slot of a table's index, in index order."""
+    white, black = parse_name(name)
+    return ([(chess.WHITE, chess.Piece.from_symbol(p).piece_type) for p in white] +
+            [(chess.BLACK, chess.Piece.from_symbol(p).piece_type) for p in black])
+
+
+def table_path(directory, name):
+    return os.path.join(directory, name + '.atb')
+
+
+# --- Indexing ----------------------------------------------------------------
+
+def encode(squares, turn):
+    """Index of a placement (one square per slot) with the given side to move."""
+    index = 0 if turn == chess.WHITE else 1
+    for square in squares:
+        index = index * 64 + square
+    return index
+
+
+def decode(index, men):
+    """Inverse of encode: (squares, turn)."""
+    squares = [0] * men
+    for i in range(men - 1, -1, -1):
+        index, squares[i] = divmod(index, 64)
+    return squares, chess.WHITE if index == 0 else chess.BLACK
+
+
+def _board_index(board, pieces, swapped):
+    """Index of a chess.Board in a table, or None if its material does not fit."""
+    if swapped:
+        board = board.mirror()
+    squares = []
+    used = set()
+    for color, piece_type in pieces:
+        # Identical pieces take their squares in ascending order
+        candidates = [sq for sq in chess.scan_forward(board.pieces_mask(piece_type, color)) if sq not in used]
+        if not candidates:
+            return None
+        used.add(candidates[0])
+        squares.append(candidates[0])
+    return encode(squares, board.turn)
+
+
+def _set_position(board, pieces, squares, turn):
+    board.clear_board()
+    for (color, piece_type), square in zip(pieces, squares):
+        board.set_piece_at(square, chess.Piece(piece_type, color))
+    board.turn = turn
+
+
+# --- Probing -----------------------------------------------------------------
+
+class Table:
+    """One table file, memory-mapped on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._data = None
+        self.men = None
+
+    def _open(self):
+        f = open(self.path, 'rb')
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            f.close()
+            raise TablebaseError("%s is not a tablebase file" % self.path)
+        magic, version, men = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            f.close()
+            raise TablebaseError("%s is not a version %d tablebase file" % (self.path, VERSION))
+        self._file = f
+        self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.men = men
+
+    def value(self, index):
+        """Raw byte of a position (see the module docstring)."""
+        if self._data is None:
+            self._open()
+        return self._data[HEADER.size + index]
+
+    def has_mates(self):
+        """True if some position of the table has the side to move mated."""
+        if self._data is None:
+            self._open()
+        return self._data.find(bytes([1]), HEADER.size) != -1
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._file.close()
+            self._data = self._file = None
+
+
+class Tablebase:
+    """
+    Probe API over a directory of tables. Tables are opened on first use.
+
+        tb = Tablebase('tablebases')
+        tb.probe(board)       # ProbeResult(wdl=1, dtm=7): side to move mates in 7 plies
+        tb.probe_wdl(board)   # 1 win, 0 draw, -1 loss for the side to move
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._tables = {}
+        self._can_mate = {'KvK': False}
+        # Bare kings need no table
+        self.max_men = 2
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.endswith('.atb'):
+                    name = filename[:-4]
+                    try:
+                        men = len(table_pieces(name))
+                    except TablebaseError:
+                        continue
+                    self._tables[name] = Table(os.path.join(directory, filename))
+                    self.max_men = max(self.max_men, men)
+
+    def available(self):
+        return sorted(self._tables)
+
+    def _value(self, board):
+        if (board.pawns or board.castling_rights or
+                chess.popcount(board.occupied) > self.max_men):
+            return None
+        name, swapped = material_name(board)
+        if name == 'KvK':
+            return DRAW
+        table = self._tables.get(name)
+        if table is None:
+            return None
+        index = _board_index(board, table_pieces(name), swapped)
+        if index is None:
+            return None
+        value = table.value(index)
+        return None if value == INVALID else value
+
+    def probe(self, board):
+        """ProbeResult for a chess.Board, or None if no table covers the position."""
+        value = self._value(board)
+        if value is None:
+            return None
+        if value == DRAW:
+            return ProbeResult(0, None)
+        dtm = value - 1
+        return ProbeResult(1 if dtm % 2 else -1, dtm)
+
+    def probe_wdl(self, board):
+        """1 if the side to move wins, -1 if it loses, 0 for a draw, None if unknown."""
+        result = self.probe(board)
+        return None if result is None else result.wdl
+
+    def adjudicate(self, board):
+        """
+        PGN result of a position under perfect play ('1-0', '0-1', '1/2-1/2'),
+        or None if no table covers it. Meant for game-over adjudication.
+        """
+        wdl = self.probe_wdl(board)
+        if wdl is None:
+            return None
+        if wdl == 0:
+            return '1/2-1/2'
+        white_wins = (wdl > 0) == (board.turn == chess.WHITE)
+        return '1-0' if white_wins else '0-1'
+
+    def can_mate(self, board):
+        """
+        Whether either side can still be mated, in any line of play, with the
+        material of a chess.Board; None if the tables do not cover it.
+        """
+        if (board.pawns or board.castling_rights or
+                chess.popcount(board.occupied) > self.max_men):
+            return None
+        return self._material_can_mate(material_name(board)[0])
+
+    def _material_can_mate(self, name):
+        # A mate is reachable if one is in the table or after some capture
+        if name not in self._can_mate:
+            table = self._tables.get(name)
+            if table is None:
+                return None
+            can_mate = table.has_mates()
+            if not can_mate:
+                for child in _capture_children(name):
+                    child_can_mate = self._material_can_mate(child)
+                    if child_can_mate is None:
+                        return None
+                    if child_can_mate:
+                        can_mate = True
+                        break
+            self._can_mate[name] = can_mate
+        return self._can_mate[name]
+
+    def close(self):
+        for table in self._tables.values():
+            table.close()
+
+
+# --- Generation --------------------------------------------------------------
+
+def _capture_children(name):
+    """Table names reachable from name by one capture."""
+    white, black = parse_name(name)
+    children = set()
+    for i, p in enumerate(white):
+        if p != 'K':
+            children.add(canonical_name(white[:i] + white[i + 1:], black)[0])
+    for i, p in enumerate(black):
+        if p != 'K':
+            children.add(canonical_name(white, black[:i] + black[i + 1:])[0])
+    return children
+
+
+def generate_table(name, directory, progress=None):
+    """
+    Generate the table for name (and any missing smaller tables it depends
+    on) into directory. progress, if given, is called with status lines.
+    """
+    pieces = table_pieces(name)
+    os.makedirs(directory, exist_ok=True)
+    for child in sorted(_capture_children(name)):
+        if child != 'KvK' and not os.path.exists(table_path(directory, child)):
+            generate_table(child, directory, progress)
+    subtables = Tablebase(directory)
+
+    men = len(pieces)
+    size = 2 * 64 ** men
+    values = bytearray(size)          # final values; 0 until decided
+    remaining = bytearray(size)       # quiet moves not yet known to lose; 255: cannot lose
+    capture_max = bytearray(size)     # longest DTM among losing captures
+    buckets = {}
+    board = chess.Board(None)
+    start = time.perf_counter()
+
+    # Pass 1: classify every index, resolve mates and moves into smaller tables
+    for index in range(size):
+        squares, turn = decode(index, men)
+        if len(set(squares)) != men:
+            values[index] = INVALID
+            continue
+        _set_position(board, pieces, squares, turn)
+        if board.is_attacked_by(turn, board.king(not turn)):
+            values[index] = INVALID
+            continue
+
+        tagged_moves = generate_moves(board)
+        if not tagged_moves:
+            if board.is_check():
+                buckets.setdefault(0, []).append(index)
+            # Stalemates stay draws
+            continue
+
+        quiet, can_escape, best_win, worst_loss = 0, False, None, 0
+        for tagged in tagged_moves:
+            if not tagged.is_capture:
+                quiet += 1
+                continue
+            board.push(tagged.move)
+            child = subtables._value(board)
+            board.pop()
+            if child is None:
+                raise TablebaseError("Missing table for a capture from %s" % name)
+            if child == DRAW:
+                can_escape = True
+            elif (child - 1) % 2 == 0:
+                # The opponent is mated in child - 1 plies after this capture
+                best_win = child if best_win is None else min(best_win, child)
+            else:
+                worst_loss = max(worst_loss, child - 1)
+
+        if best_win is not None:
+            buckets.setdefault(best_win, []).append(index)
+        remaining[index] = 255 if can_escape or best_win is not None else quiet
+        capture_max[index] = worst_loss
+        if quiet == 0 and not can_escape and best_win is None:
+            buckets.setdefault(worst_loss + 1, []).append(index)
+
+        if progress and index % 1000000 == 0 and index:
+            progress('%s: classified %d/%d positions (%.0fs)' % (name, index, size, time.perf_counter() - start))
+
+    # Pass 2: retrograde analysis in order of increasing distance to mate
+    dtm, longest = 0, None
+    while buckets:
+        if dtm > MAX_DTM:
+            raise TablebaseError("%s has mates longer than %d plies" % (name, MAX_DTM))
+        for index in buckets.pop(dtm, ()):
+            if values[index] != 0:
+                continue
+            values[index] = dtm + 1
+            longest = dtm
+            squares, turn = decode(index, men)
+            _set_position(board, pieces, squares, turn)
+            occupied = board.occupied
+            mover = not turn
+            for slot, (color, piece_type) in enumerate(pieces):
+                if color != mover:
+                    continue
+                square = squares[slot]
+                # Squares the piece can have come from by a quiet move
+                origins = board.attacks_mask(square)
+                if piece_type in _KINGS_STEP_TYPES:
+                    origins |= KINGS_STEP_MASKS[square]
+                origins &= ~occupied
+                for origin in chess.scan_forward(origins):
+                    previous = squares[:]
+                    previous[slot] = origin
+                    parent = encode(previous, mover)
+                    if values[parent] != 0:
+                        continue
+                    if dtm % 2 == 0:
+                        # Moving into this lost position wins for the parent
+                        buckets.setdefault(dtm + 1, []).append(parent)
+                    elif remaining[parent] != 255:
+                        remaining[parent] -= 1
+                        if remaining[parent] == 0:
+                            # Every move of the parent loses
+                            buckets.setdefault(max(dtm, capture_max[parent]) + 1, []).append(parent)
+        dtm += 1
+
+    path = table_path(directory, name)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, men))
+        f.write(values)
+    os.replace(path + '.tmp', path)
+    if progress:
+        mates = 'no mates' if longest is None else 'longest mate %d plies' % longest
+        progress('%s: done in %.1fs, %s' % (name, time.perf_counter() - start, mates))
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASHA CHESS endgame tablebases.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help="generate tables by retrograde analysis")
+    generate.add_argument('names', nargs='+', help="material signatures, e.g. KRvK KBNvK")
+    generate.add_argument('--dir', default='tablebases')
+
+    probe = subparsers.add_parser('probe', help="look up a position")
+    probe.add_argument('fen')
+    probe.add_argument('--dir', default='tablebases')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        for name in args.names:
+            try:
+                generate_table(name, args.dir, progress=print)
+            except TablebaseError as e:
+                parser.error(str(e))
+        return 0
+
+    tablebase = Tablebase(args.dir)
+    board = chess.Board(args.fen)
+    result = tablebase.probe(board)
+    if result is None:
+        print('not in the tablebase')
+        return 1
+    dtm = '-' if result.dtm is None else result.dtm
+    print('wdl %d  dtm %s  result %s' % (result.wdl, dtm, tablebase.adjudicate(board)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
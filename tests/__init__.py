@@ -0,0 +1,11 @@
+"""
+Test suite of ASHA CHESS. Run it with:
+
+    python -m tests.run_tests
+
+or with pytest. The app is imported with the in-memory game store, so the
+tests leave no database behind.
+"""
+import os
+
+os.environ.setdefault('GAME_STORE', 'memory')
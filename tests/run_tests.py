@@ -0,0 +1,21 @@
+"""
+Run the whole test suite with unittest.
+
+Usage:
+    python -m tests.run_tests [-v]
+"""
+import os
+import sys
+import unittest
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    suite = unittest.defaultTestLoader.discover(tests_dir, top_level_dir=os.path.dirname(tests_dir))
+    result = unittest.TextTestRunner(verbosity=2 if '-v' in argv else 1).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
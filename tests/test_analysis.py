@@ -0,0 +1,50 @@
+"""Engine searches and batch analysis on the analysis process pool."""
+import unittest
+
+import chess
+
+from analysis import AnalysisService
+from board import TwoHSChessBoard
+
+START = TwoHSChessBoard.VARIANT_STARTING_FEN
+
+
+class AnalysisServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.service = AnalysisService(max_workers=2, max_jobs=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.shutdown()
+
+    def test_search_returns_a_legal_move(self):
+        board = TwoHSChessBoard()
+        board.make_move('e2e4')
+        result = self.service.search(board, time_limit=0.2, node_limit=2000)
+        self.assertIn(result.best_move, board.legal_moves())
+        self.assertFalse(result.book)
+
+    def test_batch_results_are_in_order(self):
+        positions = [START, (START, ['e2e4']), 'not a fen', (START, ['e2e5'])] * 5
+        expected = list(TwoHSChessBoard.analyze_positions(positions))
+        results = list(self.service.analyze_positions(iter(positions), chunk_size=3))
+        self.assertEqual(results, expected)
+
+    def test_results_before_a_read_error_are_kept(self):
+        def positions():
+            for _ in range(5):
+                yield START
+            raise ValueError("malformed list item")
+
+        results = []
+        with self.assertRaises(ValueError):
+            for result in self.service.analyze_positions(positions(), chunk_size=2):
+                results.append(result)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0]["fen"], chess.Board(START).fen())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Batch position analysis: TwoHSChessBoard.analyze_positions and /api/analyze."""
+import io
+import json
+import unittest
+
+import app as app_module
+from app import stream_json_list
+from board import TwoHSChessBoard
+
+START = TwoHSChessBoard.VARIANT_STARTING_FEN
+
+
+class AnalyzePositionsTest(unittest.TestCase):
+
+    def test_impossible_positions_are_rejected(self):
+        results = list(TwoHSChessBoard.analyze_positions([
+            '8/8/8/8/8/8/8/8 w - - 0 1',
+            '4k3/8/8/8/8/8/8/4K2R w Q - 0 1',
+            '4k3/8/8/8/8/8/8/4K2R b - - 0 1',
+        ]))
+        self.assertTrue(results[0]["error"].startswith('Invalid position'))
+        self.assertTrue(results[1]["error"].startswith('Invalid position'))
+        self.assertNotIn("error", results[2])
+
+    def test_repeated_positions_keep_their_own_status(self):
+        start = TwoHSChessBoard.VARIANT_STARTING_FEN
+        first, second = TwoHSChessBoard.analyze_positions([start, (start, ['g1f3', 'g8f6', 'f3g1', 'f6g8'])])
+        self.assertEqual(first["legalMoves"], second["legalMoves"])
+        self.assertEqual((first["ply"], second["ply"]), (0, 4))
+
+
+
+class StreamJsonListTest(unittest.TestCase):
+
+    def items(self, body, chunk_size):
+        return list(stream_json_list(io.BytesIO(body.encode()), 'positions', chunk_size=chunk_size))
+
+    def test_items_split_across_chunks(self):
+        for body in ('{"positions": []}',
+                     ' { "positions" :[ "a", {"fen":"x","moves":["e2e4"]}, 12, 3.5e2, [1,2], null, true ] } ',
+                     '{"positions":["\u00e9", "x"]}'):
+            for chunk_size in range(1, 9):
+                self.assertEqual(self.items(body, chunk_size), json.loads(body)["positions"], (body, chunk_size))
+        # Anything after the list is ignored
+        self.assertEqual(self.items('{"positions":[1,2,3]} trailing', 4), [1, 2, 3])
+
+    def test_malformed_lists(self):
+        for body in ('{"positions":[1,2', '{"positions":[1 2]}', '{"positions":[1,]}', '{"positions":["a"'):
+            for chunk_size in (1, 3, 64):
+                with self.assertRaises(ValueError, msg=(body, chunk_size)):
+                    self.items(body, chunk_size)
+        for body in ('{"positions": 5}', '[1]', '', '{"other":1,"positions":[]}'):
+            self.assertIsNone(stream_json_list(io.BytesIO(body.encode()), 'positions'), body)
+
+
+class AnalyzeRouteTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = app_module.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        app_module.analysis_service.shutdown()
+
+    def lines(self, response):
+        return [json.loads(line) for line in response.data.decode().splitlines()]
+
+    def test_ndjson_and_json_bodies(self):
+        positions = [START, {"fen": START, "moves": ['e2e4']}, '8/8/8/8/8/8/8/8 w - - 0 1']
+        ndjson = '\n'.join(json.dumps(position) for position in positions)
+        for body in ({"data": ndjson, "content_type": 'application/x-ndjson'}, {"json": {"positions": positions}}):
+            lines = self.lines(self.client.post('/api/analyze', **body))
+            self.assertEqual([line["index"] for line in lines], [0, 1, 2])
+            self.assertEqual((lines[0]["ply"], lines[1]["ply"]), (0, 1))
+            self.assertIn('e2e4', lines[0]["legalMoves"])
+            self.assertTrue(lines[2]["error"].startswith('Invalid position'))
+
+    def test_malformed_bodies(self):
+        response = self.client.post('/api/analyze', json={"positions": 3})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/analyze', data='{"positions":["%s",' % START,
+                                    content_type='application/json')
+        lines = self.lines(response)
+        self.assertEqual(lines[0]["index"], 0)
+        self.assertIn("Malformed JSON body", lines[1]["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""The compact state format: packed moves, deltas against an acknowledged state, revalidation."""
+import base64
+import gzip
+import json
+import random
+import unittest
+
+import chess
+
+import app as app_module
+from board import TwoHSChessBoard
+from game_status import FLAG_GAME_OVER
+
+
+def unpack_groups(packed):
+    """{origin: bytes of targets} from pack_moves output."""
+    data = base64.b64decode(packed)
+    groups = {}
+    i = 0
+    while i < len(data):
+        groups[data[i]] = data[i + 2:i + 2 + data[i + 1]]
+        i += 2 + data[i + 1]
+    return groups
+
+
+def unpack_moves(packed):
+    """move_info (see GameStatus.to_dict) from pack_moves output."""
+    move_info = {}
+    for origin, targets in unpack_groups(packed).items():
+        entry = move_info[chess.square_name(origin)] = {"moves": [], "captures": []}
+        for target in targets:
+            entry["captures" if target & 64 else "moves"].append(chess.square_name(target & 63))
+    return move_info
+
+
+def expand(state, previous):
+    """
+    A compact state from a delta and the state it was acknowledged against,
+    both with "moves" decoded by unpack_groups, as a client holds them.
+    """
+    if "fen" in state:
+        return dict(state, moves=unpack_groups(state["moves"]))
+    pieces = chess.Board(previous["fen"]).piece_map()
+    for square, symbol in state["squares"]:
+        if symbol:
+            pieces[square] = chess.Piece.from_symbol(symbol)
+        else:
+            pieces.pop(square, None)
+    board = chess.Board(None)
+    board.set_piece_map(pieces)
+    groups = dict(previous["moves"])
+    for origin, targets in unpack_groups(state["changedMoves"]).items():
+        if targets:
+            groups[origin] = targets
+        else:
+            del groups[origin]
+    expanded = {key: value for key, value in state.items()
+                if key not in ("since", "squares", "fenTail", "played", "changedMoves")}
+    expanded["fen"] = board.board_fen() + ' ' + state["fenTail"]
+    expanded["moves"] = groups
+    return expanded
+
+
+class PackedMovesTest(unittest.TestCase):
+
+    def test_packed_moves_match_move_info(self):
+        rng = random.Random(2)
+        board = TwoHSChessBoard()
+        for _ in range(200):
+            status = board.game_status()
+            if status.is_game_over:
+                board = TwoHSChessBoard()
+                continue
+            move_info = {square: {"moves": sorted(entry["moves"]), "captures": sorted(entry["captures"])}
+                         for square, entry in status.to_dict()["moveInfo"].items()}
+            unpacked = {square: {"moves": sorted(entry["moves"]), "captures": sorted(entry["captures"])}
+                        for square, entry in unpack_moves(status.to_compact_dict()["moves"]).items()}
+            self.assertEqual(unpacked, move_info, board.fen())
+            board.make_move(rng.choice(board.tagged_legal_moves()).move.uci())
+
+
+class StateDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app_module.app.test_client()
+
+    def full_state(self):
+        state = self.client.get('/api/board?format=compact').get_json()
+        return expand(state, None)
+
+    def test_deltas_rebuild_the_full_state(self):
+        rng = random.Random(11)
+        for _ in range(4):
+            self.client.post('/api/reset')
+            state = self.full_state()
+            for _ in range(60):
+                if state["flags"] & FLAG_GAME_OVER:
+                    break
+                move = rng.choice(TwoHSChessBoard(state["fen"]).tagged_legal_moves()).move.uci()
+                response = self.client.post('/api/move?format=compact', json={"move": move},
+                                            headers={'X-State-Ack': state["tag"]})
+                delta = response.get_json()
+                self.assertEqual(delta["since"], state["ply"])
+                self.assertEqual(len(delta["played"]), 1)
+                self.assertNotIn("moves", delta)
+                del delta["success"]
+                expanded = expand(delta, state)
+                self.assertEqual(expanded, self.full_state())
+                state = expanded
+
+    def test_delta_over_several_plies(self):
+        self.client.post('/api/reset')
+        start = self.full_state()
+        for move in ('e2e4', 'e7e5', 'g1f3'):
+            self.client.post('/api/move', json={"move": move})
+        delta = self.client.get('/api/board?format=compact&ack=' + start["tag"]).get_json()
+        self.assertEqual(delta["since"], 0)
+        self.assertEqual(len(delta["played"]), 3)
+        self.assertEqual(expand(delta, start), self.full_state())
+
+    def test_unknown_ack_gets_the_full_state(self):
+        self.client.post('/api/reset')
+        self.client.post('/api/move', json={"move": 'e2e4'})
+        state = self.client.get('/api/board?format=compact&ack=0-0').get_json()
+        self.assertIn("fen", state)
+
+
+
+class RevalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app_module.app.test_client()
+        self.client.post('/api/reset')
+
+    def test_unchanged_board_is_not_modified(self):
+        response = self.client.get('/api/board?format=compact')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.client.get('/api/board?format=compact',
+                                         headers={'If-None-Match': etag}).status_code, 304)
+        # The other format has its own tag
+        self.assertEqual(self.client.get('/api/board', headers={'If-None-Match': etag}).status_code, 200)
+        self.client.post('/api/move', json={"move": 'e2e4'})
+        self.assertEqual(self.client.get('/api/board?format=compact',
+                                         headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_large_responses_are_gzipped(self):
+        response = self.client.get('/api/board', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        state = json.loads(gzip.decompress(response.data))
+        self.assertEqual(state["ply"], 0)
+        self.assertNotIn('Content-Encoding', self.client.get('/api/board').headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
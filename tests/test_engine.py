@@ -0,0 +1,81 @@
+"""Engine search: mates, King's Step defences at the horizon, and the search budget."""
+import random
+import unittest
+
+import chess
+
+import engine
+from board import TwoHSChessBoard
+from movegen import generate_moves
+
+# Only the rook's King's Step b6-a5 mates
+KINGS_STEP_MATE = '8/k1K5/1R6/8/8/8/8/8 w - - 0 1'
+# Classic mate, but the f7 or g7 pawn can step to f8 and block
+BACK_RANK_CHECK = 'R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1'
+
+
+def random_positions(count, seed=7, plies=40):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = chess.Board(TwoHSChessBoard.VARIANT_STARTING_FEN)
+        for _ in range(rng.randrange(plies)):
+            moves = generate_moves(board)
+            if not moves:
+                break
+            board.push(rng.choice(moves).move)
+        if generate_moves(board):
+            positions.append(board)
+    return positions
+
+
+class SearchTest(unittest.TestCase):
+
+    def assert_legal_line(self, board, moves):
+        board = board.copy(stack=False)
+        for move in moves:
+            self.assertIn(move, [tagged.move for tagged in generate_moves(board)], board.fen())
+            board.push(move)
+
+    def test_mate_in_one_at_depth_one(self):
+        for fen, move in (('k7/8/1K6/8/8/8/8/7R w - - 0 1', 'h1h8'), (KINGS_STEP_MATE, 'b6a5')):
+            result = engine.Searcher(time_limit=None, max_depth=1).search(chess.Board(fen))
+            self.assertEqual((result.best_move.uci(), result.depth), (move, 1), fen)
+            self.assertEqual(result.score, engine.MATE_SCORE - 1)
+        self.assertTrue(result.is_kings_step)
+
+    def test_kings_step_escapes_mate_at_the_horizon(self):
+        board = chess.Board(BACK_RANK_CHECK)
+        self.assertTrue(board.is_checkmate())
+        result = engine.Searcher(time_limit=None, max_depth=1).search(board)
+        self.assertTrue(result.is_kings_step)
+        self.assertEqual(chess.square_name(result.best_move.to_square), 'f8')
+        self.assertGreater(result.score, -engine.MATE_THRESHOLD)
+
+    def test_quiescence_lines_are_legal(self):
+        # Depth 1 leaves everything after the first move to the quiescence search
+        for board in random_positions(30):
+            for max_depth in (1, 2):
+                result = engine.Searcher(time_limit=None, max_depth=max_depth).search(board)
+                self.assert_legal_line(board, [result.best_move])
+                self.assert_legal_line(board, result.pv)
+                self.assertLess(abs(result.score), engine.MATE_SCORE)
+
+    def test_node_budget(self):
+        board = chess.Board(TwoHSChessBoard.VARIANT_STARTING_FEN)
+        for node_limit in (300, 3000):
+            result = engine.Searcher(time_limit=None, node_limit=node_limit).search(board)
+            self.assertLessEqual(result.nodes, node_limit)
+            self.assertGreaterEqual(result.depth, 1)
+            self.assert_legal_line(board, result.pv)
+        lines = engine.Searcher(time_limit=None, node_limit=300).analyse(board)
+        self.assertEqual(len(lines), len(generate_moves(board)))
+
+    def test_no_legal_moves(self):
+        result = engine.search(TwoHSChessBoard('7k/5KQ1/8/8/8/8/8/8 b - - 0 1'), time_limit=None)
+        self.assertIsNone(result.best_move)
+        self.assertEqual(result.score, -engine.MATE_SCORE)
+
+
+if __name__ == '__main__':
+    unittest.main()
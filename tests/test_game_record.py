@@ -0,0 +1,77 @@
+"""PGN game records: SAN with King's Step disambiguation and {KS} comments, read back and replayed."""
+import io
+import random
+import unittest
+
+from board import TwoHSChessBoard
+from game_record import (GameRecordError, RawGame, export_game, read_games, replay_game,
+                         validate_games, write_game)
+
+START = TwoHSChessBoard.VARIANT_STARTING_FEN
+
+
+def random_game(seed, plies=60):
+    rng = random.Random(seed)
+    board, kings_steps = TwoHSChessBoard(), 0
+    for _ in range(plies):
+        if board.is_game_over():
+            break
+        tagged = rng.choice(board.tagged_legal_moves())
+        kings_steps += tagged.is_kings_step
+        board.make_move(tagged.move.uci())
+    return board, kings_steps
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def test_kings_step_san(self):
+        # The pawn King's Step e2-d3 shares "d3" with the push d2-d3
+        pgn = write_game(START, ['e2d3', 'd7d5', 'g1f3', 'c7c6', 'f3e3'])
+        self.assertIn('1. ed3 {KS} d5 2. Nf3 c6 3. Ne3 {KS} *', pgn)
+        board = replay_game(next(read_games(io.StringIO(pgn))))
+        self.assertEqual(board.move_history, ['e2d3', 'd7d5', 'g1f3', 'c7c6', 'f3e3'])
+
+    def test_random_games(self):
+        boards, kings_steps = zip(*(random_game(seed) for seed in range(20)))
+        self.assertGreater(sum(kings_steps), 0)
+        archive = io.StringIO('\n'.join(export_game(board) for board in boards))
+        games = list(read_games(archive))
+        self.assertEqual(len(games), len(boards))
+        for board, game in zip(boards, games):
+            replayed = replay_game(game)
+            self.assertEqual(replayed.move_history, board.move_history)
+            self.assertEqual(replayed.board.fen(), board.board.fen())
+
+    def test_other_start_position(self):
+        fen = '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1'
+        pgn = write_game(fen, ['e2d3', 'e8d8'])
+        game = next(read_games(io.StringIO(pgn)))
+        self.assertEqual((game.headers["SetUp"], game.headers["FEN"]), ('1', fen))
+        self.assertEqual(replay_game(game).move_history, ['e2d3', 'e8d8'])
+
+
+class InvalidGameTest(unittest.TestCase):
+
+    def assert_invalid(self, headers, movetext, ply=None):
+        with self.assertRaises(GameRecordError) as caught:
+            replay_game(RawGame(headers, movetext))
+        self.assertEqual(caught.exception.ply, ply)
+
+    def test_malformed_fen_tag(self):
+        self.assert_invalid({"FEN": "rnbqkbnr/pppppppp/8 w KQkq - 0 1"}, '1. e4 *')
+        self.assert_invalid({"FEN": "not a position"}, '*')
+
+    def test_bad_moves(self):
+        self.assert_invalid({}, '1. e4 e5 2. Ke3 *', ply=3)
+        # d3 is the push, not the King's Step
+        self.assert_invalid({}, '1. d3 {KS} *', ply=1)
+
+    def test_validate_counts_invalid_games(self):
+        lines = io.StringIO(write_game(START, ['e2d3']) + '\n[FEN "8/8 w - - 0 1"]\n\n*\n')
+        stats = validate_games(lines)
+        self.assertEqual((stats["games"], stats["valid"], stats["invalid"], stats["plies"]), (2, 1, 1, 1))
+        self.assertEqual(stats["errors"][0]["game"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
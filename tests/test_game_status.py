@@ -0,0 +1,52 @@
+"""GameStatus: the single-pass snapshot of a position, and game over detection."""
+import unittest
+
+import chess
+
+from board import TwoHSChessBoard
+
+
+
+class GameStatusTest(unittest.TestCase):
+
+    def test_fools_mate_is_blocked_by_a_kings_step(self):
+        board = TwoHSChessBoard()
+        for move in ('f2f3', 'e7e5', 'g2g4', 'd8h4'):
+            self.assertTrue(board.make_move(move))
+        state = board.game_status().to_dict()
+        self.assertTrue(state["isCheck"])
+        self.assertEqual(state["inCheck"], 'e1')
+        self.assertFalse(state["isGameOver"])
+        # Pieces step onto f2 or g3 to block
+        self.assertEqual(state["moveInfo"]["e2"], {"moves": ['f2'], "captures": []})
+        self.assertEqual(state["lastMove"], {"from": 'd8', "to": 'h4', "isKingsStep": False})
+
+    def test_game_over_reasons(self):
+        board = TwoHSChessBoard('k7/8/1K6/8/8/8/8/7Q w - - 0 1')
+        self.assertTrue(board.make_move('h1h8'))
+        status = board.game_status()
+        self.assertEqual((status.game_over_reason, status.is_checkmate, board.termination_reason),
+                         ('checkmate', True, 'checkmate'))
+        self.assertEqual(status.game_over_dict()["gameOverReason"], 'checkmate')
+        for fen, reason in (('k7/8/1Q6/8/8/8/8/K7 b - - 0 1', 'stalemate'),
+                            ('4k3/8/8/8/8/8/4R3/4K3 w - - 100 80', 'fifty_moves')):
+            self.assertEqual(TwoHSChessBoard(fen).game_status().game_over_reason, reason, fen)
+
+    def test_snapshot_matches_the_board(self):
+        board = TwoHSChessBoard()
+        board.make_move('e2e4')
+        status = board.game_status()
+        self.assertIs(board.game_status(), status)
+        state = status.to_dict()
+        self.assertEqual((state["fen"], state["turn"], state["ply"]), (board.fen(), 'black', 1))
+        moves = {(origin, target) for origin, entry in state["moveInfo"].items()
+                 for target in entry["moves"] + entry["captures"]}
+        self.assertEqual(moves, {(chess.square_name(move.from_square), chess.square_name(move.to_square))
+                                 for move in board.legal_moves()})
+        # A new move invalidates the snapshot
+        board.make_move('e7e5')
+        self.assertIsNot(board.game_status(), status)
+
+
+if __name__ == '__main__':
+    unittest.main()
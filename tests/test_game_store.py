@@ -0,0 +1,61 @@
+"""Game stores: lazy opening, idle TTL and the default database path."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import game_store
+from game_store import MemoryGameStore, SQLiteGameStore
+
+
+class SQLiteGameStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'games.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_database_is_opened_on_first_use(self):
+        store = SQLiteGameStore(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        store.put('g', {"fen": "x"})
+        self.assertEqual(store.get('g'), {"fen": "x"})
+        store.delete('g')
+        self.assertIsNone(store.get('g'))
+
+    def test_reads_keep_a_game_alive(self):
+        store = SQLiteGameStore(self.path, ttl=100)
+        with mock.patch('time.time', return_value=1000.0):
+            store.put('g', {"ply": 1})
+        # Read before the TTL runs out, then idle for less than the TTL again
+        with mock.patch('time.time', return_value=1090.0):
+            self.assertIsNotNone(store.get('g'))
+        with mock.patch('time.time', return_value=1180.0):
+            self.assertIsNotNone(store.get('g'))
+        with mock.patch('time.time', return_value=1281.0):
+            self.assertIsNone(store.get('g'))
+
+    def test_default_path_is_next_to_the_module(self):
+        self.assertEqual(os.path.dirname(game_store.DEFAULT_PATH),
+                         os.path.dirname(os.path.abspath(game_store.__file__)))
+        with mock.patch.dict(os.environ, {'GAME_STORE': 'sqlite'}):
+            os.environ.pop('GAME_STORE_PATH', None)
+            self.assertEqual(game_store.create_game_store().path, game_store.DEFAULT_PATH)
+
+
+class MemoryGameStoreTest(unittest.TestCase):
+
+    def test_least_recently_used_games_are_evicted(self):
+        store = MemoryGameStore(max_games=2)
+        store.put('a', 1)
+        store.put('b', 2)
+        store.get('a')
+        store.put('c', 3)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual((store.get('a'), store.get('c')), (1, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
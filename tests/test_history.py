@@ -0,0 +1,103 @@
+"""Takeback and position_at against replaying the game from its start, and their routes."""
+import json
+import random
+import unittest
+
+import app as app_module
+from board import TwoHSChessBoard, board_to_state, board_from_state
+
+# Knights out and back twice: the starting position occurs a third time at ply 8
+THREEFOLD_MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2
+
+
+def snapshot(board):
+    """Everything a board reports about its position and game."""
+    return (board.fen(), board.zobrist_key, list(board.position_history), dict(board._repetition_counts),
+            list(board.move_history), board.last_move, board.last_move_kings_step,
+            board.termination_reason, board.game_status().to_dict())
+
+
+def replay(moves, fen=TwoHSChessBoard.VARIANT_STARTING_FEN):
+    board = TwoHSChessBoard(fen)
+    for move in moves:
+        assert board.make_move(move), move
+    return board
+
+
+def random_game(rng, max_plies=120):
+    board = TwoHSChessBoard()
+    while not board.is_game_over() and len(board.move_history) < max_plies:
+        board.make_move(rng.choice(board.tagged_legal_moves()).move.uci())
+    return board.move_history
+
+
+class HistoryTest(unittest.TestCase):
+
+    def assertMatchesReplay(self, board, moves):
+        self.assertEqual(snapshot(board), snapshot(replay(moves)))
+
+    def test_takeback_across_a_repetition(self):
+        board = replay(THREEFOLD_MOVES)
+        stored = board_from_state(json.loads(json.dumps(board_to_state(board))))
+        for ply in range(len(THREEFOLD_MOVES) + 1):
+            self.assertMatchesReplay(stored.position_at(ply), THREEFOLD_MOVES[:ply])
+        self.assertFalse(stored.position_at(7).is_threefold_repetition())
+
+        # Taking back the repetition reopens the game; repeating it ends it again
+        board.takeback(1)
+        self.assertMatchesReplay(board, THREEFOLD_MOVES[:7])
+        self.assertTrue(board.make_move('f6g8'))
+        self.assertTrue(board.is_threefold_repetition())
+        stored.takeback(2)
+        self.assertMatchesReplay(stored, THREEFOLD_MOVES[:6])
+
+    def test_random_games(self):
+        rng = random.Random(5)
+        for _ in range(8):
+            moves = random_game(rng)
+            board = replay(moves)
+            stored = board_from_state(json.loads(json.dumps(board_to_state(board))))
+            for ply in rng.sample(range(len(moves) + 1), min(6, len(moves) + 1)):
+                self.assertMatchesReplay(stored.position_at(ply), moves[:ply])
+
+            # From the stored records, and by popping the moves of a live board
+            plies = rng.randint(0, len(moves))
+            stored.takeback(plies)
+            self.assertMatchesReplay(stored, moves[:len(moves) - plies])
+            board.takeback(plies)
+            self.assertMatchesReplay(board, moves[:len(moves) - plies])
+
+    def test_takeback_bounds(self):
+        board = replay(['e2e4'])
+        with self.assertRaises(ValueError):
+            board.takeback(2)
+        with self.assertRaises(ValueError):
+            board.position_at(2)
+
+
+
+class HistoryRoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app_module.app.test_client()
+        self.client.post('/api/reset')
+        for move in ('e2e4', 'e7e5', 'g1f3'):
+            self.client.post('/api/move', json={"move": move})
+
+    def test_takeback(self):
+        self.assertEqual(self.client.post('/api/takeback', json={"plies": 4}).status_code, 400)
+        self.assertEqual(self.client.post('/api/takeback', json={"plies": True}).status_code, 400)
+        state = self.client.post('/api/takeback', json={"plies": 2}).get_json()
+        self.assertEqual((state["ply"], state["fen"]), (1, replay(['e2e4']).fen()))
+        self.assertEqual(self.client.get('/api/board').get_json()["ply"], 1)
+
+    def test_history_view_leaves_the_game_alone(self):
+        state = self.client.get('/api/game/history?ply=1').get_json()
+        self.assertEqual((state["ply"], state["gamePlies"]), (1, 3))
+        self.assertEqual(state["fen"], replay(['e2e4']).fen())
+        self.assertEqual(self.client.get('/api/game/history?ply=4').status_code, 400)
+        self.assertEqual(self.client.get('/api/board').get_json()["ply"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
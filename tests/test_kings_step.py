@@ -0,0 +1,60 @@
+"""The King's Step rule: which pieces step, where, and when a step is legal."""
+import unittest
+
+import chess
+
+from board import TwoHSChessBoard
+
+
+def ucis(tagged_moves, kings_step=None):
+    return {tagged.move.uci() for tagged in tagged_moves
+            if kings_step is None or tagged.is_kings_step == kings_step}
+
+
+class KingsStepTest(unittest.TestCase):
+
+    def test_starting_position(self):
+        board = TwoHSChessBoard()
+        tagged_moves = board.tagged_legal_moves()
+        self.assertEqual(len(tagged_moves), 34)
+        # Only the pawns can step, diagonally forward
+        self.assertEqual(ucis(tagged_moves, kings_step=True),
+                         {'a2b3', 'b2a3', 'b2c3', 'c2b3', 'c2d3', 'd2c3', 'd2e3',
+                          'e2d3', 'e2f3', 'f2e3', 'f2g3', 'g2f3', 'g2h3', 'h2g3'})
+
+    def test_bishop_steps_orthogonally(self):
+        board = TwoHSChessBoard('4k3/8/8/8/3B4/8/8/4K3 w - - 0 1')
+        self.assertEqual(ucis(board.tagged_legal_moves(), kings_step=True),
+                         {'d4d5', 'd4e4', 'd4d3', 'd4c4'})
+
+    def test_steps_never_capture(self):
+        board = TwoHSChessBoard('4k3/8/8/8/8/8/1p6/R3K3 w - - 0 1')
+        self.assertNotIn('a1b2', ucis(board.tagged_legal_moves()))
+        self.assertFalse(board.make_move('a1b2'))
+
+    def test_pinned_piece_steps_only_along_the_pin(self):
+        board = TwoHSChessBoard('4k3/4r3/8/8/8/8/4N3/4K3 w - - 0 1')
+        moves = ucis(board.tagged_legal_moves())
+        self.assertIn('e2e3', moves)
+        self.assertNotIn('e2d2', moves)
+        self.assertNotIn('e2c3', moves)
+
+    def test_queen_and_king_do_not_step(self):
+        board = TwoHSChessBoard('4k3/8/8/8/3Q4/8/8/4K3 w - - 0 1')
+        self.assertEqual(ucis(board.tagged_legal_moves(), kings_step=True), set())
+
+    def test_pawn_steps_onto_the_back_rank_without_promoting(self):
+        board = TwoHSChessBoard('7k/4P3/8/8/8/8/8/4K3 w - - 0 1')
+        self.assertEqual(ucis(board.tagged_legal_moves(), kings_step=True),
+                         {'e7d6', 'e7d7', 'e7d8', 'e7e6', 'e7e8', 'e7f6', 'e7f7', 'e7f8'})
+        self.assertTrue(board.make_move('e7e8'))
+        self.assertEqual(board.board.piece_at(chess.E8), chess.Piece(chess.PAWN, chess.WHITE))
+
+    def test_step_can_block_a_check(self):
+        board = TwoHSChessBoard('4k3/8/8/8/8/8/3N4/r3K3 w - - 0 1')
+        self.assertEqual(ucis(board.tagged_legal_moves()), {'d2b1', 'd2c1', 'd2d1', 'e1e2', 'e1f2'})
+        self.assertEqual(ucis(board.tagged_legal_moves(), kings_step=True), {'d2c1', 'd2d1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
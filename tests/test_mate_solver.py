@@ -0,0 +1,120 @@
+"""Forced mates under the variant's rules, and resuming an interrupted puzzle mining run."""
+import json
+import os
+import tempfile
+import unittest
+
+import chess
+
+from game_record import write_game
+from mate_solver import MateSolver, solve_mate, mine_archives, parse_mate_lengths, _clean_output
+from movegen import generate_moves
+
+# Mates found by the KRvK tablebase: 3 and 5 plies
+MATE_IN_2 = '8/8/8/8/2R4K/8/8/7k w - - 0 1'
+MATE_IN_3 = '6k1/8/3R4/4K3/8/8/8/8 w - - 0 1'
+# Only the rook's King's Step b6-a5 mates
+KINGS_STEP_MATE = '8/k1K5/1R6/8/8/8/8/8 w - - 0 1'
+# Ra8 is mate in classic chess, but a pawn King's Step to f8 blocks it
+BACK_RANK = '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+
+
+class MateSolverTest(unittest.TestCase):
+
+    def assert_mating_line(self, fen, pv):
+        board = chess.Board(fen)
+        for tagged in pv:
+            self.assertIn(tagged, generate_moves(board))
+            board.push(tagged.move)
+        self.assertTrue(board.is_check())
+        self.assertEqual(generate_moves(board), [])
+
+    def test_shortest_mates(self):
+        for fen, mate_in in ((MATE_IN_2, 2), (MATE_IN_3, 3), (KINGS_STEP_MATE, 1)):
+            result = solve_mate(chess.Board(fen), max_moves=3)
+            self.assertEqual((result.status, result.mate_in), ('mate', mate_in), fen)
+            self.assertEqual(len(result.pv), 2 * mate_in - 1)
+            self.assert_mating_line(fen, result.pv)
+
+    def test_kings_step_mates(self):
+        solver = MateSolver()
+        board = chess.Board(KINGS_STEP_MATE)
+        self.assertEqual([tagged.move.uci() for tagged in solver.solutions(board, 1)], ['b6a5'])
+        self.assertTrue(solver.solve(board, 1).pv[0].is_kings_step)
+
+    def test_kings_step_defends(self):
+        board = chess.Board(BACK_RANK)
+        board.push_uci('a1a8')
+        self.assertTrue(board.is_checkmate())
+        self.assertEqual(solve_mate(chess.Board(BACK_RANK), max_moves=2).status, 'no_mate')
+
+    def test_no_mate_and_budget(self):
+        self.assertEqual(solve_mate(chess.Board('4k3/8/8/8/8/8/8/4K3 w - - 0 1'), max_moves=3).status, 'no_mate')
+        result = solve_mate(chess.Board(MATE_IN_3), max_moves=3, node_limit=50)
+        self.assertEqual((result.status, result.mate_in, result.pv), ('unknown', None, []))
+
+    def test_parse_mate_lengths(self):
+        self.assertEqual(parse_mate_lengths('2'), [2])
+        self.assertEqual(parse_mate_lengths('2-4'), [2, 3, 4])
+        for spec in ('0', '3-2', 'x'):
+            with self.assertRaises(ValueError):
+                parse_mate_lengths(spec)
+
+
+class MiningResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.archive = os.path.join(self.tmp.name, 'games.pgn')
+        self.out = os.path.join(self.tmp.name, 'puzzles.ndjson')
+        with open(self.archive, 'w') as f:
+            for fen in (MATE_IN_2, BACK_RANK, '8/5R2/8/8/8/2K5/k7/8 w - - 0 1'):
+                f.write(write_game(fen, []) + '\n')
+
+    def mine(self):
+        return mine_archives([self.archive], self.out, [2], chunk_games=1)
+
+    def puzzles(self):
+        with open(self.out) as f:
+            return [json.loads(line) for line in f]
+
+    def test_clean_output_drops_unfinished_chunks(self):
+        with open(self.out, 'w') as f:
+            f.write(json.dumps({"fen": MATE_IN_2, "chunk": 0}) + '\n')
+            f.write(json.dumps({"fen": MATE_IN_3, "chunk": 1}) + '\n')
+            f.write('{"fen": "8/5R2/8/8/8/2K5/k7/8 w - - 0 1", "ch')
+        seen = _clean_output(self.out, {0})
+        self.assertEqual(seen, {chess.Board(MATE_IN_2).epd()})
+        self.assertEqual([puzzle["chunk"] for puzzle in self.puzzles()], [0])
+
+    def test_resume_after_interruption(self):
+        totals = self.mine()
+        self.assertEqual((totals["games"], totals["puzzles"]), (3, 2))
+        expected = self.puzzles()
+        self.assertEqual([puzzle["chunk"] for puzzle in expected], [0, 2])
+
+        # Interrupted after writing chunk 2's puzzle but before saving its progress
+        progress_path = self.out + '.progress.json'
+        with open(progress_path) as f:
+            state = json.load(f)
+        state["done"].remove(2)
+        with open(progress_path, 'w') as f:
+            json.dump(state, f)
+        with open(self.out, 'a') as f:
+            f.write('{"fen": ')
+
+        self.mine()
+        resumed = self.puzzles()
+        for puzzle in expected + resumed:
+            del puzzle["seconds"]
+        self.assertEqual(resumed, expected)
+
+    def test_other_options_are_refused(self):
+        self.mine()
+        with self.assertRaises(ValueError):
+            mine_archives([self.archive], self.out, [3], chunk_games=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Incremental move lists: random push/pop walks against a fresh generation."""
+import random
+import unittest
+
+import chess
+
+from movegen import generate_moves, MoveLists
+import zobrist
+from board import TwoHSChessBoard
+
+
+class MoveListsTest(unittest.TestCase):
+    """Random push/pop walks: incremental move lists must match a fresh generation."""
+
+    def test_chess_board_walk(self):
+        rng = random.Random(7)
+        move_lists = MoveLists()
+        board = chess.Board()
+        for _ in range(4000):
+            plain = generate_moves(board)
+            self.assertEqual(generate_moves(board, move_lists), plain, board.fen())
+            r = rng.random()
+            if not plain or board.ply() > 150 or r < 0.01:
+                board = chess.Board()
+            elif r < 0.2 and board.move_stack:
+                board.pop()
+            else:
+                board.push(rng.choice(plain).move)
+
+    def test_game_board_walk(self):
+        rng = random.Random(3)
+        board = TwoHSChessBoard()
+        for _ in range(1500):
+            tagged_moves = board.tagged_legal_moves()
+            self.assertEqual(tagged_moves, generate_moves(board.board), board.fen())
+            self.assertEqual(board.zobrist_key, zobrist.zobrist_hash(board.board))
+            if board.move_history and (not tagged_moves or rng.random() < 0.25):
+                board.pop()
+            elif tagged_moves:
+                tagged = rng.choice(tagged_moves)
+                board.push(tagged.move, tagged.is_kings_step)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Opening book files: building, lookups and the payload format."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+
+import opening_book
+import zobrist
+from movegen import generate_moves
+from opening_book import BookBuilder, BookEntry, OpeningBook
+
+
+class OpeningBookTest(unittest.TestCase):
+
+    def test_build_and_lookup(self):
+        builder = BookBuilder(max_plies=2)
+        for _ in range(3):
+            builder.add_game(chess.STARTING_FEN, ['e2e4', 'e7e5'])
+        builder.add_game(chess.STARTING_FEN, ['d2d4'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'book.bin')
+            self.assertEqual(builder.write(path, min_count=1), 2)
+            book = OpeningBook(path)
+            entry = book.lookup(zobrist.zobrist_hash(chess.Board()))
+            self.assertEqual([(tagged.move.uci(), weight) for tagged, weight in entry.book_moves],
+                             [('e2e4', 3), ('d2d4', 1)])
+            self.assertEqual(len(entry.tagged_moves), len(generate_moves(chess.Board())))
+            self.assertIsNone(book.lookup(12345))
+            book.close()
+
+    def test_more_than_255_legal_moves(self):
+        # Counts and indexes of legal moves must not be limited to a byte
+        board = chess.Board()
+        tagged_moves = generate_moves(board) * 20
+        with mock.patch.object(opening_book, 'generate_moves', return_value=tagged_moves):
+            payload = BookBuilder._payload(board.fen(), {tagged_moves[-1].move.uci(): 7})
+        entry = BookEntry(payload)
+        self.assertEqual(len(entry.tagged_moves), len(tagged_moves))
+        self.assertEqual(entry.book_moves, [(tagged_moves[-1], 7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+"""Pondering of the replies to a game's position."""
+import os
+import unittest
+from unittest import mock
+
+from board import TwoHSChessBoard
+from movegen import position_key
+from ponder import PonderService, create_ponder_service, likely_replies
+
+
+class PonderServiceTest(unittest.TestCase):
+
+    def test_replies_are_pondered(self):
+        service = PonderService(workers=1, max_replies=8)
+        board = TwoHSChessBoard()
+        board.position_cache = None
+        replies = likely_replies(board, 8)
+        service.ponder('g', board)
+        service.shutdown()
+        pondered = service.pondered('g')
+        self.assertEqual(len(pondered), 9)
+        board.board.push(replies[-1].move)
+        self.assertIn(position_key(board.board), pondered)
+
+    def test_off_by_default_and_under_gevent(self):
+        with mock.patch.dict(os.environ, {'PONDER_WORKERS': '2'}):
+            self.assertIsNotNone(create_ponder_service())
+            self.assertIsNone(create_ponder_service(cooperative=True))
+        with mock.patch.dict(os.environ, {'PONDER_WORKERS': '0'}):
+            self.assertIsNone(create_ponder_service())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Pushes to WebSocket connections and SSE spectators."""
+import json
+import unittest
+
+from board import TwoHSChessBoard
+from realtime import Connection, GameChannels, SpectatorHub, StateMessages
+
+
+class FakeSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class BroadcastTest(unittest.TestCase):
+
+    def test_each_connection_gets_its_format(self):
+        channels = GameChannels()
+        board = TwoHSChessBoard()
+        full, compact = Connection(FakeSocket()), Connection(FakeSocket(), compact=True)
+        for connection in (full, compact):
+            channels.subscribe('g', connection)
+            messages = StateMessages('g', board)
+            connection.send(messages.compact() if connection.compact else messages.full(), messages.tag)
+
+        board.make_move('e2e4')
+        channels.broadcast('g', StateMessages('g', board))
+        self.assertIn("moveInfo", full.ws.sent[-1])
+        delta = compact.ws.sent[-1]
+        self.assertEqual((delta["since"], delta["ply"]), (0, 1))
+        self.assertNotIn("moves", delta)
+        self.assertEqual(compact.tag, board.state_tag())
+
+        # Out of step after a takeback: the compact state in full
+        board.takeback(1)
+        compact.tag = 'stale'
+        channels.broadcast('g', StateMessages('g', board))
+        self.assertIn("fen", compact.ws.sent[-1])
+
+
+class SpectatorHubTest(unittest.TestCase):
+
+    def test_watched_games_are_not_evicted(self):
+        hub = SpectatorHub()
+        board = TwoHSChessBoard()
+        stream = hub.stream('g0', None, lambda: (0, StateMessages('g0', board)), compact=True)
+        first = next(stream)
+        self.assertIn(b'"fen"', first)
+        self.assertNotIn(b'moveInfo', first)
+        for i in range(1, hub.MAX_GAMES + 10):
+            hub.publish('g%d' % i, 0, StateMessages('g%d' % i, board))
+        self.assertTrue(hub.is_watched('g0'))
+        stream.close()
+        self.assertFalse(hub.has_spectators('g0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
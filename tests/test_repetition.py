@@ -0,0 +1,56 @@
+"""Threefold repetition: incremental Zobrist keys and the game's position history."""
+import json
+import random
+import unittest
+
+import zobrist
+from board import TwoHSChessBoard, board_to_state, board_from_state
+
+# Knights out and back twice: the starting position occurs a third time at ply 8
+THREEFOLD_MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2
+
+
+def replay(moves, fen=TwoHSChessBoard.VARIANT_STARTING_FEN):
+    board = TwoHSChessBoard(fen)
+    for move in moves:
+        assert board.make_move(move), move
+    return board
+
+
+class RepetitionTest(unittest.TestCase):
+
+    def test_third_occurrence_ends_the_game(self):
+        self.assertFalse(replay(THREEFOLD_MOVES[:7]).is_threefold_repetition())
+        board = replay(THREEFOLD_MOVES)
+        self.assertTrue(board.is_threefold_repetition())
+        self.assertEqual(board.game_status().game_over_reason, 'threefold_repetition')
+
+    def test_stored_history_keeps_the_count(self):
+        board = replay(THREEFOLD_MOVES[:7])
+        stored = board_from_state(json.loads(json.dumps(board_to_state(board))))
+        self.assertFalse(stored.is_threefold_repetition())
+        self.assertTrue(stored.make_move('f6g8'))
+        self.assertTrue(stored.is_threefold_repetition())
+
+    def test_captures_clear_the_history_but_pawn_moves_do_not(self):
+        # A King's Step can take a pawn back, so a pawn move is not irreversible
+        board = replay(['e2e4', 'd7d5'])
+        self.assertEqual(len(board.position_history), 3)
+        board.make_move('e4d5')
+        self.assertEqual(board.position_history, [board.zobrist_key])
+
+    def test_pawn_step_back_repeats_a_position(self):
+        board = replay(['e2e3', 'g8f6', 'e3e2', 'f6g8'] * 2)
+        self.assertTrue(board.is_threefold_repetition())
+
+    def test_incremental_keys_match_a_full_hash(self):
+        rng = random.Random(9)
+        for _ in range(10):
+            board = TwoHSChessBoard()
+            while not board.is_game_over() and len(board.move_history) < 100:
+                board.make_move(rng.choice(board.tagged_legal_moves()).move.uci())
+                self.assertEqual(board.zobrist_key, zobrist.zobrist_hash(board.board), board.fen())
+
+
+if __name__ == '__main__':
+    unittest.main()
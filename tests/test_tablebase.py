@@ -0,0 +1,145 @@
+"""
+Endgame tablebases: fixed DTM and WDL values of generated tables, and the
+insufficient material rule they decide.
+
+The KRvK, KNvK and KBvK tables take about a minute to generate, so they are
+generated once into tests/.tablebases and reused by later runs.
+"""
+import os
+import random
+import unittest
+
+import chess
+
+from board import TwoHSChessBoard
+from game_status import is_insufficient_material
+from movegen import generate_moves
+from tablebase import Tablebase, TablebaseError, generate_table, parse_name, table_path
+
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tablebases')
+TABLES = ('KNvK', 'KBvK', 'KRvK')
+
+tablebase = None
+
+
+def setUpModule():
+    global tablebase
+    for name in TABLES:
+        if not os.path.exists(table_path(TABLE_DIR, name)):
+            generate_table(name, TABLE_DIR)
+    tablebase = Tablebase(TABLE_DIR)
+
+
+def tearDownModule():
+    tablebase.close()
+
+
+class ProbeTest(unittest.TestCase):
+
+    def probe(self, fen):
+        result = tablebase.probe(chess.Board(fen))
+        return None if result is None else tuple(result)
+
+    def test_fixed_values(self):
+        self.assertEqual(self.probe('k7/8/1K6/8/8/8/8/7R w - - 0 1'), (1, 1))
+        self.assertEqual(self.probe('R6k/8/6K1/8/8/8/8/8 b - - 0 1'), (-1, 0))
+        self.assertEqual(self.probe('8/8/8/4k3/8/8/8/R3K3 w - - 0 1'), (1, 27))
+        self.assertEqual(self.probe('8/8/8/4k3/8/8/8/R3K3 b - - 0 1'), (-1, 28))
+        # Black takes the undefended rook
+        self.assertEqual(self.probe('k7/1R6/8/8/8/8/8/6K1 b - - 0 1'), (0, None))
+        self.assertEqual(self.probe('k7/8/1K6/8/8/8/8/7N w - - 0 1'), (0, None))
+
+    def test_colours_are_mirrored(self):
+        self.assertEqual(self.probe('r3k3/8/8/8/8/8/8/4K3 b - - 0 1'), self.probe('4k3/8/8/8/8/8/8/R3K3 w - - 0 1'))
+        self.assertEqual(tablebase.adjudicate(chess.Board('7r/8/8/8/8/1k6/8/K7 b - - 0 1')), '0-1')
+
+    def test_uncovered_positions(self):
+        self.assertIsNone(self.probe('4k3/8/8/8/8/8/8/Q3K3 w - - 0 1'))
+        self.assertIsNone(self.probe('4k3/8/8/8/8/8/4P3/R3K3 w - - 0 1'))
+        self.assertIsNone(self.probe('4k3/8/8/8/8/8/8/R3K3 w Q - 0 1'))
+
+    def test_values_agree_with_the_moves(self):
+        # A win in n plies has a move to a loss in n - 1; a loss in n has
+        # only moves to wins, one of them in n - 1
+        rng = random.Random(4)
+        board = chess.Board(None)
+        checked = 0
+        while checked < 200:
+            board.clear_board()
+            squares = rng.sample(chess.SQUARES, 3)
+            for square, symbol in zip(squares, 'KRk'):
+                board.set_piece_at(square, chess.Piece.from_symbol(symbol))
+            board.turn = rng.choice(chess.COLORS)
+            if board.status() != chess.STATUS_VALID:
+                continue
+            wdl, dtm = tablebase.probe(board)
+            children = []
+            for tagged in generate_moves(board):
+                board.push(tagged.move)
+                children.append(tablebase.probe(board))
+                board.pop()
+            if wdl > 0:
+                self.assertIn((-1, dtm - 1), children, board.fen())
+            elif wdl < 0:
+                self.assertTrue(all(child.wdl > 0 and child.dtm <= dtm - 1 for child in children), board.fen())
+                self.assertTrue(dtm == 0 or (1, dtm - 1) in children, board.fen())
+            else:
+                self.assertTrue(not children or any(child.wdl == 0 for child in children), board.fen())
+            checked += 1
+
+    def test_table_names(self):
+        self.assertEqual(parse_name('KRvK'), ('KR', 'K'))
+        for name in ('KPvK', 'KvKR', 'KQRvKR', 'KRK'):
+            with self.assertRaises(TablebaseError):
+                parse_name(name)
+
+
+class CanMateTest(unittest.TestCase):
+
+    def test_can_mate(self):
+        self.assertTrue(tablebase.can_mate(chess.Board('4k3/8/8/8/8/8/8/R3K3 w - - 0 1')))
+        self.assertFalse(tablebase.can_mate(chess.Board('4k3/8/8/8/8/8/8/N3K3 w - - 0 1')))
+        self.assertFalse(tablebase.can_mate(chess.Board('4k3/8/8/8/8/8/8/B3K3 w - - 0 1')))
+        self.assertFalse(tablebase.can_mate(chess.Board('4k3/8/8/8/8/8/8/4K3 w - - 0 1')))
+        # No table, or pawns: unknown
+        self.assertIsNone(tablebase.can_mate(chess.Board('4k3/8/8/8/8/8/8/Q3K3 w - - 0 1')))
+        self.assertIsNone(tablebase.can_mate(chess.Board('4k3/8/8/8/8/8/4P3/4K3 w - - 0 1')))
+
+    def test_insufficient_material_follows_the_tables(self):
+        for fen, insufficient in (('4k3/8/8/8/8/8/8/N3K3 w - - 0 1', True),
+                                  ('4k3/8/8/8/8/8/8/B3K3 w - - 0 1', True),
+                                  ('4k3/8/8/8/8/8/8/R3K3 w - - 0 1', False)):
+            board = chess.Board(fen)
+            self.assertEqual(is_insufficient_material(board, tablebase), insufficient, fen)
+            game_board = TwoHSChessBoard(fen)
+            game_board.position_cache = None
+            game_board.tablebase = tablebase
+            self.assertEqual(game_board.is_insufficient_material(), insufficient, fen)
+
+
+class InsufficientMaterialTest(unittest.TestCase):
+
+    def test_lone_minor_piece_is_a_draw(self):
+        for fen in ('4k3/8/8/8/8/8/8/4K3 w - - 0 1',
+                    '4k3/8/8/8/8/8/4B3/4K3 w - - 0 1',
+                    '4k3/8/8/8/8/8/4n3/4K3 b - - 0 1'):
+            self.assertTrue(is_insufficient_material(chess.Board(fen)), fen)
+            self.assertEqual(TwoHSChessBoard(fen).game_status().game_over_reason, 'insufficient_material')
+
+    def test_same_coloured_bishops_can_still_mate(self):
+        # Drawn in standard chess, but King's Steps let a bishop change colour
+        fen = '8/8/4k3/8/2b5/8/4B3/4K3 w - - 0 1'
+        self.assertTrue(chess.Board(fen).is_insufficient_material())
+        self.assertFalse(is_insufficient_material(chess.Board(fen)))
+        self.assertFalse(TwoHSChessBoard(fen).game_status().is_game_over)
+
+    def test_mating_material(self):
+        for fen in ('4k3/8/8/8/8/8/3NN3/4K3 w - - 0 1',
+                    '4k3/8/8/8/8/8/4R3/4K3 w - - 0 1',
+                    '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1'):
+            self.assertFalse(is_insufficient_material(chess.Board(fen)), fen)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
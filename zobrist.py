@@ -0,0 +1,84 @@
+"""
+Incremental Zobrist hashing for ASHA CHESS positions.
+
+Keys use the Polyglot random numbers, so they cover piece placement, side to
+move, castling rights and en passant rights. The only difference from
+chess.polyglot.zobrist_hash is the en passant rule: here the file is hashed
+when any pawn of the side to move is diagonally next to the en passant square,
+because python-chess also plays a pawn's King's Step diagonally backwards onto
+that square as an en passant capture.
+"""
+import chess
+import chess.polyglot
+
+_RANDOM = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_CASTLING_KEYS = ((chess.BB_H1, _RANDOM[768]), (chess.BB_A1, _RANDOM[769]),
+                  (chess.BB_H8, _RANDOM[770]), (chess.BB_A8, _RANDOM[771]))
+_TURN_KEY = _RANDOM[780]
+_PIECE_BITBOARDS = ('pawns', 'knights', 'bishops', 'rooks', 'queens', 'kings')
+
+
+def _piece_key(piece_type, color, square):
+    return _RANDOM[64 * ((piece_type - 1) * 2 + int(color)) + square]
+
+
+def _castling_key(board):
+    rights = board.clean_castling_rights()
+    key = 0
+    for mask, value in _CASTLING_KEYS:
+        if rights & mask:
+            key ^= value
+    return key
+
+
+def _ep_key(board):
+    ep_square = board.ep_square
+    if ep_square is None:
+        return 0
+    diagonal = chess.BB_PAWN_ATTACKS[chess.WHITE][ep_square] | chess.BB_PAWN_ATTACKS[chess.BLACK][ep_square]
+    if diagonal & board.pawns & board.occupied_co[board.turn]:
+        return _RANDOM[772 + chess.square_file(ep_square)]
+    return 0
+
+
+def _bitboards(board):
+    return tuple(getattr(board, name) for name in _PIECE_BITBOARDS) + (board.occupied_co[chess.WHITE],)
+
+
+def zobrist_hash(board):
+    """Compute the Zobrist key of a position from scratch."""
+    key = 0
+    for square, piece in board.piece_map().items():
+        key ^= _piece_key(piece.piece_type, piece.color, square)
+    key ^= _castling_key(board) ^ _ep_key(board)
+    if board.turn == chess.WHITE:
+        key ^= _TURN_KEY
+    return key
+
+
+def push(board, move, key):
+    """
+    Push a move on the board and return the updated Zobrist key.
+
+    Only the squares whose contents changed are rehashed, which covers
+    captures, en passant, castling and promotions without special cases.
+    """
+    before = _bitboards(board)
+    key ^= _castling_key(board) ^ _ep_key(board)
+
+    board.push(move)
+
+    after = _bitboards(board)
+    changed = 0
+    for old, new in zip(before, after):
+        changed |= old ^ new
+
+    for square in chess.scan_forward(changed):
+        mask = chess.BB_SQUARES[square]
+        for index, (old, new) in enumerate(zip(before[:6], after[:6])):
+            if old & mask:
+                key ^= _piece_key(index + 1, bool(before[6] & mask), square)
+            if new & mask:
+                key ^= _piece_key(index + 1, bool(after[6] & mask), square)
+
+    return key ^ _castling_key(board) ^ _ep_key(board) ^ _TURN_KEY